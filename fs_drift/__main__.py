@@ -30,6 +30,7 @@ import fs_drift.event
 import errno
 import pickle
 import logging
+import socket
 
 import fs_drift.common
 from fs_drift.common import rq, OK, NOTOK
@@ -42,6 +43,7 @@ import fs_drift.launcher_thread
 import fs_drift.sync_files
 import fs_drift.multi_thread_workload
 from fs_drift.sync_files import write_pickle, read_pickle
+from fs_drift.live_stream import LiveStreamCollector, LIVE_RATES_FILENAME
 
 
 def abort_test(prm):
@@ -66,6 +68,21 @@ def run_multi_host_workload(prm, log):
 
     log.debug('python_prog = %s' % python_prog)
 
+    # listen for live counters from hosts before they read test params
+    # to find out where to send them
+
+    collector = None
+    if prm.live_stream_port > 0:
+        try:
+            collector = LiveStreamCollector(prm.host_set, prm.live_interval, log,
+                                            rates_path=os.path.join(prm.network_shared_path, LIVE_RATES_FILENAME),
+                                            port=prm.live_stream_port)
+            prm.live_stream_address = (socket.gethostname(), collector.port)
+            write_pickle(prm.param_pickle_path, prm)
+            collector.start()
+        except OSError as e:
+            log.warning('could not listen on port %d for live counters: %s' % (prm.live_stream_port, str(e)))
+
     remote_thread_list = []
     host_ct = len(prm.host_set)
     for j in range(0, len(prm.host_set)):
@@ -107,6 +124,7 @@ def run_multi_host_workload(prm, log):
 
     hosts_ready = False  # set scope outside while loop
     last_host_seen = -1
+    host_progress = {}
     sec = 0.0
     start_loop_start = time.time()
     try:
@@ -132,6 +150,14 @@ def run_multi_host_workload(prm, log):
             if hosts_ready:
                 break
 
+            # hosts that are still getting ready (--precreate-dirs) restart the timeouts
+
+            if fs_drift.multi_thread_workload.progress_seen(
+                    [fs_drift.multi_thread_workload.gen_host_progress_fname(prm, h.strip())
+                     for h in prm.host_set[last_host_seen + 1:]], host_progress):
+                sec = 0.0
+                start_loop_start = time.time()
+
             # if one of ssh threads has died, no reason to continue
 
             kill_remaining_threads = False
@@ -189,6 +215,8 @@ def run_multi_host_workload(prm, log):
         if t.status != OK:
             log.error('ssh thread for host %s completed with status %d' %
                       (t.remote_host, t.status))
+    if collector != None:
+        collector.stop()
 
     # attempt to aggregate results by reading pickle files
     # containing worker thread instances
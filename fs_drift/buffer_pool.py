@@ -0,0 +1,107 @@
+# buffer_pool.py - page-aligned I/O buffers that are allocated once and reused
+#
+# an anonymous mmap is always page-aligned, which is what O_DIRECT needs,
+# but creating and destroying one per record costs an mmap/munmap pair
+# and a copy of the record contents.  Instead we allocate a few
+# buffers of the largest record size up front and hand out
+# memoryview slices of them to the I/O routines.
+
+import mmap
+import ctypes
+
+from fs_drift.common import FsDriftException
+
+
+# address of a writable buffer object such as an mmap,
+# it stays valid for as long as the mmap is open
+
+def buffer_address(b):
+    c = ctypes.c_char.from_buffer(b)
+    addr = ctypes.addressof(c)
+    del c
+    return addr
+
+
+class AlignedBufferPool:
+
+    def __init__(self, buf_size, count=1):
+        # never allocate less than a page so that a zero-length
+        # record size still yields a usable, aligned buffer
+        self.buf_size = max(buf_size, mmap.PAGESIZE)
+        self.buffers = [mmap.mmap(-1, self.buf_size) for k in range(0, count)]
+        self.views = [memoryview(b) for b in self.buffers]
+        self.addresses = [buffer_address(b) for b in self.buffers]
+        self.free_list = list(range(count - 1, -1, -1))
+
+    def __len__(self):
+        return len(self.buffers)
+
+    # reserve a buffer for exclusive use, returns its index
+
+    def acquire(self):
+        try:
+            return self.free_list.pop()
+        except IndexError:
+            raise FsDriftException('all %d aligned buffers are in use' % len(self.buffers))
+
+    def release(self, index):
+        self.free_list.append(index)
+
+    # return an aligned slice of the first "size" bytes of buffer "index"
+    # this does not copy anything
+
+    def view(self, index, size):
+        if size > self.buf_size:
+            raise FsDriftException('record size %d exceeds aligned buffer size %d' %
+                                   (size, self.buf_size))
+        return self.views[index][0:size]
+
+    # memory address of buffer "index", for passing it to the kernel directly
+
+    def address(self, index):
+        return self.addresses[index]
+
+    # copy contents into buffer "index" starting at offset 0
+
+    def fill(self, index, contents):
+        b = self.buffers[index]
+        b.seek(0)
+        b.write(contents)
+
+    def close(self):
+        for v in self.views:
+            v.release()
+        for b in self.buffers:
+            b.close()
+        self.views = []
+        self.buffers = []
+        self.free_list = []
+        self.addresses = []
+
+
+if __name__ == '__main__':
+    pool = AlignedBufferPool(10000, count=2)
+    assert(len(pool) == 2)
+    assert(pool.buf_size == 10000)
+    i = pool.acquire()
+    j = pool.acquire()
+    assert(i != j)
+    try:
+        pool.acquire()
+        assert(False)
+    except FsDriftException:
+        pass
+    pool.fill(j, b'abcdef')
+    assert(bytes(pool.view(j, 3)) == b'abc')
+    assert(len(pool.view(i, 4096)) == 4096)
+    assert(pool.address(i) % mmap.PAGESIZE == 0 and pool.address(i) != pool.address(j))
+    try:
+        pool.view(i, 10001)
+        assert(False)
+    except FsDriftException:
+        pass
+    pool.release(j)
+    assert(pool.acquire() == j)
+    assert(AlignedBufferPool(0).buf_size == mmap.PAGESIZE)
+    pool.close()
+    print('buffer_pool unit test passed')
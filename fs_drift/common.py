@@ -66,6 +66,83 @@ def FileAccessDistr2str(v):
     raise FsDriftException(
         'file access distribution must be one of: uniform, gaussian')
 
+# random_read and random_write can position each record with lseek()
+# followed by read/write, with a single pread/pwrite,
+# or submit a batch of records per preadv/pwritev call
+
+class IOMode:
+    seek = 0
+    positional = 1
+    vectored = 2
+
+def IOMode2str(v):
+    if v == IOMode.seek:
+        return "seek"
+    elif v == IOMode.positional:
+        return "positional"
+    elif v == IOMode.vectored:
+        return "vectored"
+    raise FsDriftException(
+        'I/O mode must be one of: seek, positional, vectored')
+
+
+class IOEngine:
+    sync = 0
+    io_uring = 1
+
+def IOEngine2str(v):
+    if v == IOEngine.sync:
+        return "sync"
+    elif v == IOEngine.io_uring:
+        return "io_uring"
+    raise FsDriftException(
+        'I/O engine must be one of: sync, io_uring')
+
+
+# whether --target-rate is for each thread or for all threads in the test
+
+class RateScope:
+    thread = 0
+    cluster = 1
+
+def RateScope2str(v):
+    if v == RateScope.thread:
+        return "thread"
+    elif v == RateScope.cluster:
+        return "cluster"
+    raise FsDriftException(
+        'target rate scope must be one of: thread, cluster')
+
+
+# how open-loop op arrivals are spaced
+
+class ArrivalDistr:
+    fixed = 0
+    poisson = 1
+
+def ArrivalDistr2str(v):
+    if v == ArrivalDistr.fixed:
+        return "fixed"
+    elif v == ArrivalDistr.poisson:
+        return "poisson"
+    raise FsDriftException(
+        'arrival distribution must be one of: fixed, poisson')
+
+
+# how response time and bandwidth logs are saved, see sample_log.py
+
+class SampleLogFormat:
+    csv = 0
+    binary = 1
+
+def SampleLogFormat2str(v):
+    if v == SampleLogFormat.csv:
+        return "csv"
+    elif v == SampleLogFormat.binary:
+        return "binary"
+    raise FsDriftException(
+        'sample log format must be one of: csv, binary')
+
 
 # instead of looking up before deletion, do reverse, delete and catch exception
 
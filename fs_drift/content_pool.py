@@ -0,0 +1,185 @@
+# content_pool.py - write data patterns shared by all worker processes on a host
+#
+# every worker process needs the same data to write: the plain data
+# pattern, or the pool of compressible blocks that compressible/dedupable
+# data is streamed from (see random_buffer.py).  Rather than have each of
+# them generate its own copy, run_multi_thread_workload() generates it
+# once per host in a multiprocessing.shared_memory segment, and workers
+# map that segment read-only and write straight out of slices of it.
+#
+# the segment starts with a page-sized header holding the region sizes,
+# so a worker only needs the segment name to attach to it.
+# regions start on page boundaries so O_DIRECT writes stay aligned.
+
+import os
+import mmap
+import struct
+from multiprocessing import shared_memory
+
+import numpy
+
+import fs_drift.random_buffer
+from fs_drift.random_buffer import CONTENT_BLOCK_SIZE, CompressibleStream
+from fs_drift.common import FsDriftException
+
+HEADER_FORMAT = '=8sQQ'
+HEADER_MAGIC = b'fsdpool1'
+
+# POSIX shared memory segments appear here on Linux
+
+SHM_DIR = '/dev/shm'
+
+
+def page_round_up(n):
+    return (n + mmap.PAGESIZE - 1) // mmap.PAGESIZE * mmap.PAGESIZE
+
+
+# address of a buffer object that may be read-only,
+# it stays valid for as long as the buffer is mapped
+
+def readonly_buffer_address(b):
+    return numpy.frombuffer(b, dtype=numpy.uint8).ctypes.data
+
+
+class ContentPool:
+
+    # plain_size bytes of plain data pattern (random if seed is set), or if
+    # compress_ratio or dedupe_pct is set, pool_blocks compressible blocks instead
+
+    def __init__(self, mapping, name, shm=None):
+        self.name = name
+        self.shm = shm
+        self.mapping = mapping
+        (magic, self.plain_size, self.pool_blocks) = struct.unpack_from(HEADER_FORMAT, mapping, 0)
+        if magic != HEADER_MAGIC:
+            raise FsDriftException('%s is not an fs-drift content pool' % name)
+        plain_start = mmap.PAGESIZE
+        pool_start = plain_start + page_round_up(self.plain_size)
+        view = memoryview(mapping)
+        self.plain_view = None
+        self.plain_address = None
+        if self.plain_size > 0:
+            self.plain_view = view[plain_start:plain_start + self.plain_size]
+            self.plain_address = readonly_buffer_address(mapping) + plain_start
+        self.block_pool = None
+        if self.pool_blocks > 0:
+            self.block_pool = numpy.frombuffer(
+                    mapping, dtype=numpy.uint8, count=self.pool_blocks * CONTENT_BLOCK_SIZE,
+                    offset=pool_start).reshape(self.pool_blocks, CONTENT_BLOCK_SIZE)
+
+    @staticmethod
+    def create(plain_size, compress_ratio, dedupe_pct, pool_blocks=CompressibleStream.default_pool_blocks,
+               seed=None):
+        if compress_ratio or dedupe_pct:
+            plain_size = 0
+        else:
+            pool_blocks = 0
+        size = mmap.PAGESIZE + page_round_up(plain_size) + pool_blocks * CONTENT_BLOCK_SIZE
+        shm = shared_memory.SharedMemory(create=True, size=size)
+        try:
+            struct.pack_into(HEADER_FORMAT, shm.buf, 0, HEADER_MAGIC, plain_size, pool_blocks)
+            contents = numpy.frombuffer(shm.buf, dtype=numpy.uint8)
+            start = mmap.PAGESIZE
+            if plain_size > 0:
+                fs_drift.random_buffer.fill_buffer(contents[start:start + plain_size], seed)
+                start += page_round_up(plain_size)
+            if pool_blocks > 0:
+                contents[start:start + pool_blocks * CONTENT_BLOCK_SIZE] = \
+                        fs_drift.random_buffer.gen_block_pool(pool_blocks, compress_ratio).reshape(-1)
+            del contents
+        except Exception:
+            shm.close()
+            shm.unlink()
+            raise
+        return ContentPool(shm.buf, shm.name, shm=shm)
+
+    # map an existing pool read-only, raises OSError if it is not there
+
+    @staticmethod
+    def attach(name):
+        fd = os.open(os.path.join(SHM_DIR, name), os.O_RDONLY)
+        try:
+            mapping = mmap.mmap(fd, 0, prot=mmap.PROT_READ)
+        finally:
+            os.close(fd)
+        return ContentPool(mapping, name)
+
+    # remove the segment name, processes that have it mapped keep their mapping,
+    # only the process that created the pool does this
+
+    def unlink(self):
+        if self.shm != None:
+            self.shm.unlink()
+
+    def close(self):
+        self.plain_view = None
+        self.block_pool = None
+        if self.shm != None:
+            self.shm.close()
+            self.shm = None
+        else:
+            self.mapping.close()
+        self.mapping = None
+
+
+if __name__ == '__main__':
+    import time
+    import multiprocessing
+
+    def child(name, q):
+        p = ContentPool.attach(name)
+        q.put((bytes(p.plain_view[0:4096]), p.plain_address % mmap.PAGESIZE))
+        try:
+            p.plain_view[0:1] = b'x'
+            q.put('writable')
+        except TypeError:
+            q.put('read-only')
+
+    plain_size = (1 << 20) + 12345
+    start = time.perf_counter()
+    pool = ContentPool.create(plain_size, 0.0, 0)
+    print('%d-byte plain pool created in %f sec' % (plain_size, time.perf_counter() - start))
+    try:
+        assert(pool.plain_size == plain_size and pool.block_pool is None)
+        assert(bytes(pool.plain_view) == bytes(fs_drift.random_buffer.gen_buffer(plain_size)))
+        q = multiprocessing.Queue()
+        p = multiprocessing.Process(target=child, args=(pool.name, q))
+        p.start()
+        (first_page, misalignment) = q.get()
+        assert(first_page == bytes(pool.plain_view[0:4096]) and misalignment == 0)
+        assert(q.get() == 'read-only')
+        p.join()
+        attached = ContentPool.attach(pool.name)
+        assert(bytes(attached.plain_view[-100:]) == bytes(pool.plain_view[-100:]))
+        attached.close()
+    finally:
+        pool.unlink()
+        pool.close()
+    pool = ContentPool.create(plain_size, 0.0, 0, seed=3)
+    assert(bytes(pool.plain_view) == bytes(fs_drift.random_buffer.gen_buffer(plain_size, seed=3)))
+    pool.unlink()
+    pool.close()
+    try:
+        ContentPool.attach(pool.name)
+        assert(False)
+    except OSError:
+        pass
+
+    pool = ContentPool.create(plain_size, 4.0, 50, pool_blocks=16)
+    try:
+        attached = ContentPool.attach(pool.name)
+        assert(attached.plain_view is None and attached.block_pool.shape == (16, CONTENT_BLOCK_SIZE))
+        assert(not attached.block_pool.flags.writeable)
+        assert((attached.block_pool == pool.block_pool).all())
+        # only the first quarter of each block is random
+        assert(not attached.block_pool[:, CONTENT_BLOCK_SIZE // 4 + 1:].any())
+        window = mmap.mmap(-1, 8 * CONTENT_BLOCK_SIZE)
+        stream = CompressibleStream(window, 4.0, 50, pool=attached.block_pool)
+        start = stream.locate(0, 4 * CONTENT_BLOCK_SIZE)
+        assert(window[start + 16:start + 1024] == attached.block_pool[0, 16:1024].tobytes())
+        del stream
+        attached.close()
+    finally:
+        pool.unlink()
+        pool.close()
+    print('content_pool unit test passed')
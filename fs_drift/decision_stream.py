@@ -0,0 +1,159 @@
+# decision_stream.py - random decisions for ops, generated in blocks with NumPy
+#
+# every op makes several random choices (op type, file index, file size,
+# record sizes, seek offsets, whether to fsync).  Calling random.randint()
+# or numpy.random.normal() once per choice spends most of its time in
+# interpreter and call overhead, so instead each kind of decision is
+# generated DecisionStream.block_size values at a time by one vectorized
+# NumPy call, and the op functions just take the next value.
+# Callers on a hot path should keep the iterator returned by integers()
+# and call next() on it, which avoids even the method call.
+# A stream must not be shared between threads, each FSOPCtx lane has its own.
+
+import numpy
+
+from fs_drift.common import FsDriftException
+
+
+class DecisionStream:
+
+    block_size = 1 << 16
+
+    # NumPy blocks are handed out as Python numbers this many at a time,
+    # so that a whole block of Python objects never has to exist at once
+
+    chunk_size = 1 << 12
+
+    def __init__(self, block_size=block_size, seed=None):
+        if block_size < 1:
+            raise FsDriftException('decision block size must be positive')
+        self.block_size = block_size
+        self.rng = numpy.random.default_rng(seed)
+        self.int_streams = {}
+        self.uniform_stream = self.blocks(self.rng.random)
+        self.normal_stream = self.blocks(self.rng.standard_normal)
+
+    # generator that calls fill(block_size) for a NumPy array
+    # whenever the previous one has been used up
+
+    def blocks(self, fill):
+        chunk = DecisionStream.chunk_size
+        while True:
+            block = fill(self.block_size)
+            for k in range(0, len(block), chunk):
+                yield from block[k:k+chunk].tolist()
+
+    # iterator over random integers x with lo <= x <= hi, like random.randint(),
+    # rounded down to a multiple of "multiple" (e.g. 4096 for O_DIRECT)
+
+    def integers(self, lo, hi, multiple=1):
+        key = (lo, hi, multiple)
+        try:
+            return self.int_streams[key]
+        except KeyError:
+            if hi < lo:
+                raise FsDriftException('empty range %d-%d' % (lo, hi))
+            if multiple == 1:
+                def fill(n):
+                    return self.rng.integers(lo, hi, size=n, endpoint=True)
+            else:
+                def fill(n):
+                    return (self.rng.integers(lo, hi, size=n, endpoint=True) // multiple) * multiple
+            stream = self.blocks(fill)
+            self.int_streams[key] = stream
+            return stream
+
+    def randint(self, lo, hi, multiple=1):
+        return next(self.integers(lo, hi, multiple))
+
+    # random integer x with 0 <= x <= n for an n that changes from call
+    # to call (e.g. a seek offset within the current file),
+    # uniform to within n/2^53
+
+    def randint_upto(self, n):
+        if n <= 0:
+            return 0
+        return int(next(self.uniform_stream) * (n + 1))
+
+    # uniform float in [0, 1)
+
+    def uniform(self):
+        return next(self.uniform_stream)
+
+    # float from the standard normal distribution
+
+    def normal(self):
+        return next(self.normal_stream)
+
+    # iterator over opcodes drawn from an event.AliasTable,
+    # with the same outcome as calling event.gen_event() each time
+
+    def opcodes(self, alias_table):
+        return self.blocks(lambda n: alias_table.select_many(self.rng.random(n)))
+
+
+if __name__ == '__main__':
+    import time
+    import random
+    import fs_drift.event
+    from fs_drift.common import rq
+
+    ds = DecisionStream(block_size=1000, seed=42)
+    n = 200000
+
+    # integer ranges are inclusive at both ends, like random.randint
+    values = [ds.randint(0, 100) for k in range(0, n)]
+    assert(min(values) == 0 and max(values) == 100)
+    assert(abs(sum(values) / n - 50.0) < 0.5)
+    values = [ds.randint(4096, 65536, multiple=4096) for k in range(0, 5000)]
+    assert(all(v % 4096 == 0 and 4096 <= v <= 65536 for v in values))
+    assert(len(set(values)) >= 15)
+    values = [ds.randint_upto(9) for k in range(0, n)]
+    assert(min(values) == 0 and max(values) == 9)
+    assert(max([values.count(k) for k in range(0, 10)]) < 1.05 * n / 10)
+    assert(ds.randint_upto(0) == 0)
+    assert(isinstance(ds.randint(1, 2), int) and isinstance(ds.uniform(), float))
+    try:
+        ds.randint(2, 1)
+        assert(False)
+    except FsDriftException:
+        pass
+
+    z = numpy.array([ds.normal() for k in range(0, n)])
+    assert(abs(z.mean()) < 0.02 and abs(z.std() - 1.0) < 0.02)
+
+    # opcode shares match those of event.gen_event
+    alias_table = fs_drift.event.AliasTable(fs_drift.event.normalize_weights(
+        {rq.READ: 5.0, rq.CREATE: 3.0, rq.DELETE: 1.0, rq.RENAME: 1.0}))
+    stream = ds.opcodes(alias_table)
+    counts = {}
+    expected = {}
+    for k in range(0, n):
+        x = next(stream)
+        counts[x] = counts.get(x, 0) + 1
+        y = fs_drift.event.gen_event(alias_table)
+        expected[y] = expected.get(y, 0) + 1
+    assert(sorted(counts.keys()) == sorted(expected.keys()))
+    for opcode in counts.keys():
+        assert(abs(counts[opcode] - expected[opcode]) < 0.02 * n)
+
+    # per-decision cost compared with the Python random module
+    ds = DecisionStream()
+    ints = ds.integers(0, 100000)
+    normals = ds.normal_stream
+    n = 1000000
+    for (name, python_way, stream_way) in [
+            ('randint', lambda: random.randint(0, 100000), lambda: next(ints)),
+            ('normal', lambda: numpy.random.normal(loc=5.0, scale=2.0), lambda: 5.0 + 2.0 * next(normals)),
+            ('opcode', lambda: fs_drift.event.gen_event(alias_table), lambda: next(stream))]:
+        start = time.perf_counter()
+        for k in range(0, n // 10):
+            python_way()
+        python_nsec = (time.perf_counter() - start) * 1.0e9 / (n // 10)
+        start = time.perf_counter()
+        for k in range(0, n):
+            stream_way()
+        stream_nsec = (time.perf_counter() - start) * 1.0e9 / n
+        print('%8s: %7.1f nsec/decision per call, %6.1f nsec/decision from stream' %
+              (name, python_nsec, stream_nsec))
+    print('decision_stream unit test passed')
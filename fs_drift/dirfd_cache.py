@@ -0,0 +1,114 @@
+# dirfd_cache.py - keep leaf directories open so ops only resolve the last component
+#
+# with --dirfd-cache N, each thread keeps up to N directory file descriptors
+# open, least recently used ones are closed first.  Ops then call
+# os.open(), os.unlink(), os.rename() etc. with dir_fd= set to the
+# file's directory, so the kernel (and, on a distributed filesystem,
+# the server) only has to look up the final pathname component
+# instead of walking ./dNNNN/dNNNN/... again on every op.
+
+import os
+from collections import OrderedDict
+
+from fs_drift.common import FsDriftException
+
+
+class DirFdCache:
+
+    open_flags = os.O_RDONLY | os.O_DIRECTORY | os.O_CLOEXEC
+
+    def __init__(self, capacity):
+        if capacity < 1:
+            raise FsDriftException('directory fd cache needs room for at least one fd')
+        self.capacity = capacity
+        self.fds = OrderedDict()
+        self.opens = 0
+
+    def __len__(self):
+        return len(self.fds)
+
+    # return an open fd for directory "dirpath", opening it if needed,
+    # raises OSError (e.g. ENOENT) if it cannot be opened
+
+    def get(self, dirpath):
+        fds = self.fds
+        try:
+            fd = fds[dirpath]
+            fds.move_to_end(dirpath)
+            return fd
+        except KeyError:
+            fd = os.open(dirpath, DirFdCache.open_flags)
+            self.opens += 1
+            fds[dirpath] = fd
+            if len(fds) > self.capacity:
+                (_, old_fd) = fds.popitem(last=False)
+                os.close(old_fd)
+            return fd
+
+    # split a pathname into (last component, fd of its directory)
+    # suitable for passing to os.* calls as (name, dir_fd=fd)
+
+    def split(self, path):
+        slash = path.rfind(b'/')
+        if slash < 0:
+            return (path, None)
+        return (path[slash+1:], self.get(path[:slash]))
+
+    # forget a directory whose fd may have gone bad (e.g. ESTALE)
+
+    def invalidate(self, dirpath):
+        fd = self.fds.pop(dirpath, None)
+        if fd != None:
+            try:
+                os.close(fd)
+            except OSError:
+                pass
+
+    # close everything, e.g. before unmounting the filesystem
+
+    def clear(self):
+        for fd in self.fds.values():
+            try:
+                os.close(fd)
+            except OSError:
+                pass
+        self.fds.clear()
+
+
+if __name__ == '__main__':
+    import errno
+    import tempfile
+    with tempfile.TemporaryDirectory() as d:
+        os.chdir(d)
+        for k in range(0, 4):
+            os.makedirs('./d%04d/d0001' % k)
+        cache = DirFdCache(2)
+        (name, dfd) = cache.split(b'./d0000/d0001/f1')
+        assert(name == b'f1' and len(cache) == 1)
+        fd = os.open(name, os.O_CREAT | os.O_WRONLY, dir_fd=dfd)
+        os.close(fd)
+        assert(os.path.isfile('./d0000/d0001/f1'))
+        assert(cache.split(b'./d0000/d0001/f2')[1] == dfd and cache.opens == 1)
+        # least recently used directory is closed when the cache is full
+        cache.get(b'./d0001/d0001')
+        cache.get(b'./d0000/d0001')
+        cache.get(b'./d0002/d0001')
+        assert(len(cache) == 2 and b'./d0001/d0001' not in cache.fds)
+        assert(b'./d0000/d0001' in cache.fds)
+        os.rename(b'f1', b'f3', src_dir_fd=cache.get(b'./d0000/d0001'),
+                  dst_dir_fd=cache.get(b'./d0002/d0001'))
+        assert(os.path.isfile('./d0002/d0001/f3'))
+        assert(os.listdir(cache.get(b'./d0002/d0001')) == ['f3'])
+        assert(os.listdir(cache.get(b'./d0002/d0001')) == ['f3'])
+        try:
+            cache.get(b'./d0009/d0001')
+            assert(False)
+        except OSError as e:
+            assert(e.errno == errno.ENOENT)
+        assert(cache.split(b'f4') == (b'f4', None))
+        cache.invalidate(b'./d0002/d0001')
+        assert(b'./d0002/d0001' not in cache.fds)
+        cache.clear()
+        assert(len(cache) == 0)
+        os.chdir('/')
+    print('dirfd_cache unit test passed')
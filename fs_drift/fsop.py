@@ -7,27 +7,65 @@ import os.path
 import random
 import errno
 import fs_drift.random_buffer
-import numpy  # for gaussian distribution
 import subprocess
-import mmap
 import struct
 from fcntl import ioctl
 import time
+import copy
+import threading
+import stat
 
 # my modules
 import fs_drift.common
-from fs_drift.common import rq, FileAccessDistr, FileSizeDistr
+from fs_drift.common import rq, FileAccessDistr, FileSizeDistr, IOMode, IOEngine
 from fs_drift.common import OK, NOTOK, BYTES_PER_KiB, FD_UNDEFINED, FsDriftException
 from fs_drift.common import myassert
 from fs_drift.fsop_counters import FSOPCounters
+from fs_drift.buffer_pool import AlignedBufferPool
+from fs_drift.decision_stream import DecisionStream
+from fs_drift.path_cache import PathCache
+from fs_drift.dirfd_cache import DirFdCache
+import fs_drift.io_uring
+from fs_drift.simtime import SimTimeState, state_path
 
-link_suffix = '.s'
-hlink_suffix = '.h'
-rename_suffix = '.r'
+# pathnames are bytes, see path_cache.py
+
+link_suffix = b'.s'
+hlink_suffix = b'.h'
+rename_suffix = b'.r'
 
 large_prime = 12373
 
 
+# largest record any op may transfer
+
+def max_record_size(params):
+    recsz = params.record_size
+    if isinstance(recsz, tuple):
+        recsz = recsz[1]
+    return max(recsz, params.max_record_size_kb * BYTES_PER_KiB)
+
+
+# size of the plain data content region, see FSOPCtx.content_rotation_span
+
+def plain_content_size(params):
+    return max_record_size(params) + FSOPCtx.content_rotation_span
+
+
+# with --incompressible the plain data is seeded random bytes
+
+def plain_content_seed(params):
+    if params.incompressible:
+        return fs_drift.random_buffer.incompressible_seed
+    return None
+
+
+# fraction of filesystem blocks in use, from os.statvfs() results
+
+def fs_fullness(fs_stats):
+    return (fs_stats.f_blocks - fs_stats.f_bfree)/float(fs_stats.f_blocks)
+
+
 class FSOPCtx:
 
     opname_to_opcode = {
@@ -65,27 +103,78 @@ class FSOPCtx:
     }
 
     # for gaussian distribution with moving mean, we need to remember simulated time
-    # so we can pick up where we left off with moving mean
+    # so we can pick up where we left off with moving mean, see simtime.py
 
-    SIMULATED_TIME_UNDEFINED = None
     time_save_rate_default = 5  # make this 60 later on
 
-    def __init__(self, params, log, ctrs, onhost, tid):
+    # plain data is written straight out of one pre-filled, aligned content
+    # region that is this much larger than the biggest record, so that
+    # successive records can start at different places in it
+
+    content_rotation_span = 1 << 20
+
+    # content_pool, if given, is the per-host content_pool.ContentPool
+    # that write data comes from instead of a private copy
+
+    def __init__(self, params, log, ctrs, onhost, tid, content_pool=None):
         self.ctrs = ctrs
         self.params = params
         self.log = log
         self.onhost = onhost
         self.tid = tid
-        self.buf = fs_drift.random_buffer.gen_buffer(params.max_record_size_kb*BYTES_PER_KiB)
+        self.init_decisions()
+        self.max_recsz = self.max_record_size()
+        self.uring = None
+        # every data-path op reads into this page-aligned buffer,
+        # vectored and io_uring reads need one buffer per record in a batch
+        iov_count = 1
+        if self.params.io_mode == IOMode.vectored or self.params.io_engine == IOEngine.io_uring:
+            iov_count = self.params.iov_batch
+        self.bufpool = AlignedBufferPool(self.max_recsz, count=iov_count)
+        self.iov_rdbufs = [self.bufpool.acquire() for k in range(0, iov_count)]
+        self.rdbuf = self.iov_rdbufs[0]
+        # and writes from memoryview slices of this one,
+        # which holds the plain data pattern (in the shared content pool
+        # if there is one), or is a window that compressible/dedupable
+        # data is streamed through
+        self.content = None
+        self.content_salt = 0
+        self.content_stream = None
+        self.content_registered = False
+        block_pool = None
+        if content_pool != None:
+            block_pool = content_pool.block_pool
+        if self.params.compress_ratio or self.params.dedupe_pct:
+            self.start_content_stream(block_pool)
+        elif content_pool != None and content_pool.plain_size >= plain_content_size(self.params):
+            self.content_view = content_pool.plain_view
+            self.content_address = content_pool.plain_address
+            self.content_size = content_pool.plain_size
+        else:
+            self.alloc_content_region(plain_content_size(self.params))
+            fs_drift.random_buffer.fill_buffer(self.content.buffers[0], plain_content_seed(self.params))
+        if self.params.io_engine == IOEngine.io_uring:
+            self.uring = self.start_uring()
         self.total_dirs = 1
         self.verbosity = self.params.verbosity
-        self.measured_bw = None
+        self.measured_io = None
         for i in range(0, self.params.levels):
             self.total_dirs *= self.params.subdirs_per_dir
         self.max_files_per_dir = self.params.max_files // self.total_dirs
         if self.max_files_per_dir == 0:
             self.log.debug('Setting of max-files too low with number of dirs and levels, raising to one per dir')
             self.max_files_per_dir = 1
+        self.paths = PathCache(self.params.levels, self.params.subdirs_per_dir,
+                               self.max_files_per_dir, self.params.max_files)
+        # leaf directories that are known to exist, so creates
+        # need not check for them, see precreate_dirs()
+        self.known_dirs = set()
+        self.dirs_precreated = False
+        self.dirfds = None
+        if self.params.dirfd_cache > 0:
+            self.dirfds = DirFdCache(self.params.dirfd_cache)
+        # --iodepth lanes made from this context, see make_lane()
+        self.lanes = []
         # most recent center
         self.center = self.params.max_files * random.random() * 0.99
         # since mean of random.random() is 0.5, threads' average
@@ -96,13 +185,35 @@ class FSOPCtx:
         # low but occasionally it will be high when one thread catches up to another's
         # moving gaussian distribution.
         self.velocity = self.params.mean_index_velocity * 2.0 * random.random()
-        self.simulated_time = FSOPCtx.SIMULATED_TIME_UNDEFINED  # initialized later
+        self.simulated_time = 0
         self.time_save_rate = FSOPCtx.time_save_rate_default
-        self.simtime_pathname = os.path.join(self.params.network_shared_path,
-                                             'fs-drift-simtime-hst-%s-thrd-%s.tmp' % (self.onhost, self.tid))
+        self.simtime = None
+        if self.params.random_distribution == FileAccessDistr.gaussian:
+            self.resume_simulated_time()
         self.fs_fullness = 0.0
         self.fs_stats = None
         self.get_fs_stats()
+        self.init_rqmap()
+        if self.params.random_distribution != fs_drift.common.FileAccessDistr.uniform:
+            self.log.info('velocity=%f, stddev=%f, center=%f' % (self.velocity, self.params.gaussian_stddev, self.center))
+
+#        if self.params.directIO and self.params.max_record_size_kb < 4:
+#            self.log.debug('record size too low for directIO, raising to 4KiB')
+#            self.params.max_record_size_kb = 4
+
+        if self.params.directIO and self.params.max_file_size_kb < 4:
+            self.log.debug('file size too low for directIO, raising to 4KiB')
+            self.params.max_file_size_kb = 4
+
+        if self.params.rawdevice != None:
+            #Open testing device and keep file descriptor
+            self.rawdevice_fd = os.open(self.params.rawdevice, os.O_RDWR | os.O_DIRECT * self.params.directIO)
+            self.rawdevice_f = os.fdopen(self.rawdevice_fd, 'rb', 0)
+            #Get device size by seeking the end, then set coursor to offset 0
+            self.rawdevice_size = os.lseek(self.rawdevice_fd, 0, os.SEEK_END)
+            os.lseek(self.rawdevice_fd, 0, os.SEEK_SET)
+
+    def init_rqmap(self):
         self._rqmap = {
             rq.READ:        self.op_read,
             rq.RANDOM_READ: self.op_random_read,
@@ -119,24 +230,149 @@ class FSOPCtx:
             rq.RANDOM_DISCARD: self.op_random_discard,
             rq.WRITE:       self.op_write,
             }
-        if self.params.random_distribution != fs_drift.common.FileAccessDistr.uniform:
-            self.log.info('velocity=%f, stddev=%f, center=%f' % (self.velocity, self.params.gaussian_stddev, self.center))
 
-#        if self.params.directIO and self.params.max_record_size_kb < 4:
-#            self.log.debug('record size too low for directIO, raising to 4KiB')
-#            self.params.max_record_size_kb = 4
+    # for --iodepth, several ops run at once in "lanes", which are
+    # copies of this context with their own counters, buffers and
+    # bandwidth measurement.  File selection state (e.g. the moving
+    # gaussian center) stays shared, so it is serialized with a lock.
+
+    def share_file_selection(self):
+        lock = threading.Lock()
+        unlocked_gen_random_fn = self.gen_random_fn
+
+        def locked_gen_random_fn(is_create=False):
+            with lock:
+                return unlocked_gen_random_fn(is_create)
+
+        self.gen_random_fn = locked_gen_random_fn
+
+    def make_lane(self):
+        lane = copy.copy(self)
+        lane.lanes = []
+        self.lanes.append(lane)
+        lane.ctrs = FSOPCounters()
+        lane.measured_io = None
+        lane.init_decisions()
+        if self.dirfds != None:
+            lane.dirfds = DirFdCache(self.params.dirfd_cache)
+        iov_count = len(self.iov_rdbufs)
+        lane.bufpool = AlignedBufferPool(self.max_recsz, count=iov_count)
+        lane.iov_rdbufs = [lane.bufpool.acquire() for k in range(0, iov_count)]
+        lane.rdbuf = lane.iov_rdbufs[0]
+        # plain data content region is read-only and can be shared,
+        # compressible data is streamed through it so each lane needs its own
+        # (the block pool it is generated from is read-only and shared)
+        # io_uring rings must not be shared between threads
+        lane.uring = None
+        if self.content_stream != None:
+            lane.content = None
+            lane.start_content_stream(self.content_stream.pool)
+        if self.uring != None:
+            lane.uring = lane.start_uring()
+        lane.init_rqmap()
+        return lane
+
+    # random decisions are generated in blocks (see decision_stream.py),
+    # the ones with fixed ranges are bound to iterators up front
+
+    def init_decisions(self):
+        self.decisions = DecisionStream()
+        p = self.params
+        alignment = 4096 if p.directIO else 1
+        self.file_index_stream = self.decisions.integers(0, p.max_files)
+        self.fsync_pct_stream = self.decisions.integers(0, 100)
+        self.content_salt_stream = self.decisions.integers(0, FSOPCtx.content_rotation_span)
+        self.file_size_stream = None
+        if isinstance(p.file_size, tuple):
+            self.file_size_stream = self.decisions.integers(p.file_size[0], p.file_size[1], alignment)
+        self.record_size_stream = None
+        if isinstance(p.record_size, tuple):
+            self.record_size_stream = self.decisions.integers(p.record_size[0], p.record_size[1], alignment)
+
+    # with --io-engine io_uring every context gets its own ring,
+    # if the kernel refuses we carry on with synchronous syscalls
+
+    def start_uring(self):
+        try:
+            uring = fs_drift.io_uring.IoUring(2 * self.params.iov_batch)
+        except OSError as e:
+            self.log.warning('io_uring unavailable (%s), using synchronous I/O' % os.strerror(e.errno))
+            return None
+        if not (uring.supports(fs_drift.io_uring.op.READ) and uring.supports(fs_drift.io_uring.op.WRITE)):
+            self.log.warning('io_uring cannot read or write on this kernel, using synchronous I/O')
+            uring.close()
+            return None
+        self.register_uring_buffers(uring)
+        return uring
+
+    # read buffers and the content region are registered with the ring
+    # so the kernel does not have to map them again for every record,
+    # buffer index k is iov_rdbufs[k] and the last one is the content region,
+    # unless it is in the read-only shared content pool, which the kernel
+    # will not pin, in which case writes use an unregistered buffer
+
+    def register_uring_buffers(self, uring):
+        regions = [(self.bufpool.address(k), self.bufpool.buf_size) for k in self.iov_rdbufs]
+        self.content_registered = (self.content != None)
+        if self.content_registered:
+            regions.append((self.content_address, self.content_size))
+        try:
+            uring.register_buffers(regions)
+        except OSError as e:
+            self.log.info('could not register io_uring buffers (%s), using unregistered buffers' %
+                          os.strerror(e.errno))
 
-        if self.params.directIO and self.params.max_file_size_kb < 4:
-            self.log.debug('file size too low for directIO, raising to 4KiB')
-            self.params.max_file_size_kb = 4
+    # with --dirfd-cache, pathnames are resolved relative to an
+    # already-open fd for their directory, at() returns the
+    # (name, dir_fd) pair to pass to os.* calls, dir_fd is None otherwise
 
-        if self.params.rawdevice != None:
-            #Open testing device and keep file descriptor
-            self.rawdevice_fd = os.open(self.params.rawdevice, os.O_RDWR | os.O_DIRECT * self.params.directIO)
-            self.rawdevice_f = os.fdopen(self.rawdevice_fd, 'rb', 0)
-            #Get device size by seeking the end, then set coursor to offset 0
-            self.rawdevice_size = os.lseek(self.rawdevice_fd, 0, os.SEEK_END)
-            os.lseek(self.rawdevice_fd, 0, os.SEEK_SET)
+    def at(self, fn):
+        if self.dirfds == None:
+            return (fn, None)
+        return self.dirfds.split(fn)
+
+    # after ESTALE, the cached directory fd may be the stale one
+
+    def forget_dirfd(self, fn):
+        if self.dirfds != None:
+            self.dirfds.invalidate(os.path.dirname(fn))
+
+    def is_file(self, fn):
+        try:
+            (name, dir_fd) = self.at(fn)
+            return stat.S_ISREG(os.stat(name, dir_fd=dir_fd).st_mode)
+        except (OSError, ValueError):
+            return False
+
+    def exists(self, fn):
+        try:
+            (name, dir_fd) = self.at(fn)
+            os.stat(name, dir_fd=dir_fd)
+            return True
+        except (OSError, ValueError):
+            return False
+
+    def open_fd(self, fn, flags):
+        (name, dir_fd) = self.at(fn)
+        if self.uring != None and self.uring.supports(fs_drift.io_uring.op.OPENAT):
+            if dir_fd == None:
+                dir_fd = fs_drift.io_uring.AT_FDCWD
+            return self.uring.open(name, flags, dir_fd=dir_fd)
+        return os.open(name, flags, dir_fd=dir_fd)
+
+    def close_fd(self, fd):
+        if self.uring != None and self.uring.supports(fs_drift.io_uring.op.CLOSE):
+            self.uring.run(self.uring.prep_close(fd))
+        else:
+            os.close(fd)
+
+    def sync_fd(self, fd, datasync=False):
+        if self.uring != None:
+            self.uring.run(self.uring.prep_fsync(fd, datasync))
+        elif datasync:
+            os.fdatasync(fd)
+        else:
+            os.fsync(fd)
 
     # clients invoke functions by workload request type code
     # instead of by function name, using this:
@@ -144,8 +380,11 @@ class FSOPCtx:
     def invoke_rq(self, rqcode):
         return self._rqmap[rqcode]()
 
+    # pathnames are bytes, so decode them for the message
+
     def scallerr(self, msg, fn, syscall_exception, fd=None):
         self.log.exception(syscall_exception)
+        fn = os.fsdecode(fn)
         try:
             err = syscall_exception.errno
             if fd == None:
@@ -162,7 +401,11 @@ class FSOPCtx:
 
     def get_fs_stats(self):
         self.fs_stats = os.statvfs(self.params.top_directory)
-        self.fs_fullness = (self.fs_stats.f_blocks - self.fs_stats.f_bfree)/float(self.fs_stats.f_blocks)
+        self.fs_fullness = fs_fullness(self.fs_stats)
+        # --iodepth lanes have their own copy, so creates there see it too
+        for lane in self.lanes:
+            lane.fs_stats = self.fs_stats
+            lane.fs_fullness = self.fs_fullness
 
     def fs_is_full(self):
         if self.fs_fullness * 100.0 > self.params.fullness_limit_pct:
@@ -182,50 +425,39 @@ class FSOPCtx:
     # for the dirname, and the least significant portion for
     # the filename within the directory.
 
+    # the path cache does the arithmetic and remembers the result
+
     def gen_random_dirname(self, file_index):
-        subdirs_per_dir = self.params.subdirs_per_dir
-        d = '.'
-        # divide by max_files_per_dir so that we're computing
-        # the directory path on a different part of the
-        # random number than the part used to compute the filename
-        index = file_index // self.max_files_per_dir
-        for j in range(0, self.params.levels):
-            subdir_index = 1 + (index % subdirs_per_dir)
-            dname = 'd%04d' % subdir_index
-            d = os.path.join(d, dname)
-            index /= subdirs_per_dir
-        return d
-
-    def read_num_from_file(f):
-        return f.readline().strip()
+        return self.paths.dirname(file_index)
+
+    # pick up where the last run of this thread left off
+
+    def resume_simulated_time(self):
+        self.simtime = SimTimeState(state_path(self.params, self.onhost, self.tid))
+        state = self.simtime.load()
+        if state != None:
+            (self.simulated_time, self.center, self.velocity) = state
+        self.log.info('resuming with simulated time %d' % self.simulated_time)
+
+    def add_to_simulated_time(self, t):
+        self.simulated_time += t
+
+    # called when the thread is done
+
+    def save_simulated_time(self):
+        if self.simtime != None:
+            self.simtime.store(self.simulated_time, self.center, self.velocity)
+            self.simtime.close()
+            self.simtime = None
 
     def gen_random_fn(self, is_create=False):
         if self.params.rawdevice != None:
             return self.params.rawdevice
         if self.params.random_distribution == FileAccessDistr.uniform:
             # lower limit 0 means at least 1 file/dir
-            index = random.randint(0, self.params.max_files)
+            index = next(self.file_index_stream)
         elif self.params.random_distribution == FileAccessDistr.gaussian:
 
-            # if simulated time is not defined,
-            # attempt to read it in from a file, set to zero if no file
-
-            if self.simulated_time == FSOPCtx.SIMULATED_TIME_UNDEFINED:
-                try:
-                    with open(self.simtime_pathname, 'r') as readtime_fd:
-                        version = int(read_num_from_file(readtime_fd))
-                        if version != 1:
-                            raise FsDriftException('unrecognized version %d in simtime file' % version)
-                        self.simulated_time = int(read_num_from_file(readtime_fd))
-                        self.center = float(read_num_from_file(readtime_fd))
-                        self.velocity = float(read_num_from_file(readtime_fd))
-                except IOError as e:
-                    if e.errno != errno.ENOENT:
-                        raise e
-                    self.simulated_time = 0
-                self.center = self.center + (self.simulated_time * self.velocity)
-                self.log.info('resuming with simulated time %d' % self.simulated_time)
-
             # for creates, use greater time, so that reads, etc. will "follow" creates most of the time
             # mean and std deviation define gaussian distribution
 
@@ -234,8 +466,7 @@ class FSOPCtx:
                 self.center += (self.params.create_stddevs_ahead * self.params.gaussian_stddev)
             if self.verbosity & 0x20:
                 self.log.debug('%f = center' % self.center)
-            index_float = numpy.random.normal(
-                loc=self.center, scale=self.params.gaussian_stddev)
+            index_float = self.center + self.params.gaussian_stddev * next(self.decisions.normal_stream)
             self.log.debug('index_float = %f' % index_float)
             file_opstr = 'read'
             if is_create:
@@ -250,44 +481,208 @@ class FSOPCtx:
             if self.params.drift_time == -1:
                 self.simulated_time += 1
             if self.simulated_time % self.time_save_rate == 0:
-                simtime_dir = os.path.dirname(self.simtime_pathname)
-                if not os.path.exists(simtime_dir):
-                    os.makedirs(simtime_dir)
-                with open(self.simtime_pathname, 'w') as time_fd:
-                    time_fd.write('1\n')  # version
-                    time_fd.write('%10d\n' % self.simulated_time)
-                    time_fd.write('%f\n' % self.center)
-                    time_fd.write('%f\n' % self.velocity)
+                self.simtime.store(self.simulated_time, self.center, self.velocity)
         else:
             raise FsDriftException('invalid distribution type %d' % self.params.random_distribution)
         if self.verbosity & 0x20:
             self.log.debug('next file index %u out of %u' % (index, self.max_files_per_dir))
-        dirpath = self.gen_random_dirname(index)
-        fn = os.path.join(dirpath, 'f%09d' % index)
+        fn = self.paths.path(index)
         if self.verbosity & 0x20:
-            self.log.debug('next pathname %s' % fn)
+            self.log.debug('next pathname %s' % os.fsdecode(fn))
         return fn
 
+    # with --precreate-dirs, every thread on every host creates
+    # its share ("slot" out of "slots") of the leaf directories before
+    # the test starts, after which creates skip the directory check
+
+    # progress, if not None, is called every few hundred directories
+
+    def precreate_dirs(self, slot, slots, progress=None):
+        created = 0
+        for dir_index in range(slot, self.total_dirs, slots):
+            subdir = self.paths.compute_dirname(dir_index)
+            try:
+                os.makedirs(subdir)
+                created += 1
+            except OSError as e:
+                if e.errno != errno.EEXIST:
+                    raise e
+            if progress != None and dir_index % (256 * slots) == slot:
+                progress()
+        self.dirs_precreated = True
+        self.log.info('created %d of %d directories' % (created, self.total_dirs))
+        return created
+
     def random_file_size(self):
         #In case user inputs range, do random file size
-        if isinstance(self.params.file_size, tuple):
-            file_size = random.randint(self.params.file_size[0], self.params.file_size[1])
-        else:
-            file_size = self.params.file_size
+        if self.file_size_stream != None:
+            return next(self.file_size_stream)
+        file_size = self.params.file_size
         if self.params.directIO:
             return (file_size // 4096) * 4096
         return file_size
 
     def random_record_size(self):
         #In case user inputs range, do random file size
-        if isinstance(self.params.record_size, tuple):
-            recsz = random.randint(self.params.record_size[0], self.params.record_size[1])
-        else:
-            recsz = self.params.record_size
+        if self.record_size_stream != None:
+            return next(self.record_size_stream)
+        recsz = self.params.record_size
         if self.params.directIO:
             return (recsz // 4096) * 4096
         return recsz
 
+    # largest record that any op can ask for, in bytes
+
+    def max_record_size(self):
+        return max_record_size(self.params)
+
+    # compressible/dedupable data is generated a window at a time
+    # (see random_buffer.CompressibleStream), the window holds the largest
+    # batch of records that is written at once plus the partial block
+    # in front of it, so memory use does not grow with file size
+
+    def start_content_stream(self, pool=None):
+        max_records = 1
+        if self.params.io_mode == IOMode.vectored or self.params.io_engine == IOEngine.io_uring:
+            max_records = self.params.iov_batch
+        block_size = fs_drift.random_buffer.CONTENT_BLOCK_SIZE
+        self.alloc_content_region(max_records * self.max_recsz + block_size)
+        self.content_stream = fs_drift.random_buffer.CompressibleStream(
+                self.content.buffers[0], self.params.compress_ratio, self.params.dedupe_pct, pool=pool)
+
+    def alloc_content_region(self, size):
+        if self.content != None:
+            if self.content.buf_size >= size:
+                return
+            self.content.close()
+        self.content = AlignedBufferPool(size)
+        self.content_view = self.content.views[0]
+        self.content_address = self.content.address(0)
+        self.content_size = self.content.buf_size
+        if self.uring != None:
+            self.register_uring_buffers(self.uring)
+
+    # called once at the start of every write op
+    # plain data only needs a new starting point in the content region,
+    # compressible/dedupable data starts a new stream, which is
+    # generated into the content region as records are written
+
+    def prepare_write_content(self, target_sz):
+        if self.content_stream != None:
+            self.content_stream.restart()
+        else:
+            self.content_salt = next(self.content_salt_stream)
+
+    # records that are submitted together must all be in the
+    # content region at the same time, so a streamed window is
+    # positioned for the whole batch before any of it is used
+
+    def prepare_write_batch(self, buf_offset, batch_size):
+        if self.content_stream != None:
+            self.content_stream.locate(buf_offset, batch_size)
+
+    # return where in the content region the next record to write starts
+    # plain data rotates through the content region so that
+    # dedupe-sensitive targets do not see the same bytes in every record,
+    # with O_DIRECT the starting point stays on a 4-KiB boundary
+    # so the buffer stays aligned
+
+    def write_record_start(self, buf_offset, recsz):
+        if self.content_stream != None:
+            return self.content_stream.locate(buf_offset, recsz)
+        rotation = (buf_offset + self.content_salt) % FSOPCtx.content_rotation_span
+        if self.params.directIO:
+            rotation -= rotation % 4096
+        return rotation
+
+    # return a memoryview of the next record to write, no data is copied
+
+    def write_record_buf(self, buf_offset, recsz):
+        start = self.write_record_start(buf_offset, recsz)
+        return self.content_view[start:start+recsz]
+
+    # sizes of the records that are submitted together,
+    # one per syscall unless --io-mode vectored or io_uring is used,
+    # never transferring more than "remaining" bytes
+
+    def next_record_batch(self, remaining):
+        max_records = 1
+        if self.params.io_mode == IOMode.vectored or self.uring != None:
+            max_records = self.params.iov_batch
+        batch = []
+        batch_size = 0
+        while len(batch) < max_records and batch_size < remaining:
+            record_size = self.random_record_size()
+            if record_size + batch_size > remaining:
+                record_size = remaining - batch_size
+            batch.append(record_size)
+            batch_size += record_size
+        return batch
+
+    # io_uring data path: hand the kernel up to --iov-batch records at once,
+    # each at the file offset that next_offset(record_size) picks,
+    # then reap all their completions.
+    # returns (bytes transferred, records, seconds from submit to last completion)
+
+    def uring_records(self, fd, target_size, is_write, next_offset, buf_offset=0):
+        u = self.uring
+        fixed = u.fixed_buffers > 0
+        content_index = None
+        if fixed and self.content_registered:
+            content_index = len(self.iov_rdbufs)
+        total_count = 0
+        records = 0
+        precise_time = 0.0
+        while total_count < target_size:
+            batch = self.next_record_batch(target_size - total_count)
+            if is_write:
+                self.prepare_write_batch(buf_offset, sum(batch))
+            for k in range(0, len(batch)):
+                off = next_offset(batch[k])
+                if is_write:
+                    start = self.write_record_start(buf_offset, batch[k])
+                    buf_offset += batch[k]
+                    u.prep_write(fd, self.content_address + start, batch[k], off,
+                                 buf_index=content_index)
+                else:
+                    u.prep_read(fd, self.bufpool.address(self.iov_rdbufs[k]), batch[k], off,
+                                buf_index=(k if fixed else None))
+            completions = u.complete_all()
+            precise_time += (max([cmp.complete_time for cmp in completions]) -
+                             min([cmp.submit_time for cmp in completions]))
+            records += len(batch)
+            short = False
+            for k in range(0, len(completions)):
+                count = completions[k].check()
+                if is_write:
+                    myassert(count == batch[k])
+                elif count < batch[k]:
+                    short = True
+                total_count += count
+            if short:
+                break
+        return (total_count, records, precise_time)
+
+    # sequential transfer starts at the current file offset (which only
+    # matters for --rawdevice) and records follow each other
+
+    def uring_sequential(self, fd, target_size, is_write):
+        pos = 0
+        if self.params.rawdevice != None:
+            pos = os.lseek(fd, 0, os.SEEK_CUR)
+        start_pos = pos
+
+        def next_offset(record_size):
+            nonlocal pos
+            off = pos
+            pos += record_size
+            return off
+
+        result = self.uring_records(fd, target_size, is_write, next_offset)
+        if self.params.rawdevice != None:
+            os.lseek(fd, start_pos + result[0], os.SEEK_SET)
+        return result
+
     def random_segment_size(self, filesz):
         segsize = 2 * self.random_record_size()
         if segsize > filesz:
@@ -298,8 +693,8 @@ class FSOPCtx:
 
     def random_seek_offset(self, filesz):
         if self.params.directIO:
-            return random.randint(0, int((filesz)/4096))*4096
-        return random.randint(0, filesz)
+            return self.decisions.randint_upto(int((filesz)/4096))*4096
+        return self.decisions.randint_upto(filesz)
 
     def try_to_close(self, closefd, filename, f=None):
         if self.params.rawdevice != None:
@@ -314,7 +709,7 @@ class FSOPCtx:
                 return self.scallerr('close', filename, e, fd=closefd)
         elif closefd != FD_UNDEFINED:
             try:
-                os.close(closefd)
+                self.close_fd(closefd)
             except OSError as e:
                 if self.params.tolerate_stale_fh and e.errno == errno.ESTALE:
                     self.ctrs.e_stale_fh += 1
@@ -333,43 +728,42 @@ class FSOPCtx:
         buf_offset = 0
         precise_time = 0
         total_count = 0
-        if self.params.compress_ratio or self.params.dedupe_pct:
-            self.buf = fs_drift.random_buffer.gen_compressible_buffer(target_sz, self.params.compress_ratio, self.params.dedupe_pct)
+        self.prepare_write_content(target_sz)
         if self.verbosity & 0x8000:
-            self.log.debug('write %s size %s' % (fn, target_sz))
+            self.log.debug('write %s size %s' % (os.fsdecode(fn), target_sz))
         try:
             if self.params.rawdevice != None:
                 fd = self.rawdevice_fd
             else:
-                fd = os.open(fn, os.O_WRONLY | os.O_DIRECT * self.params.directIO)
-            total_written = 0
-            while total_written < target_sz:
-                recsz = self.random_record_size()
-                if recsz + total_written > target_sz:
-                    recsz = target_sz - total_written
-                myassert(recsz > 0)
-                if self.verbosity & 0x8000:
-                    self.log.debug('write record size %u' % (recsz))
-                #using mmap for memory alignment
-                m = mmap.mmap(-1, recsz)
-                if self.params.compress_ratio or self.params.dedupe_pct:
-                    m.write(self.buf[buf_offset:buf_offset+recsz])
-                else:
-                    m.write(self.buf[0:recsz])
-                start = time.perf_counter()
-                count = os.write(fd, m)
-                end = time.perf_counter()
-                precise_time += float(end - start)
-                myassert(count == recsz)
-                total_written += count
-                c.write_requests += 1
-                c.write_bytes += count
-                buf_offset += count
-                total_count += count
+                fd = self.open_fd(fn, os.O_WRONLY | os.O_DIRECT * self.params.directIO)
+            if self.uring != None:
+                (total_count, records, precise_time) = self.uring_sequential(fd, target_sz, True)
+                c.write_requests += records
+                c.write_bytes += total_count
+            else:
+                total_written = 0
+                while total_written < target_sz:
+                    recsz = self.random_record_size()
+                    if recsz + total_written > target_sz:
+                        recsz = target_sz - total_written
+                    myassert(recsz > 0)
+                    if self.verbosity & 0x8000:
+                        self.log.debug('write record size %u' % (recsz))
+                    m = self.write_record_buf(buf_offset, recsz)
+                    start = time.perf_counter()
+                    count = os.write(fd, m)
+                    end = time.perf_counter()
+                    precise_time += float(end - start)
+                    myassert(count == recsz)
+                    total_written += count
+                    c.write_requests += 1
+                    c.write_bytes += count
+                    buf_offset += count
+                    total_count += count
             rc = self.maybe_fsync(fd)
             c.have_appended += 1
             if total_count:
-                self.measured_bw = total_count / precise_time
+                self.measured_io = (total_count, precise_time)
         except OSError as e:
             if e.errno == errno.ENOENT:
                 c.e_file_not_found += 1
@@ -377,6 +771,7 @@ class FSOPCtx:
                 c.e_no_space += 1
             elif e.errno == errno.ESTALE and self.params.tolerate_stale_fh:
                 c.e_stale_fh += 1
+                self.forget_dirfd(fn)
                 return NOTOK
             else:
                 return self.scallerr('write', fn, e, fd=fd)
@@ -391,13 +786,14 @@ class FSOPCtx:
         fn = self.gen_random_fn()
         try:
             if self.verbosity & 0x20000:
-                self.log.debug('read file %s' % fn)
+                self.log.debug('read file %s' % os.fsdecode(fn))
             if self.params.rawdevice != None:
                 fd = self.rawdevice_fd
                 f = self.rawdevice_f
             else:
-                fd = os.open(fn, os.O_RDONLY | os.O_DIRECT * self.params.directIO)
-                f = os.fdopen(fd, 'rb', 0)
+                fd = self.open_fd(fn, os.O_RDONLY | os.O_DIRECT * self.params.directIO)
+                if self.uring == None:
+                    f = os.fdopen(fd, 'rb', 0)
             file_size = self.get_file_size(fd)
             target_size = self.random_file_size()
             if target_size > file_size:
@@ -406,30 +802,35 @@ class FSOPCtx:
                 self.log.debug('read file sz %u' % target_size)
             total_count = 0
             precise_time = 0
-            while total_count < target_size:
-                rdsz = self.random_record_size()
-                #using mmap for correct memory alignment
-                bytebuf = mmap.mmap(-1, rdsz)
-                start = time.perf_counter()
-                count = f.readinto(bytebuf)
-                end = time.perf_counter()
-                precise_time += float(end - start)
-                if count < 1:
-                    break
-                c.read_requests += 1
-                c.read_bytes += count
-                if self.verbosity & 0x4000:
-                    self.log.debug('seq. read off %u sz %u got %u' %
-                                   (total_count, rdsz, count))
-                total_count += count
+            if self.uring != None:
+                (total_count, records, precise_time) = self.uring_sequential(fd, target_size, False)
+                c.read_requests += records
+                c.read_bytes += total_count
+            else:
+                while total_count < target_size:
+                    rdsz = self.random_record_size()
+                    bytebuf = self.bufpool.view(self.rdbuf, rdsz)
+                    start = time.perf_counter()
+                    count = f.readinto(bytebuf)
+                    end = time.perf_counter()
+                    precise_time += float(end - start)
+                    if count < 1:
+                        break
+                    c.read_requests += 1
+                    c.read_bytes += count
+                    if self.verbosity & 0x4000:
+                        self.log.debug('seq. read off %u sz %u got %u' %
+                                       (total_count, rdsz, count))
+                    total_count += count
             c.have_read += 1
             if total_count:
-                self.measured_bw = total_count / precise_time
+                self.measured_io = (total_count, precise_time)
         except OSError as e:
             if e.errno == errno.ENOENT:
                 c.e_file_not_found += 1
             elif e.errno == errno.ESTALE and self.params.tolerate_stale_fh:
                 c.e_stale_fh += 1
+                self.forget_dirfd(fn)
                 return NOTOK
             else:
                 return self.scallerr('op_read', fn, e, fd=fd)
@@ -442,54 +843,87 @@ class FSOPCtx:
         fd = FD_UNDEFINED
         f = None
         fn = self.gen_random_fn()
+        io_mode = self.params.io_mode
         try:
             if self.verbosity & 0x20000:
-               self.log.debug('randread %s' % (fn))
+               self.log.debug('randread %s' % (os.fsdecode(fn)))
             if self.params.rawdevice != None:
                 fd = self.rawdevice_fd
                 f = self.rawdevice_f
             else:
-                fd = os.open(fn, os.O_RDONLY | os.O_DIRECT * self.params.directIO)
-                f = os.fdopen(fd, 'rb', 0)
+                fd = self.open_fd(fn, os.O_RDONLY | os.O_DIRECT * self.params.directIO)
+                # positional reads go straight to the fd, no file object needed
+                if io_mode == IOMode.seek and self.uring == None:
+                    f = os.fdopen(fd, 'rb', 0)
             file_size = self.get_file_size(fd)
             target_size = self.random_file_size()
             #Make sure we won't be working with the file too much
             if target_size > file_size:
                 target_size = file_size
             if self.verbosity & 0x20000:
-                self.log.debug('randread %s size %u' % (fn, target_size))
+                self.log.debug('randread %s size %u' % (os.fsdecode(fn), target_size))
             total_count = 0
             precise_time = 0
-            while total_count < target_size:
-                record_size = self.random_record_size()
-                if record_size + total_count > target_size:
-                    record_size = target_size - total_count
-
-                #Offset should be at least one record size away from end of file
-                off = os.lseek(fd, self.random_seek_offset(file_size - record_size), 0)
-
-                if self.verbosity & 0x2000:
-                    self.log.debug('randread off %u size %u' % (off, record_size))
-
-                #using mmap for memory alignment
-                bytebuf = mmap.mmap(-1, record_size)
-                start = time.perf_counter()
-                count = f.readinto(bytebuf)
-                end = time.perf_counter()
-                precise_time += float(end - start)
-                if self.verbosity & 0x2000:
-                    self.log.debug('randread count %u recsz %u' % (count, record_size))
-                total_count += count
-                c.randread_bytes += count
-                c.randread_requests += 1
+            if self.uring != None:
+                # unlike preadv, every record in a batch goes to its own offset
+                (total_count, records, precise_time) = self.uring_records(
+                        fd, target_size, False, lambda record_size: self.random_seek_offset(file_size - record_size))
+                c.randread_bytes += total_count
+                c.randread_requests += records
+            else:
+                while total_count < target_size:
+                    if io_mode != IOMode.seek:
+                        # one preadv of one or several contiguous records
+                        # replaces the lseek + read pair, into pool buffers
+                        # (os.pread would allocate a new bytes object per read)
+                        batch = self.next_record_batch(target_size - total_count)
+                        batch_size = sum(batch)
+                        off = self.random_seek_offset(file_size - batch_size)
+                        if self.verbosity & 0x2000:
+                            self.log.debug('randread off %u size %u records %u' %
+                                           (off, batch_size, len(batch)))
+                        bufs = [self.bufpool.view(self.iov_rdbufs[k], batch[k])
+                                for k in range(0, len(batch))]
+                        start = time.perf_counter()
+                        count = os.preadv(fd, bufs, off)
+                        end = time.perf_counter()
+                        precise_time += float(end - start)
+                        if count < 1:
+                            break
+                        total_count += count
+                        c.randread_bytes += count
+                        c.randread_requests += len(batch)
+                        continue
+
+                    record_size = self.random_record_size()
+                    if record_size + total_count > target_size:
+                        record_size = target_size - total_count
+
+                    #Offset should be at least one record size away from end of file
+                    off = os.lseek(fd, self.random_seek_offset(file_size - record_size), 0)
+
+                    if self.verbosity & 0x2000:
+                        self.log.debug('randread off %u size %u' % (off, record_size))
+
+                    bytebuf = self.bufpool.view(self.rdbuf, record_size)
+                    start = time.perf_counter()
+                    count = f.readinto(bytebuf)
+                    end = time.perf_counter()
+                    precise_time += float(end - start)
+                    if self.verbosity & 0x2000:
+                        self.log.debug('randread count %u recsz %u' % (count, record_size))
+                    total_count += count
+                    c.randread_bytes += count
+                    c.randread_requests += 1
             c.have_randomly_read += 1
             if total_count:
-                self.measured_bw = total_count / precise_time
+                self.measured_io = (total_count, precise_time)
         except OSError as e:
             if e.errno == errno.ENOENT:
                 c.e_file_not_found += 1
             elif e.errno == errno.ESTALE and self.params.tolerate_stale_fh:
                 c.e_stale_fh += 1
+                self.forget_dirfd(fn)
                 return NOTOK
             else:
                 return self.scallerr('random_read', fn, e, fd=fd)
@@ -499,15 +933,15 @@ class FSOPCtx:
 
     def maybe_fsync(self, fd):
         c = self.ctrs
-        percent = random.randint(0, 100)
+        percent = next(self.fsync_pct_stream)
         if percent > self.params.fsync_probability_pct + self.params.fdatasync_probability_pct:
             return
         elif percent > self.params.fsync_probability_pct:
             c.fdatasyncs += 1
-            os.fdatasync(fd)
+            self.sync_fd(fd, datasync=True)
         else:
             c.fsyncs += 1
-            os.fsync(fd)
+            self.sync_fd(fd)
 
     def op_create(self):
         if self.fs_is_full():
@@ -519,55 +953,57 @@ class FSOPCtx:
         target_sz = self.random_file_size()
         buf_offset = 0
         precise_time = 0
-        if self.params.compress_ratio or self.params.dedupe_pct:
-            self.buf = fs_drift.random_buffer.gen_compressible_buffer(target_sz, self.params.compress_ratio, self.params.dedupe_pct)
+        self.prepare_write_content(target_sz)
         if self.verbosity & 0x1000:
-            self.log.debug('create %s sz %s' % (fn, target_sz))
+            self.log.debug('create %s sz %s' % (os.fsdecode(fn), target_sz))
         subdir = os.path.dirname(fn)
-        if not os.path.isdir(subdir):
-            try:
-                os.makedirs(subdir)
-            except OSError as e:
-                if e.errno == errno.ENOSPC:
-                    c.e_no_dir_space += 1
-                    return OK
-                elif e.errno != errno.EEXIST:
-                    return self.scallerr('dir create', fn, e)
-            c.dirs_created += 1
+        if not (self.dirs_precreated or subdir in self.known_dirs):
+            if not os.path.isdir(subdir):
+                try:
+                    os.makedirs(subdir)
+                except OSError as e:
+                    if e.errno == errno.ENOSPC:
+                        c.e_no_dir_space += 1
+                        return OK
+                    elif e.errno != errno.EEXIST:
+                        return self.scallerr('dir create', fn, e)
+                c.dirs_created += 1
+            self.known_dirs.add(subdir)
         try:
             if self.params.rawdevice != None:
                 fd = self.rawdevice_fd
             else:
                 start = time.perf_counter()
-                fd = os.open(fn, os.O_CREAT | os.O_EXCL | os.O_WRONLY | os.O_DIRECT * self.params.directIO)
+                fd = self.open_fd(fn, os.O_CREAT | os.O_EXCL | os.O_WRONLY | os.O_DIRECT * self.params.directIO)
                 end = time.perf_counter()
                 precise_time += float(end - start)
-            total_count = 0
-            while total_count < target_sz:
-                recsz = self.random_record_size()
-                if recsz + total_count > target_sz:
-                    recsz = target_sz - total_count
-                #using mmap for memory alignment
-                m = mmap.mmap(-1, recsz)
-                if self.params.compress_ratio or self.params.dedupe_pct:
-                    m.write(self.buf[buf_offset:buf_offset+recsz])
-                else:
-                    m.write(self.buf[0:recsz])
-                start = time.perf_counter()
-                count = os.write(fd, m)
-                end = time.perf_counter()
-                precise_time += float(end - start)
-                myassert(count == recsz)
-                if self.verbosity & 0x1000:
-                    self.log.debug('create sz %u written %u' % (recsz, count))
-                total_count += count
-                c.write_requests += 1
-                c.write_bytes += count
-                buf_offset += count
+            if self.uring != None:
+                (total_count, records, uring_time) = self.uring_sequential(fd, target_sz, True)
+                precise_time += uring_time
+                c.write_requests += records
+                c.write_bytes += total_count
+            else:
+                total_count = 0
+                while total_count < target_sz:
+                    recsz = self.random_record_size()
+                    if recsz + total_count > target_sz:
+                        recsz = target_sz - total_count
+                    m = self.write_record_buf(buf_offset, recsz)
+                    start = time.perf_counter()
+                    count = os.write(fd, m)
+                    end = time.perf_counter()
+                    precise_time += float(end - start)
+                    myassert(count == recsz)
+                    if self.verbosity & 0x1000:
+                        self.log.debug('create sz %u written %u' % (recsz, count))
+                    total_count += count
+                    c.write_requests += 1
+                    c.write_bytes += count
+                    buf_offset += count
             rc = self.maybe_fsync(fd)
             c.have_created += 1
             if total_count:
-                self.measured_bw = total_count / precise_time
+                self.measured_io = (total_count, precise_time)
         except OSError as e:
             if e.errno == errno.EEXIST:
                 c.e_already_exists += 1
@@ -576,8 +1012,15 @@ class FSOPCtx:
                     c.e_no_inode_space += 1
                 else:
                     c.e_no_space += 1
+            elif e.errno == errno.ENOENT and fd == FD_UNDEFINED:
+                # the directory went away, the next create there will remake it
+                c.e_dir_not_found += 1
+                self.known_dirs.discard(subdir)
+                self.dirs_precreated = False
+                self.forget_dirfd(fn)
             elif e.errno == errno.ESTALE and self.params.tolerate_stale_fh:
                 c.e_stale_fh += 1
+                self.forget_dirfd(fn)
                 return NOTOK
             else:
                 return self.scallerr('create', fn, e, fd=fd)
@@ -595,42 +1038,42 @@ class FSOPCtx:
         target_sz = self.random_file_size()
         buf_offset = 0
         precise_time = 0
-        if self.params.compress_ratio or self.params.dedupe_pct:
-            self.buf = fs_drift.random_buffer.gen_compressible_buffer(target_sz, self.params.compress_ratio, self.params.dedupe_pct)
+        self.prepare_write_content(target_sz)
         if self.verbosity & 0x8000:
-            self.log.debug('append %s sz %s' % (fn, target_sz))
+            self.log.debug('append %s sz %s' % (os.fsdecode(fn), target_sz))
         try:
             if self.params.rawdevice != None:
                 fd = self.rawdevice_fd
             else:
-                fd = os.open(fn, os.O_WRONLY | os.O_APPEND | os.O_DIRECT * self.params.directIO)
-            total_count = 0
-            while total_count < target_sz:
-                recsz = self.random_record_size()
-                if recsz + total_count > target_sz:
-                    recsz = target_sz - total_count
-                myassert(recsz > 0)
-                if self.verbosity & 0x8000:
-                    self.log.debug('append rsz %u' % (recsz))
-                #using mmap for memory alignment
-                m = mmap.mmap(-1, recsz)
-                if self.params.compress_ratio or self.params.dedupe_pct:
-                    m.write(self.buf[buf_offset:buf_offset+recsz])
-                else:
-                    m.write(self.buf[0:recsz])
-                start = time.perf_counter()
-                count = os.write(fd, m)
-                end = time.perf_counter()
-                precise_time += float(end - start)
-                myassert(count == recsz)
-                total_count += count
-                buf_offset += count
-                c.write_requests += 1
-                c.write_bytes += count
+                fd = self.open_fd(fn, os.O_WRONLY | os.O_APPEND | os.O_DIRECT * self.params.directIO)
+            if self.uring != None:
+                # O_APPEND makes the kernel ignore the offsets we pass
+                (total_count, records, precise_time) = self.uring_sequential(fd, target_sz, True)
+                c.write_requests += records
+                c.write_bytes += total_count
+            else:
+                total_count = 0
+                while total_count < target_sz:
+                    recsz = self.random_record_size()
+                    if recsz + total_count > target_sz:
+                        recsz = target_sz - total_count
+                    myassert(recsz > 0)
+                    if self.verbosity & 0x8000:
+                        self.log.debug('append rsz %u' % (recsz))
+                    m = self.write_record_buf(buf_offset, recsz)
+                    start = time.perf_counter()
+                    count = os.write(fd, m)
+                    end = time.perf_counter()
+                    precise_time += float(end - start)
+                    myassert(count == recsz)
+                    total_count += count
+                    buf_offset += count
+                    c.write_requests += 1
+                    c.write_bytes += count
             rc = self.maybe_fsync(fd)
             c.have_appended += 1
             if total_count:
-                self.measured_bw = total_count / precise_time
+                self.measured_io = (total_count, precise_time)
         except OSError as e:
             if e.errno == errno.ENOENT:
                 c.e_file_not_found += 1
@@ -638,6 +1081,7 @@ class FSOPCtx:
                 c.e_no_space += 1
             elif e.errno == errno.ESTALE and self.params.tolerate_stale_fh:
                 c.e_stale_fh += 1
+                self.forget_dirfd(fn)
                 return NOTOK
             else:
                 return self.scallerr('append', fn, e, fd=fd)
@@ -651,54 +1095,85 @@ class FSOPCtx:
         fn = self.gen_random_fn()
         try:
             if self.verbosity & 0x20000:
-                self.log.debug('randwrite %s' % (fn))
+                self.log.debug('randwrite %s' % (os.fsdecode(fn)))
             if self.params.rawdevice != None:
                 fd = self.rawdevice_fd
             else:
-                fd = os.open(fn, os.O_WRONLY | os.O_DIRECT * self.params.directIO)
+                fd = self.open_fd(fn, os.O_WRONLY | os.O_DIRECT * self.params.directIO)
             file_size = self.get_file_size(fd)
             target_size = self.random_file_size()
             buf_offset = 0
-            if self.params.compress_ratio or self.params.dedupe_pct:
-                self.buf = fs_drift.random_buffer.gen_compressible_buffer(target_size, self.params.compress_ratio, self.params.dedupe_pct)
+            self.prepare_write_content(target_size)
             #Lets make sure, we won't write 100MB into 4KB file
             #This way, we'll at most rewrite the whole file
             if target_size > file_size:
                 target_size = file_size
             total_count = 0
             precise_time = 0
-            while total_count < target_size:
-                record_size = self.random_record_size()
-                if record_size + total_count > target_size:
-                    record_size = target_size - total_count
-
-                #Offset should be at least one record size away from end of file
-                off = os.lseek(fd, self.random_seek_offset(file_size - record_size), 0)
-
-                if self.verbosity & 0x20000:
-                    self.log.debug('randwrite off %u size %u' % (off, record_size))
-
-                #using mmap for memory alignment
-                m = mmap.mmap(-1, record_size)
-                if self.params.compress_ratio or self.params.dedupe_pct:
-                    m.write(self.buf[buf_offset:buf_offset+record_size])
-                else:
-                    m.write(self.buf[0:record_size])
-                start = time.perf_counter()
-                count = os.write(fd, m)
-                end = time.perf_counter()
-                precise_time += float(end - start)
-                if self.verbosity & 0x20000:
-                    self.log.debug('randwrite count %u record size %u' % (count, record_size))
-                myassert(count == record_size)
-                total_count += count
-                buf_offset += count
-                c.randwrite_requests += 1
+            if self.uring != None:
+                (total_count, records, precise_time) = self.uring_records(
+                        fd, target_size, True, lambda record_size: self.random_seek_offset(file_size - record_size))
+                c.randwrite_requests += records
                 c.randwrite_bytes += total_count
-                rc = self.maybe_fsync(fd)
+                for k in range(0, records):
+                    self.maybe_fsync(fd)
+            else:
+                while total_count < target_size:
+                    if self.params.io_mode != IOMode.seek:
+                        # one pwrite (or pwritev of several contiguous records)
+                        # replaces the lseek + write pair
+                        batch = self.next_record_batch(target_size - total_count)
+                        batch_size = sum(batch)
+                        off = self.random_seek_offset(file_size - batch_size)
+                        if self.verbosity & 0x20000:
+                            self.log.debug('randwrite off %u size %u records %u' %
+                                           (off, batch_size, len(batch)))
+                        self.prepare_write_batch(buf_offset, batch_size)
+                        bufs = []
+                        for record_size in batch:
+                            bufs.append(self.write_record_buf(buf_offset, record_size))
+                            buf_offset += record_size
+                        start = time.perf_counter()
+                        if len(bufs) == 1:
+                            count = os.pwrite(fd, bufs[0], off)
+                        else:
+                            count = os.pwritev(fd, bufs, off)
+                        end = time.perf_counter()
+                        precise_time += float(end - start)
+                        myassert(count == batch_size)
+                        total_count += count
+                        c.randwrite_requests += len(batch)
+                        c.randwrite_bytes += count
+                        for record_size in batch:
+                            self.maybe_fsync(fd)
+                        continue
+
+                    record_size = self.random_record_size()
+                    if record_size + total_count > target_size:
+                        record_size = target_size - total_count
+
+                    #Offset should be at least one record size away from end of file
+                    off = os.lseek(fd, self.random_seek_offset(file_size - record_size), 0)
+
+                    if self.verbosity & 0x20000:
+                        self.log.debug('randwrite off %u size %u' % (off, record_size))
+
+                    m = self.write_record_buf(buf_offset, record_size)
+                    start = time.perf_counter()
+                    count = os.write(fd, m)
+                    end = time.perf_counter()
+                    precise_time += float(end - start)
+                    if self.verbosity & 0x20000:
+                        self.log.debug('randwrite count %u record size %u' % (count, record_size))
+                    myassert(count == record_size)
+                    total_count += count
+                    buf_offset += count
+                    c.randwrite_requests += 1
+                    c.randwrite_bytes += count
+                    rc = self.maybe_fsync(fd)
             c.have_randomly_written += 1
             if total_count:
-                self.measured_bw = total_count / precise_time
+                self.measured_io = (total_count, precise_time)
         except OSError as e:
             if e.errno == errno.ENOENT:
                 c.e_file_not_found += 1
@@ -706,6 +1181,7 @@ class FSOPCtx:
                 c.e_no_space += 1
             elif e.errno == errno.ESTALE and self.params.tolerate_stale_fh:
                 c.e_stale_fh += 1
+                self.forget_dirfd(fn)
                 return NOTOK
             else:
                 return self.scallerr('random write', fn, e, fd=fd)
@@ -721,12 +1197,12 @@ class FSOPCtx:
         s = OK
         fn = self.gen_random_fn()
         if self.verbosity & 0x40000:
-            self.log.debug('truncate %s' % fn)
+            self.log.debug('truncate %s' % os.fsdecode(fn))
         try:
             if self.params.rawdevice != None:
                 fd = self.rawdevice_fd
             else:
-                fd = os.open(fn, os.O_RDWR | os.O_DIRECT * self.params.directIO)
+                fd = self.open_fd(fn, os.O_RDWR | os.O_DIRECT * self.params.directIO)
             new_file_size = self.get_file_size(fd)
             os.ftruncate(fd, new_file_size)
             c.have_truncated += 1
@@ -737,6 +1213,7 @@ class FSOPCtx:
                 c.e_no_space += 1
             elif e.errno == errno.ESTALE and self.params.tolerate_stale_fh:
                 c.e_stale_fh += 1
+                self.forget_dirfd(fn)
                 return NOTOK
             else:
                 return self.scallerr('truncate', fn, e, fd=fd)
@@ -751,15 +1228,17 @@ class FSOPCtx:
             self.log.debug('filesystem full, disabling softlink')
             return OK
         c = self.ctrs
-        fn = os.getcwd() + os.sep + self.gen_random_fn()
+        relfn = self.gen_random_fn()
+        fn = os.getcwdb() + b'/' + relfn
         fn2 = self.gen_random_fn() + link_suffix
         if self.verbosity & 0x10000:
-            self.log.debug('link to %s from %s' % (fn, fn2))
-        if not os.path.isfile(fn):
+            self.log.debug('link to %s from %s' % (os.fsdecode(fn), os.fsdecode(fn2)))
+        if not self.is_file(relfn):
             c.e_file_not_found += 1
             return OK
         try:
-            rc = os.symlink(fn, fn2)
+            (name2, dir_fd2) = self.at(fn2)
+            rc = os.symlink(fn, name2, dir_fd=dir_fd2)
             c.have_softlinked += 1
         except OSError as e:
             if e.errno == errno.EEXIST:
@@ -770,6 +1249,7 @@ class FSOPCtx:
                 c.e_no_inode_space += 1
             elif e.errno == errno.ESTALE and self.params.tolerate_stale_fh:
                 c.e_stale_fh += 1
+                self.forget_dirfd(relfn)
                 return NOTOK
             else:
                 return self.scallerr('softlink', fn, e)
@@ -785,12 +1265,14 @@ class FSOPCtx:
         fn = self.gen_random_fn()
         fn2 = self.gen_random_fn() + hlink_suffix
         if self.verbosity & 0x10000:
-            self.log.debug('hard link to %s from %s' % (fn, fn2))
-        if not os.path.isfile(fn):
+            self.log.debug('hard link to %s from %s' % (os.fsdecode(fn), os.fsdecode(fn2)))
+        if not self.is_file(fn):
             c.e_file_not_found += 1
             return OK
         try:
-            rc = os.link(fn, fn2)
+            (name, dir_fd) = self.at(fn)
+            (name2, dir_fd2) = self.at(fn2)
+            rc = os.link(name, name2, src_dir_fd=dir_fd, dst_dir_fd=dir_fd2)
             c.have_hardlinked += 1
         except OSError as e:
             if e.errno == errno.EEXIST:
@@ -801,6 +1283,7 @@ class FSOPCtx:
                 c.e_no_inode_space += 1
             elif e.errno == errno.ESTALE and self.params.tolerate_stale_fh:
                 c.e_stale_fh += 1
+                self.forget_dirfd(fn)
                 return NOTOK
             else:
                 return self.scallerr('hardlink', fn, e)
@@ -812,31 +1295,33 @@ class FSOPCtx:
         c = self.ctrs
         fn = self.gen_random_fn()
         if self.verbosity & 0x20000:
-            self.log.debug('delete %s' % (fn))
+            self.log.debug('delete %s' % (os.fsdecode(fn)))
         try:
             linkfn = fn + link_suffix
-            if os.path.exists(linkfn):
+            (name, dir_fd) = self.at(fn)
+            if self.exists(linkfn):
                 if self.verbosity & 0x20000:
-                    self.log.debug('delete soft link %s' % (linkfn))
-                os.unlink(linkfn)
+                    self.log.debug('delete soft link %s' % (os.fsdecode(linkfn)))
+                os.unlink(name + link_suffix, dir_fd=dir_fd)
             else:
                 c.e_file_not_found += 1
             hlinkfn = fn + hlink_suffix
-            if os.path.exists(hlinkfn):
+            if self.exists(hlinkfn):
                 if self.verbosity & 0x20000:
-                    self.log.debug('delete hard link %s' % (hlinkfn))
-                os.unlink(hlinkfn)
+                    self.log.debug('delete hard link %s' % (os.fsdecode(hlinkfn)))
+                os.unlink(name + hlink_suffix, dir_fd=dir_fd)
             else:
                 c.e_file_not_found += 1
             if self.verbosity & 0x20000:
-                self.log.debug('delete file %s' % fn)
-            os.unlink(fn)
+                self.log.debug('delete file %s' % os.fsdecode(fn))
+            os.unlink(name, dir_fd=dir_fd)
             c.have_deleted += 1
         except OSError as e:
             if e.errno == errno.ENOENT:
                 c.e_file_not_found += 1
             elif e.errno == errno.ESTALE and self.params.tolerate_stale_fh:
                 c.e_stale_fh += 1
+                self.forget_dirfd(fn)
                 return NOTOK
             else:
                 self.scallerr('delete', fn, e)
@@ -849,9 +1334,11 @@ class FSOPCtx:
         fn = self.gen_random_fn()
         fn2 = self.gen_random_fn()
         if self.verbosity & 0x20000:
-            self.log.debug('rename %s to %s' % (fn, fn2))
+            self.log.debug('rename %s to %s' % (os.fsdecode(fn), os.fsdecode(fn2)))
         try:
-            os.rename(fn, fn2)
+            (name, dir_fd) = self.at(fn)
+            (name2, dir_fd2) = self.at(fn2)
+            os.rename(name, name2, src_dir_fd=dir_fd, dst_dir_fd=dir_fd2)
             c.have_renamed += 1
         except OSError as e:
             if e.errno == errno.ENOENT:
@@ -862,6 +1349,7 @@ class FSOPCtx:
                 c.e_no_inode_space += 1
             elif e.errno == errno.ESTALE and self.params.tolerate_stale_fh:
                 c.e_stale_fh += 1
+                self.forget_dirfd(fn)
                 return NOTOK
             else:
                 return self.scallerr('rename', fn, e)
@@ -882,7 +1370,7 @@ class FSOPCtx:
             if target_size > file_size:
                 target_size = file_size
             if self.verbosity & 0x20000:
-                self.log.debug('randwrite %s size %u' % (fn, target_size))
+                self.log.debug('randwrite %s size %u' % (os.fsdecode(fn), target_size))
             total_count = 0
             precise_time = 0
             while total_count < target_size:
@@ -907,7 +1395,7 @@ class FSOPCtx:
                 c.randdiscard_bytes += total_count
             c.have_randomly_discarded += 1
             if total_count:
-                self.measured_bw = total_count / precise_time
+                self.measured_io = (total_count, precise_time)
         except OSError as e:
             if e.errno == errno.ENOENT:
                 c.e_file_not_found += 1
@@ -915,6 +1403,7 @@ class FSOPCtx:
                 c.e_no_space += 1
             elif e.errno == errno.ESTALE and self.params.tolerate_stale_fh:
                 c.e_stale_fh += 1
+                self.forget_dirfd(fn)
                 return NOTOK
             else:
                 return self.scallerr('random discard', fn, e, fd=fd)
@@ -951,6 +1440,8 @@ class FSOPCtx:
             c.e_not_mounted += 1
         else:
             os.chdir('/tmp')
+            # open directory fds would keep the filesystem busy
+            self.forget_dirfds()
             rc = os.system('umount %s' % mountpoint)
             if rc != OK:
                 c.e_could_not_unmount += 1
@@ -962,6 +1453,14 @@ class FSOPCtx:
         c.have_remounted += 1
         return OK
 
+    # close cached directory fds of this context and all of its lanes,
+    # none of the lanes may have an op in progress
+
+    def forget_dirfds(self):
+        for ctx in [self] + self.lanes:
+            if ctx.dirfds != None:
+                ctx.dirfds.clear()
+
     def op_readdir(self):
         if self.params.rawdevice != None:
             return OK
@@ -969,9 +1468,12 @@ class FSOPCtx:
         fn = self.gen_random_fn()
         dirpath = os.path.dirname(fn)
         if self.verbosity & 0x20000:
-            self.log.debug('readdir %s' % dirpath)
+            self.log.debug('readdir %s' % os.fsdecode(dirpath))
         try:
-            dirlist = os.listdir(dirpath)
+            if self.dirfds != None:
+                dirlist = os.listdir(self.dirfds.get(dirpath))
+            else:
+                dirlist = os.listdir(dirpath)
             c.have_readdir += 1
         except OSError as e:
             if e.errno == errno.ENOENT:
@@ -1031,9 +1533,193 @@ if __name__ == "__main__":
                 rc = ctx.invoke_rq(k)
             assert(rc == OK)
 
+    # records to write are slices of the content region, never copies
+    ctx.prepare_write_content(4096)
+    m = ctx.write_record_buf(12345, 4096)
+    assert(isinstance(m, memoryview) and len(m) == 4096)
+    assert(m.obj is ctx.content_view.obj)
+
+    # random I/O through pread/pwrite and batched preadv/pwritev
+    for mode in [IOMode.positional, IOMode.vectored]:
+        ctx.params.io_mode = mode
+        ctx.params.iov_batch = 4
+        ctx = FSOPCtx(options, log, ctrs, 'test-host', 'test-tid')
+        ctx.verbosity = -1
+        assert(len(ctx.iov_rdbufs) == (4 if mode == IOMode.vectored else 1))
+        randreads = ctrs.randread_requests
+        for j in range(0, 100):
+            assert(ctx.op_create() == OK)
+            assert(ctx.op_random_read() == OK)
+            assert(ctx.op_random_write() == OK)
+        assert(ctrs.randread_requests > randreads)
+    batch = ctx.next_record_batch(3 * ctx.params.record_size + 1)
+    assert(sum(batch) == 3 * ctx.params.record_size + 1 and len(batch) == 4)
+    ctx.params.io_mode = IOMode.seek
+
+    # batched sequential and random I/O through io_uring,
+    # when the kernel refuses io_uring this exercises the fallback instead
+    ctx.params.io_engine = IOEngine.io_uring
+    ctx = FSOPCtx(options, log, ctrs, 'test-host', 'test-tid')
+    ctx.verbosity = -1
+    if ctx.uring == None:
+        log.warning('io_uring unavailable, testing synchronous fallback')
+    writes = ctrs.write_requests
+    for j in range(0, 100):
+        for k in [rq.CREATE, rq.READ, rq.RANDOM_READ, rq.APPEND, rq.RANDOM_WRITE, rq.WRITE, rq.TRUNCATE]:
+            assert(ctx.invoke_rq(k) == OK)
+    assert(ctrs.write_requests > writes)
+    if ctx.uring != None:
+        assert(len(ctx.uring) == 0)
+        lane = ctx.make_lane()
+        assert(lane.uring != None and lane.uring is not ctx.uring)
+        lane.uring.close()
+        # what io_uring writes is exactly the content region
+        ctx.prepare_write_content(65536)
+        ctx.content_salt = 0
+        fd = os.open('uring-check', os.O_CREAT | os.O_RDWR)
+        (count, records, elapsed) = ctx.uring_sequential(fd, 65536, True)
+        assert(count == 65536 and records >= 65536 // ctx.max_recsz and elapsed > 0.0)
+        assert(os.pread(fd, 65536, 0) == bytes(ctx.write_record_buf(0, 65536)))
+        os.close(fd)
+        ctx.uring.close()
+    ctx.params.io_engine = IOEngine.sync
+
+    # every op resolving names relative to cached directory fds,
+    # with io_uring too when available so its openat uses them
+    ctx.params.dirfd_cache = 4
+    for engine in [IOEngine.sync, IOEngine.io_uring]:
+        ctx.params.io_engine = engine
+        ctx = FSOPCtx(options, log, ctrs, 'test-host', 'test-tid')
+        ctx.verbosity = -1
+        links = ctrs.have_hardlinked + ctrs.have_softlinked
+        for j in range(0, 200):
+            for k in FSOPCtx.opcode_to_opname.keys():
+                if k != rq.REMOUNT:
+                    assert(ctx.invoke_rq(k) == OK)
+        assert(0 < len(ctx.dirfds) <= 4)
+        assert(ctrs.have_hardlinked + ctrs.have_softlinked > links)
+        (name, dir_fd) = ctx.at(b'./d0001/d0001/f000000001')
+        assert(name == b'f000000001' and dir_fd >= 0)
+        ctx.dirfds.clear()
+    ctx.params.io_engine = IOEngine.sync
+
+    # a remount closes the directory fds of every --iodepth lane too
+    ctx = FSOPCtx(options, log, ctrs, 'test-host', 'test-tid')
+    ctx.verbosity = -1
+    lanes = [ctx.make_lane() for k in range(0, 2)]
+    for c in [ctx] + lanes:
+        for j in range(0, 20):
+            assert(c.op_create() == OK)
+        assert(len(c.dirfds) > 0)
+    assert(lanes[0].dirfds is not ctx.dirfds and lanes[0].lanes == [])
+    ctx.forget_dirfds()
+    assert([len(c.dirfds) for c in [ctx] + lanes] == [0, 0, 0])
+    for lane in lanes:
+        lane.bufpool.close()
+    ctx.params.dirfd_cache = 0
+
+    # creates only look for a directory the first time they use it
+    ctx = FSOPCtx(options, log, ctrs, 'test-host', 'test-tid')
+    ctx.verbosity = -1
+    for j in range(0, 100):
+        assert(ctx.op_create() == OK)
+    assert(len(ctx.known_dirs) > 0)
+    assert(all(os.path.isdir(d) for d in ctx.known_dirs))
+    # if a known directory disappears, creates there make it again
+    os.system('rm -rf ./d0001')
+    dirs_missing = ctrs.e_dir_not_found
+    for j in range(0, 300):
+        assert(ctx.op_create() == OK)
+    assert(ctrs.e_dir_not_found > dirs_missing)
+    assert(os.path.isdir('./d0001'))
+
+    # the whole tree, created in two interleaved halves
+    os.system('rm -rf ./d0*')
+    assert(ctx.precreate_dirs(0, 2) + ctx.precreate_dirs(1, 2) == ctx.total_dirs)
+    assert(ctx.dirs_precreated)
+    assert(len(os.listdir('.')) >= ctx.params.subdirs_per_dir)
+    for j in range(0, 100):
+        assert(ctx.op_create() == OK)
+
+    # compressible/dedupable files much bigger than the window they are
+    # streamed through, written one record, a vectored batch
+    # or an io_uring batch at a time
+    import zlib
+    ctx.params.compress_ratio = 4.0
+    ctx.params.dedupe_pct = 50
+    ctx.params.iov_batch = 4
+    for (mode, engine) in [(IOMode.seek, IOEngine.sync), (IOMode.vectored, IOEngine.sync),
+                           (IOMode.seek, IOEngine.io_uring)]:
+        ctx.params.io_mode = mode
+        ctx.params.io_engine = engine
+        ctx = FSOPCtx(options, log, ctrs, 'test-host', 'test-tid')
+        ctx.verbosity = -1
+        assert(ctx.content.buf_size <= 4 * ctx.max_recsz + 4096)
+        lane = ctx.make_lane()
+        assert(lane.content is not ctx.content and lane.content_stream.pool is ctx.content_stream.pool)
+        fd = os.open('compress-check', os.O_CREAT | os.O_TRUNC | os.O_RDWR)
+        ctx.prepare_write_content(1 << 22)
+        if ctx.uring != None:
+            (count, records, elapsed) = ctx.uring_sequential(fd, 1 << 22, True)
+        else:
+            for off in range(0, 1 << 22, ctx.params.record_size):
+                os.write(fd, ctx.write_record_buf(off, ctx.params.record_size))
+        contents = os.pread(fd, 1 << 22, 0)
+        os.close(fd)
+        assert(len(contents) == 1 << 22)
+        assert(len(zlib.compress(contents, 1)) < len(contents) / 3)
+        blocks = set(contents[k:k+4096] for k in range(0, len(contents), 4096))
+        assert(abs(len(blocks) - len(contents) // 8192) <= 2)
+        for j in range(0, 20):
+            for k in [rq.CREATE, rq.APPEND, rq.RANDOM_WRITE, rq.WRITE]:
+                assert(ctx.invoke_rq(k) == OK)
+        if ctx.uring != None:
+            ctx.uring.close()
+    ctx.params.compress_ratio = 0.0
+    ctx.params.dedupe_pct = 0
+    ctx.params.io_mode = IOMode.seek
+    ctx.params.io_engine = IOEngine.sync
+
+    # writing out of a read-only shared content pool, plain and compressible,
+    # through io_uring as well when it is available
+    from fs_drift.content_pool import ContentPool
+    for (compress_ratio, engine) in [(0.0, IOEngine.sync), (0.0, IOEngine.io_uring), (2.0, IOEngine.io_uring)]:
+        ctx.params.compress_ratio = compress_ratio
+        ctx.params.io_engine = engine
+        pool = ContentPool.create(plain_content_size(ctx.params), compress_ratio, 0)
+        shared = ContentPool.attach(pool.name)
+        ctx = FSOPCtx(options, log, ctrs, 'test-host', 'test-tid', content_pool=shared)
+        ctx.verbosity = -1
+        if compress_ratio:
+            assert(ctx.content_stream.pool is shared.block_pool)
+        else:
+            assert(ctx.content == None and ctx.content_view is shared.plain_view)
+            assert(ctx.content_view.readonly)
+        for j in range(0, 50):
+            for k in [rq.CREATE, rq.READ, rq.APPEND, rq.RANDOM_WRITE, rq.WRITE]:
+                assert(ctx.invoke_rq(k) == OK)
+        if not compress_ratio:
+            ctx.prepare_write_content(65536)
+            ctx.content_salt = 0
+            fd = os.open('pool-check', os.O_CREAT | os.O_TRUNC | os.O_RDWR)
+            if ctx.uring != None:
+                ctx.uring_sequential(fd, 65536, True)
+            else:
+                os.write(fd, ctx.write_record_buf(0, 65536))
+            assert(os.pread(fd, 65536, 0) == bytes(ctx.write_record_buf(0, 65536)))
+            os.close(fd)
+        if ctx.uring != None:
+            ctx.uring.close()
+        pool.unlink()
+        pool.close()
+    ctx.params.compress_ratio = 0.0
+    ctx.params.io_engine = IOEngine.sync
+
     #simulate a run where max record size = max file size
     ctx.params.max_record_size_kb = ctx.params.max_file_size_kb = 1024
-    ctx.buf = fs_drift.random_buffer.gen_buffer(ctx.params.max_record_size_kb*BYTES_PER_KiB)
+    ctx.params.record_size = ctx.params.file_size = 1024 * BYTES_PER_KiB
+    ctx = FSOPCtx(options, log, ctrs, 'test-host', 'test-tid')
+    ctx.verbosity = -1
     for j in range(0, 200):
         for k in FSOPCtx.opcode_to_opname.keys():
             if k != rq.REMOUNT:
@@ -1048,14 +1734,23 @@ if __name__ == "__main__":
     assert(ctrs2.have_read > 0 and ctrs2.have_read == 2 * ctrs.have_read)
     print(ctrs.json_dict())
 
-    # simulate a gaussian run
+    # simulate a gaussian run, with its simulated time state file
+    # in a scratch directory so the next run does not resume from it
+    import tempfile
     options.random_distribution = fs_drift.common.FileAccessDistr.gaussian
-    ctrs = FSOPCounters()
-    ctx = FSOPCtx(options, log, ctrs, 'test-host', 'test-tid')
-    ctx.verbosity = -1
-    for j in range(0, 200):
-        for k in FSOPCtx.opcode_to_opname.keys():
-            if k != rq.REMOUNT:
-                rc = ctx.invoke_rq(k)
-            assert(rc == OK)
+    options.local_scratch_dir = tempfile.mkdtemp(prefix='fsd-simtime-')
+    try:
+        ctrs = FSOPCounters()
+        ctx = FSOPCtx(options, log, ctrs, 'test-host', 'test-tid')
+        ctx.verbosity = -1
+        for j in range(0, 200):
+            for k in FSOPCtx.opcode_to_opname.keys():
+                if k != rq.REMOUNT:
+                    rc = ctx.invoke_rq(k)
+                assert(rc == OK)
+        ctx.save_simulated_time()
+        assert(os.path.exists(state_path(options, 'test-host', 'test-tid')))
+    finally:
+        fs_drift.common.deltree(options.local_scratch_dir)
+        options.local_scratch_dir = None
     print(ctrs)
@@ -33,6 +33,11 @@ class FSOPCounters:
         self.fsyncs = 0
         self.fdatasyncs = 0
         self.dirs_created = 0
+
+        # pacing of --pause-between-ops, see pacer.py
+        self.pauses = 0
+        self.pause_requested_usec = 0
+        self.pause_achieved_usec = 0
         
         # error counters
         self.e_already_exists = 0
@@ -80,6 +85,9 @@ class FSOPCounters:
         total.fsyncs                += self.fsyncs
         total.fdatasyncs            += self.fdatasyncs
         total.dirs_created          += self.dirs_created
+        total.pauses                += self.pauses
+        total.pause_requested_usec  += self.pause_requested_usec
+        total.pause_achieved_usec   += self.pause_achieved_usec
         
         # error counters
         total.e_already_exists      += self.e_already_exists
@@ -137,6 +145,9 @@ class FSOPCounters:
             ('fsyncs', self.fsyncs),
             ('fdatasyncs', self.fdatasyncs),
             ('dirs_created', self.dirs_created),
+            ('pauses', self.pauses),
+            ('pause_requested_usec', self.pause_requested_usec),
+            ('pause_achieved_usec', self.pause_achieved_usec),
             ('e_already_exists', self.e_already_exists),
             ('e_file_not_found', self.e_file_not_found),
             ('e_no_dir_space', self.e_no_dir_space),
@@ -46,7 +46,6 @@ class subprocess(multiprocessing.Process):
             print('Exception seen in thread %s host %s (tail %s) ' %
                   (wkr.tid, wkr.onhost, wkr.log_fn()))
         finally:
-            wkr.rsptimes = None  # response time array already saved to file
             wkr.params = None
             wkr.log = None  # log objects cannot be serialized
             wkr.buf = None
@@ -54,6 +53,8 @@ class subprocess(multiprocessing.Process):
             self.sender.send(wkr.status)
             self.sender.send(wkr.elapsed_time)
             self.sender.send(ctrs)
+            self.sender.send(wkr.latencies)
+            self.sender.send(wkr.latency_timeline)
 
     # parent that launched the subprocess retrieves results here
 
@@ -61,6 +62,8 @@ class subprocess(multiprocessing.Process):
         self.invoke.status = self.receiver.recv()
         self.invoke.elapsed_time = self.receiver.recv()
         self.invoke.ctrs = self.receiver.recv()
+        self.invoke.latencies = self.receiver.recv()
+        self.invoke.latency_timeline = self.receiver.recv()
         # null out sub-objects so that pickling doesn't fail
         self.receiver = None
         self.sender = None
@@ -0,0 +1,419 @@
+# io_uring.py - minimal io_uring submission/completion rings using raw syscalls
+#
+# with --io-engine io_uring, data-path ops hand a whole batch of records
+# to the kernel with a single io_uring_enter() call instead of doing one
+# blocking syscall per record, so a single worker can keep a device busy.
+# This talks to the kernel through ctypes and the syscall numbers directly,
+# so there is no dependency on liburing or any compiled extension.
+# If the kernel does not support io_uring (or it is disabled by
+# sysctl, seccomp or a container runtime), IoUring() raises OSError
+# and the caller falls back to ordinary synchronous syscalls.
+#
+# Ring memory is accessed with struct.pack_into/unpack_from on the
+# mmap'ed rings.  Since we never use SQPOLL, the kernel only looks at
+# the submission queue during io_uring_enter(), and we only look at the
+# completion queue after io_uring_enter() returns, so the syscall itself
+# provides the memory barriers that liburing would otherwise supply.
+
+import os
+import mmap
+import struct
+import ctypes
+import time
+import errno
+
+from fs_drift.common import FsDriftException
+
+# io_uring was added after the syscall tables were unified,
+# so these numbers are the same on every architecture
+
+NR_io_uring_setup = 425
+NR_io_uring_enter = 426
+NR_io_uring_register = 427
+
+IORING_OFF_SQ_RING = 0
+IORING_OFF_CQ_RING = 0x8000000
+IORING_OFF_SQES = 0x10000000
+
+IORING_FEAT_SINGLE_MMAP = 1
+IORING_ENTER_GETEVENTS = 1
+
+IORING_REGISTER_BUFFERS = 0
+IORING_UNREGISTER_BUFFERS = 1
+IORING_REGISTER_PROBE = 8
+IO_URING_OP_SUPPORTED = 1
+
+IORING_FSYNC_DATASYNC = 1
+
+AT_FDCWD = -100
+
+
+# request opcodes from enum io_uring_op in <linux/io_uring.h>
+
+class op:
+    NOP = 0
+    FSYNC = 3
+    READ_FIXED = 4
+    WRITE_FIXED = 5
+    OPENAT = 18
+    CLOSE = 19
+    READ = 22
+    WRITE = 23
+
+
+# struct io_uring_sqe, 64 bytes:
+# opcode, flags, ioprio, fd, off, addr, len, op_flags, user_data,
+# buf_index, personality, splice_fd_in, addr3, pad
+
+SQE_FORMAT = '=BBHiQQIIQHHiQQ'
+SQE_SIZE = struct.calcsize(SQE_FORMAT)
+
+# struct io_uring_cqe, 16 bytes: user_data, res, flags
+
+CQE_FORMAT = '=QiI'
+CQE_SIZE = struct.calcsize(CQE_FORMAT)
+
+U32 = struct.Struct('=I')
+
+
+class io_sqring_offsets(ctypes.Structure):
+    _fields_ = [('head', ctypes.c_uint32),
+                ('tail', ctypes.c_uint32),
+                ('ring_mask', ctypes.c_uint32),
+                ('ring_entries', ctypes.c_uint32),
+                ('flags', ctypes.c_uint32),
+                ('dropped', ctypes.c_uint32),
+                ('array', ctypes.c_uint32),
+                ('resv1', ctypes.c_uint32),
+                ('user_addr', ctypes.c_uint64)]
+
+
+class io_cqring_offsets(ctypes.Structure):
+    _fields_ = [('head', ctypes.c_uint32),
+                ('tail', ctypes.c_uint32),
+                ('ring_mask', ctypes.c_uint32),
+                ('ring_entries', ctypes.c_uint32),
+                ('overflow', ctypes.c_uint32),
+                ('cqes', ctypes.c_uint32),
+                ('flags', ctypes.c_uint32),
+                ('resv1', ctypes.c_uint32),
+                ('user_addr', ctypes.c_uint64)]
+
+
+class io_uring_params(ctypes.Structure):
+    _fields_ = [('sq_entries', ctypes.c_uint32),
+                ('cq_entries', ctypes.c_uint32),
+                ('flags', ctypes.c_uint32),
+                ('sq_thread_cpu', ctypes.c_uint32),
+                ('sq_thread_idle', ctypes.c_uint32),
+                ('features', ctypes.c_uint32),
+                ('wq_fd', ctypes.c_uint32),
+                ('resv', ctypes.c_uint32 * 3),
+                ('sq_off', io_sqring_offsets),
+                ('cq_off', io_cqring_offsets)]
+
+
+class iovec(ctypes.Structure):
+    _fields_ = [('iov_base', ctypes.c_void_p),
+                ('iov_len', ctypes.c_size_t)]
+
+
+libc = ctypes.CDLL(None, use_errno=True)
+libc.syscall.restype = ctypes.c_long
+
+
+def sys_io_uring(nr, *args):
+    while True:
+        rc = libc.syscall(nr, *args)
+        if rc >= 0:
+            return rc
+        err = ctypes.get_errno()
+        if err != errno.EINTR:
+            raise OSError(err, os.strerror(err))
+
+
+# one completed request, with the time it was handed to the kernel
+# and the time its completion was reaped, both from time.perf_counter()
+
+class UringCompletion:
+
+    def __init__(self, user_data, res, submit_time, complete_time):
+        self.user_data = user_data
+        self.res = res
+        self.submit_time = submit_time
+        self.complete_time = complete_time
+
+    def latency(self):
+        return self.complete_time - self.submit_time
+
+    # raise OSError if the request failed, like the equivalent syscall would
+
+    def check(self):
+        if self.res < 0:
+            raise OSError(-self.res, os.strerror(-self.res))
+        return self.res
+
+
+class IoUring:
+
+    def __init__(self, entries):
+        p = io_uring_params()
+        self.fd = sys_io_uring(NR_io_uring_setup, ctypes.c_uint(entries), ctypes.byref(p))
+        self.entries = p.sq_entries
+        self.sq_off = p.sq_off
+        self.cq_off = p.cq_off
+        sq_size = p.sq_off.array + p.sq_entries * U32.size
+        cq_size = p.cq_off.cqes + p.cq_entries * CQE_SIZE
+        prot = mmap.PROT_READ | mmap.PROT_WRITE
+        flags = mmap.MAP_SHARED | getattr(mmap, 'MAP_POPULATE', 0)
+        try:
+            if p.features & IORING_FEAT_SINGLE_MMAP:
+                sq_size = cq_size = max(sq_size, cq_size)
+            self.sq_ring = mmap.mmap(self.fd, sq_size, flags=flags, prot=prot,
+                                     offset=IORING_OFF_SQ_RING)
+            if p.features & IORING_FEAT_SINGLE_MMAP:
+                self.cq_ring = self.sq_ring
+            else:
+                self.cq_ring = mmap.mmap(self.fd, cq_size, flags=flags, prot=prot,
+                                         offset=IORING_OFF_CQ_RING)
+            self.sqes = mmap.mmap(self.fd, p.sq_entries * SQE_SIZE, flags=flags, prot=prot,
+                                  offset=IORING_OFF_SQES)
+        except OSError:
+            os.close(self.fd)
+            raise
+        self.sq_mask = U32.unpack_from(self.sq_ring, p.sq_off.ring_mask)[0]
+        self.cq_mask = U32.unpack_from(self.cq_ring, p.cq_off.ring_mask)[0]
+        self.sq_tail = U32.unpack_from(self.sq_ring, p.sq_off.tail)[0]
+        self.to_submit = 0
+        self.next_user_data = 1
+        # user_data -> [submit time, objects the kernel may still be using]
+        self.pending = {}
+        self.completed = {}
+        self.fixed_buffers = 0
+        self.supported_ops = self.probe()
+
+    def __len__(self):
+        return len(self.pending)
+
+    # ask the kernel which opcodes it implements,
+    # kernels older than 5.6 cannot tell us so we assume the 5.1 set
+
+    def probe(self):
+        max_ops = 256
+        probe_buf = ctypes.create_string_buffer(16 + max_ops * 8)
+        try:
+            sys_io_uring(NR_io_uring_register, self.fd, IORING_REGISTER_PROBE,
+                         probe_buf, max_ops)
+        except OSError:
+            return set([op.NOP, op.FSYNC, op.READ_FIXED, op.WRITE_FIXED])
+        raw = probe_buf.raw
+        ops_len = raw[1]
+        supported = set()
+        for k in range(0, ops_len):
+            (opcode, _, opflags, _) = struct.unpack_from('=BBHI', raw, 16 + k * 8)
+            if opflags & IO_URING_OP_SUPPORTED:
+                supported.add(opcode)
+        return supported
+
+    def supports(self, opcode):
+        return opcode in self.supported_ops
+
+    # register (address, length) pairs as fixed buffers,
+    # buf_index in prep_read/prep_write is an index into this list.
+    # This can fail with ENOMEM if RLIMIT_MEMLOCK is too low,
+    # in which case the caller should just use unregistered buffers.
+
+    def register_buffers(self, regions):
+        self.unregister_buffers()
+        iovecs = (iovec * len(regions))()
+        for k, (addr, length) in enumerate(regions):
+            iovecs[k].iov_base = addr
+            iovecs[k].iov_len = length
+        sys_io_uring(NR_io_uring_register, self.fd, IORING_REGISTER_BUFFERS,
+                     iovecs, len(regions))
+        self.fixed_buffers = len(regions)
+
+    def unregister_buffers(self):
+        if self.fixed_buffers:
+            self.fixed_buffers = 0
+            sys_io_uring(NR_io_uring_register, self.fd, IORING_UNREGISTER_BUFFERS, None, 0)
+
+    # fill in the next submission queue entry, returns its user_data tag
+    # "keep" is referenced until the request completes (e.g. a pathname)
+
+    def prep(self, opcode, fd, addr=0, length=0, offset=0, op_flags=0, buf_index=0, keep=None):
+        # never have more requests outstanding than there are ring entries,
+        # so that neither queue can overflow
+        while len(self.pending) >= self.entries:
+            self.submit(min_complete=1)
+            self.reap()
+        index = self.sq_tail & self.sq_mask
+        user_data = self.next_user_data
+        self.next_user_data += 1
+        struct.pack_into(SQE_FORMAT, self.sqes, index * SQE_SIZE,
+                         opcode, 0, 0, fd, offset & 0xffffffffffffffff, addr,
+                         length, op_flags, user_data, buf_index, 0, 0, 0, 0)
+        U32.pack_into(self.sq_ring, self.sq_off.array + index * U32.size, index)
+        self.sq_tail = (self.sq_tail + 1) & 0xffffffff
+        U32.pack_into(self.sq_ring, self.sq_off.tail, self.sq_tail)
+        self.pending[user_data] = [None, keep]
+        self.to_submit += 1
+        return user_data
+
+    def prep_read(self, fd, addr, length, offset, buf_index=None):
+        if buf_index is None:
+            return self.prep(op.READ, fd, addr, length, offset)
+        return self.prep(op.READ_FIXED, fd, addr, length, offset, buf_index=buf_index)
+
+    def prep_write(self, fd, addr, length, offset, buf_index=None):
+        if buf_index is None:
+            return self.prep(op.WRITE, fd, addr, length, offset)
+        return self.prep(op.WRITE_FIXED, fd, addr, length, offset, buf_index=buf_index)
+
+    def prep_fsync(self, fd, datasync=False):
+        return self.prep(op.FSYNC, fd, op_flags=(IORING_FSYNC_DATASYNC if datasync else 0))
+
+    def prep_openat(self, path, flags, mode=0o777, dir_fd=AT_FDCWD):
+        cpath = ctypes.create_string_buffer(os.fsencode(path))
+        return self.prep(op.OPENAT, dir_fd, ctypes.addressof(cpath), mode,
+                         op_flags=flags | os.O_CLOEXEC, keep=cpath)
+
+    def prep_close(self, fd):
+        return self.prep(op.CLOSE, fd)
+
+    # hand every prepared request to the kernel and,
+    # if min_complete > 0, wait until that many have completed
+
+    def submit(self, min_complete=0):
+        now = time.perf_counter()
+        if self.to_submit:
+            for user_data in range(self.next_user_data - self.to_submit, self.next_user_data):
+                self.pending[user_data][0] = now
+        enter_flags = IORING_ENTER_GETEVENTS if min_complete > 0 else 0
+        submitted = sys_io_uring(NR_io_uring_enter, self.fd, self.to_submit,
+                                 min_complete, enter_flags, None, 0)
+        self.to_submit -= submitted
+        return submitted
+
+    # move every available completion off the completion queue
+
+    def reap(self):
+        cq_head = U32.unpack_from(self.cq_ring, self.cq_off.head)[0]
+        cq_tail = U32.unpack_from(self.cq_ring, self.cq_off.tail)[0]
+        if cq_head == cq_tail:
+            return 0
+        now = time.perf_counter()
+        reaped = 0
+        while cq_head != cq_tail:
+            (user_data, res, flags) = struct.unpack_from(
+                    CQE_FORMAT, self.cq_ring, self.cq_off.cqes + (cq_head & self.cq_mask) * CQE_SIZE)
+            (submit_time, _) = self.pending.pop(user_data)
+            self.completed[user_data] = UringCompletion(user_data, res, submit_time, now)
+            cq_head = (cq_head + 1) & 0xffffffff
+            reaped += 1
+        U32.pack_into(self.cq_ring, self.cq_off.head, cq_head)
+        return reaped
+
+    # submit everything that is prepared and wait for all outstanding
+    # requests, returns their completions in submission order.
+    # Completions are reaped as they arrive rather than all at once,
+    # so each one gets its own completion timestamp.
+
+    def complete_all(self):
+        self.submit(min_complete=0)
+        while self.pending:
+            if self.reap() == 0:
+                self.submit(min_complete=1)
+        done = [self.completed[k] for k in sorted(self.completed.keys())]
+        self.completed = {}
+        return done
+
+    # run a single request to completion and return its result
+
+    def run(self, user_data):
+        completions = self.complete_all()
+        for c in completions:
+            if c.user_data == user_data:
+                return c.check()
+        raise FsDriftException('io_uring request %d never completed' % user_data)
+
+    def open(self, path, flags, mode=0o777, dir_fd=AT_FDCWD):
+        return self.run(self.prep_openat(path, flags, mode, dir_fd))
+
+    def close(self):
+        if self.fd < 0:
+            return
+        if self.pending:
+            self.complete_all()
+        self.unregister_buffers()
+        self.sqes.close()
+        if self.cq_ring is not self.sq_ring:
+            self.cq_ring.close()
+        self.sq_ring.close()
+        os.close(self.fd)
+        self.fd = -1
+
+
+if __name__ == '__main__':
+    import tempfile
+    from fs_drift.buffer_pool import AlignedBufferPool
+    try:
+        ring = IoUring(8)
+    except OSError as e:
+        print('io_uring not available here (%s), skipping unit test' % os.strerror(e.errno))
+        raise SystemExit(0)
+    assert(ring.entries >= 8)
+    assert(ring.supports(op.FSYNC))
+    pool = AlignedBufferPool(4096, count=4)
+    addrs = [pool.address(k) for k in range(0, len(pool))]
+    for k in range(0, 4):
+        pool.fill(k, bytes([ord('a') + k]) * 4096)
+    fixed = True
+    try:
+        ring.register_buffers([(a, pool.buf_size) for a in addrs])
+    except OSError:
+        fixed = False
+    with tempfile.TemporaryDirectory() as d:
+        fn = os.path.join(d, 'f')
+        if ring.supports(op.OPENAT):
+            fd = ring.open(fn, os.O_CREAT | os.O_RDWR)
+        else:
+            fd = os.open(fn, os.O_CREAT | os.O_RDWR)
+        # a batch of writes at different offsets, all submitted at once
+        tags = [ring.prep_write(fd, addrs[k], 4096, (3 - k) * 4096,
+                                buf_index=(k if fixed else None))
+                for k in range(0, 4)]
+        assert(len(ring) == 4)
+        done = ring.complete_all()
+        assert([c.user_data for c in done] == tags)
+        for c in done:
+            assert(c.check() == 4096)
+            assert(c.latency() >= 0.0)
+        assert(len(ring) == 0)
+        ring.run(ring.prep_fsync(fd, datasync=True))
+        with open(fn, 'rb') as f:
+            assert(f.read() == b'd' * 4096 + b'c' * 4096 + b'b' * 4096 + b'a' * 4096)
+        # read it back into buffer 0 and past EOF
+        tags = [ring.prep_read(fd, addrs[0], 4096, 4096), ring.prep_read(fd, addrs[1], 4096, 1 << 20)]
+        done = ring.complete_all()
+        assert(done[0].check() == 4096 and done[1].check() == 0)
+        assert(bytes(pool.view(0, 4096)) == b'c' * 4096)
+        # errors come back as negative errno
+        try:
+            ring.run(ring.prep_read(-1, addrs[0], 4096, 0))
+            assert(False)
+        except OSError as e:
+            assert(e.errno == errno.EBADF)
+        if ring.supports(op.CLOSE):
+            ring.run(ring.prep_close(fd))
+        else:
+            os.close(fd)
+        # more requests than ring entries are submitted in several pieces
+        fd = os.open(fn, os.O_RDONLY)
+        for k in range(0, 3 * ring.entries):
+            ring.prep_read(fd, addrs[k % 4], 4096, (k % 4) * 4096)
+        assert(all(c.check() == 4096 for c in ring.complete_all()))
+        os.close(fd)
+    ring.close()
+    pool.close()
+    print('io_uring unit test passed')
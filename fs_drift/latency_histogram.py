@@ -0,0 +1,469 @@
+# latency_histogram.py - fixed-size, mergeable response-time histograms
+#
+# keeping every response time in memory until the end of the run does not
+# scale to long runs at high op rates, so each worker also counts response
+# times in a histogram per op type, like HdrHistogram does: values (in
+# microseconds) below 2^b are counted exactly, and above that each power of
+# two is split into 2^(b-1) equal-width buckets, so every bucket is narrower
+# than 1/2^(b-1) of the values in it.  b is chosen from the number of
+# significant decimal digits wanted.  Memory use is fixed no matter how
+# many ops are counted, and two histograms with the same precision merge
+# losslessly by adding their bucket counts, so histograms from intervals,
+# threads and hosts can be combined afterwards.
+# A LatencyTimeline keeps the histograms of each --report-interval in
+# sparse form, so cluster-wide percentiles over time can be computed
+# without copying response time logs from every host.
+
+import math
+import array
+
+import numpy
+
+from fs_drift.common import FsDriftException
+
+USEC_PER_SEC = 1000000
+
+# percentiles reported for each op type
+
+report_percentiles = [50.0, 90.0, 99.0, 99.9]
+
+
+class LatencyHistogram:
+
+    # longest response time that is told apart from longer ones, about 19 hours
+
+    max_usec = (1 << 36) - 1
+
+    def __init__(self, digits=2):
+        if digits < 1 or digits > 5:
+            raise FsDriftException('latency histogram precision must be 1 to 5 significant digits')
+        self.digits = digits
+        self.sub_bits = int(math.ceil(math.log2(2 * 10 ** digits)))
+        self.half = 1 << (self.sub_bits - 1)
+        top_exponent = max(LatencyHistogram.max_usec.bit_length() - self.sub_bits, 0)
+        # a Python array, not a NumPy one, because indexing it
+        # for every op is several times faster
+        self.buckets = array.array('q', bytes(8 * (top_exponent + 2) * self.half))
+        self.total = 0
+        self.sum_usec = 0
+        self.min_usec = None
+        self.max_seen_usec = 0
+
+    def __len__(self):
+        return self.total
+
+    # NumPy view of the bucket counts, for whole-histogram operations
+
+    @property
+    def counts(self):
+        return numpy.frombuffer(self.buckets, dtype=numpy.int64)
+
+    def index(self, usec):
+        e = usec.bit_length() - self.sub_bits
+        if e < 0:
+            e = 0
+        return e * self.half + (usec >> e)
+
+    # smallest value counted in bucket "index", and the bucket width
+
+    def bucket_bounds(self, index):
+        e = max(index // self.half - 1, 0)
+        return ((index - e * self.half) << e, 1 << e)
+
+    # returns the index of the bucket the value was counted in
+
+    def record(self, seconds):
+        usec = int(seconds * USEC_PER_SEC)
+        if usec > LatencyHistogram.max_usec:
+            usec = LatencyHistogram.max_usec
+        elif usec < 0:
+            usec = 0
+        # same as index(), inlined since this runs for every op
+        e = usec.bit_length() - self.sub_bits
+        if e < 0:
+            e = 0
+        index = e * self.half + (usec >> e)
+        self.buckets[index] += 1
+        self.total += 1
+        self.sum_usec += usec
+        if usec > self.max_seen_usec:
+            self.max_seen_usec = usec
+        if self.min_usec == None or usec < self.min_usec:
+            self.min_usec = usec
+        return index
+
+    def merge(self, other):
+        if other.digits != self.digits:
+            raise FsDriftException('cannot merge latency histograms with %d and %d significant digits' %
+                                   (self.digits, other.digits))
+        counts = self.counts
+        counts += other.counts
+        del counts
+        self.total += other.total
+        self.sum_usec += other.sum_usec
+        if other.min_usec != None and (self.min_usec == None or other.min_usec < self.min_usec):
+            self.min_usec = other.min_usec
+        self.max_seen_usec = max(self.max_seen_usec, other.max_seen_usec)
+
+    def reset(self):
+        counts = self.counts
+        counts[:] = 0
+        del counts
+        self.total = 0
+        self.sum_usec = 0
+        self.min_usec = None
+        self.max_seen_usec = 0
+
+    # response time (usec) that the given percentages of ops did not exceed,
+    # the middle of the bucket the percentile falls in,
+    # but never outside the smallest and largest values seen,
+    # and exactly the largest one for the 100th percentile
+
+    def percentiles(self, pcts):
+        if self.total == 0:
+            return [0 for p in pcts]
+        cumulative = numpy.cumsum(self.counts)
+        ranks = [max(int(math.ceil(p * self.total / 100.0)), 1) for p in pcts]
+        result = []
+        for (rank, index) in zip(ranks, numpy.searchsorted(cumulative, ranks).tolist()):
+            if rank >= self.total:
+                result.append(self.max_seen_usec)
+                continue
+            (low, width) = self.bucket_bounds(index)
+            value = low + (width - 1) // 2
+            result.append(min(max(value, self.min_usec), self.max_seen_usec))
+        return result
+
+    def mean_usec(self):
+        if self.total == 0:
+            return 0.0
+        return self.sum_usec / float(self.total)
+
+    # ops, mean, report_percentiles and max, all in usec
+
+    def summary(self):
+        s = {'ops': self.total, 'mean-usec': self.mean_usec(), 'max-usec': self.max_seen_usec}
+        for (p, v) in zip(report_percentiles, self.percentiles(report_percentiles)):
+            s['p%g-usec' % p] = v
+        return s
+
+    # compact form that only holds the non-empty buckets:
+    # (total, sum, min, max, bucket indexes, bucket counts)
+
+    def to_sparse(self):
+        counts = self.counts
+        nonzero = numpy.nonzero(counts)[0]
+        return (self.total, self.sum_usec, self.min_usec, self.max_seen_usec,
+                nonzero.astype(numpy.int32), counts[nonzero])
+
+    def merge_sparse(self, sparse):
+        (total, sum_usec, min_usec, max_usec, indexes, bucket_counts) = sparse
+        counts = self.counts
+        counts[indexes] += bucket_counts
+        del counts
+        self.total += total
+        self.sum_usec += sum_usec
+        if min_usec != None and (self.min_usec == None or min_usec < self.min_usec):
+            self.min_usec = min_usec
+        self.max_seen_usec = max(self.max_seen_usec, max_usec)
+
+    # lossless JSON form, only non-empty buckets are listed
+
+    def to_json_obj(self):
+        nonzero = numpy.nonzero(self.counts)[0]
+        return {
+            'digits': self.digits,
+            'total': self.total,
+            'sum-usec': self.sum_usec,
+            'min-usec': self.min_usec,
+            'max-usec': self.max_seen_usec,
+            'buckets': dict(zip([str(k) for k in nonzero.tolist()], self.counts[nonzero].tolist()))}
+
+    @staticmethod
+    def from_json_obj(d):
+        h = LatencyHistogram(d['digits'])
+        for (k, v) in d['buckets'].items():
+            h.buckets[int(k)] = v
+        h.total = d['total']
+        h.sum_usec = d['sum-usec']
+        h.min_usec = d['min-usec']
+        h.max_seen_usec = d['max-usec']
+        return h
+
+
+# one histogram per op type, created when the op type is first seen
+
+class OpLatencies:
+
+    def __init__(self, digits=2):
+        self.digits = digits
+        self.by_op = {}
+
+    def __len__(self):
+        return sum([len(h) for h in self.by_op.values()])
+
+    def record(self, opname, seconds):
+        try:
+            h = self.by_op[opname]
+        except KeyError:
+            h = LatencyHistogram(self.digits)
+            self.by_op[opname] = h
+        return h.record(seconds)
+
+    def histogram(self, opname):
+        try:
+            return self.by_op[opname]
+        except KeyError:
+            h = LatencyHistogram(self.digits)
+            self.by_op[opname] = h
+            return h
+
+    def merge(self, other):
+        for (opname, h) in other.by_op.items():
+            self.histogram(opname).merge(h)
+
+    # one histogram of all op types together
+
+    def all_ops(self):
+        h = LatencyHistogram(self.digits)
+        for oph in self.by_op.values():
+            h.merge(oph)
+        return h
+
+    def reset(self):
+        for h in self.by_op.values():
+            h.reset()
+
+    # per op type: ops, mean, report_percentiles and max, all in usec
+
+    def summary(self):
+        d = {}
+        for opname in sorted(self.by_op.keys()):
+            h = self.by_op[opname]
+            if h.total == 0:
+                continue
+            d[opname] = h.summary()
+        return d
+
+    def to_json_obj(self):
+        return dict([(opname, h.to_json_obj()) for (opname, h) in self.by_op.items() if h.total > 0])
+
+    @staticmethod
+    def from_json_obj(d, digits=2):
+        ol = OpLatencies(digits)
+        for (opname, hd) in d.items():
+            ol.by_op[opname] = LatencyHistogram.from_json_obj(hd)
+            ol.digits = hd['digits']
+        return ol
+
+    # table of the summary, one line per op type
+
+    def format_table(self):
+        return format_summary_table('latency (usec)', self.summary().items())
+
+
+# table with one line for each (name, summary) pair
+
+def format_summary_table(title, rows):
+    lines = ['%-16s %10s %10s %10s %10s %10s %10s' %
+             (title, 'ops', 'p50', 'p90', 'p99', 'p99.9', 'max')]
+    for (name, s) in rows:
+        lines.append('%-16s %10d %10d %10d %10d %10d %10d' %
+                     (name, s['ops'], s['p50-usec'], s['p90-usec'], s['p99-usec'],
+                      s['p99.9-usec'], s['max-usec']))
+    return '\n'.join(lines)
+
+
+# merge two sparse histograms (see LatencyHistogram.to_sparse)
+
+def merge_sparse_pair(a, b):
+    (total, sum_usec, min_usec, max_usec, indexes, bucket_counts) = a
+    (total2, sum_usec2, min_usec2, max_usec2, indexes2, bucket_counts2) = b
+    (merged_indexes, inverse) = numpy.unique(numpy.concatenate((indexes, indexes2)), return_inverse=True)
+    merged_counts = numpy.bincount(inverse, weights=numpy.concatenate((bucket_counts, bucket_counts2)))
+    mins = [m for m in (min_usec, min_usec2) if m != None]
+    return (total + total2, sum_usec + sum_usec2, min(mins) if mins else None, max(max_usec, max_usec2),
+            merged_indexes.astype(numpy.int32), merged_counts.astype(numpy.int64))
+
+
+# response time histograms for each report interval of a thread, kept sparse.
+# memory must not grow without limit on long runs, so once there are
+# more than max_slots intervals, pairs of neighbouring intervals are merged
+# and each slot covers twice as many report intervals from then on.
+# Slot boundaries stay on multiples of the slot width, so timelines of
+# threads that ended up with different widths still line up when merged
+
+class LatencyTimeline:
+
+    max_slots = 256
+
+    def __init__(self, digits=2, interval=1.0):
+        self.digits = digits
+        self.interval = float(interval)
+        # report intervals per slot
+        self.width = 1
+        # one dictionary per slot, mapping op name to sparse histogram
+        self.slots = []
+
+    def __len__(self):
+        return len(self.slots)
+
+    # add the histograms of the report interval starting "start" seconds into the test
+
+    def add(self, start, latencies):
+        k = int(round(start / self.interval)) // self.width
+        while k >= LatencyTimeline.max_slots:
+            self.coarsen(self.width * 2)
+            k //= 2
+        while len(self.slots) <= k:
+            self.slots.append({})
+        slot = self.slots[k]
+        for (opname, h) in latencies.by_op.items():
+            if h.total == 0:
+                continue
+            sparse = h.to_sparse()
+            try:
+                slot[opname] = merge_sparse_pair(slot[opname], sparse)
+            except KeyError:
+                slot[opname] = sparse
+
+    # merge slots so each covers "width" report intervals
+
+    def coarsen(self, width):
+        factor = width // self.width
+        if factor <= 1:
+            return
+        coarse = []
+        for (k, slot) in enumerate(self.slots):
+            if k % factor == 0:
+                coarse.append(dict(slot))
+                continue
+            merged = coarse[-1]
+            for (opname, sparse) in slot.items():
+                try:
+                    merged[opname] = merge_sparse_pair(merged[opname], sparse)
+                except KeyError:
+                    merged[opname] = sparse
+        self.slots = coarse
+        self.width = width
+
+    # summaries per op type for each slot of the merged timelines of many threads,
+    # as a list of dictionaries with the slot start time and duration in seconds
+
+    @staticmethod
+    def merged_summaries(timelines):
+        timelines = [t for t in timelines if t != None and len(t) > 0]
+        if len(timelines) == 0:
+            return []
+        width = max([t.width for t in timelines])
+        for t in timelines:
+            t.coarsen(width)
+        summaries = []
+        duration = timelines[0].interval * width
+        # merge one slot at a time, so only one set of full-size histograms is needed
+        for k in range(0, max([len(t) for t in timelines])):
+            merged = OpLatencies(timelines[0].digits)
+            for t in timelines:
+                if k < len(t):
+                    for (opname, sparse) in t.slots[k].items():
+                        merged.histogram(opname).merge_sparse(sparse)
+            summaries.append({'start-sec': k * duration, 'duration-sec': duration,
+                              'latency': merged.summary()})
+        return summaries
+
+
+if __name__ == '__main__':
+    import json
+    import time
+
+    for digits in [1, 2, 3]:
+        h = LatencyHistogram(digits)
+        # every value maps into a bucket that contains it,
+        # and buckets are narrow relative to the values in them
+        for usec in list(range(0, 5000)) + [(1 << k) + j for k in range(12, 36) for j in (-1, 0, 1, 12345)]:
+            index = h.index(usec)
+            (low, width) = h.bucket_bounds(index)
+            assert(low <= usec < low + width)
+            assert(width == 1 or width <= low / (10.0 ** digits))
+            assert(index < len(h.counts))
+        assert(h.index(LatencyHistogram.max_usec) == len(h.counts) - 1)
+
+    # percentiles agree with exact ones to within bucket precision
+    rng = numpy.random.default_rng(11)
+    samples = rng.lognormal(mean=-7.0, sigma=1.5, size=200000)
+    h = LatencyHistogram(2)
+    for s in samples.tolist():
+        h.record(s)
+    exact = numpy.percentile((samples * USEC_PER_SEC).astype(numpy.int64), report_percentiles + [100.0])
+    got = h.percentiles(report_percentiles + [100.0])
+    for (e, g) in zip(exact.tolist(), got):
+        assert(abs(g - e) <= 1 + 0.01 * e)
+    assert(got[-1] == h.max_seen_usec and len(h) == len(samples))
+
+    # merging pieces gives exactly the histogram of the whole
+    pieces = [OpLatencies(2) for k in range(0, 4)]
+    whole = OpLatencies(2)
+    for (k, s) in enumerate(samples.tolist()):
+        opname = ['read', 'create'][k % 2]
+        pieces[k % 4].record(opname, s)
+        whole.record(opname, s)
+    merged = OpLatencies(2)
+    for p in pieces:
+        merged.merge(p)
+    for opname in ['read', 'create']:
+        assert((merged.by_op[opname].counts == whole.by_op[opname].counts).all())
+    assert(merged.summary() == whole.summary())
+    # and so does a trip through JSON
+    restored = OpLatencies.from_json_obj(json.loads(json.dumps(merged.to_json_obj())))
+    assert(restored.summary() == whole.summary())
+    print(whole.format_table())
+    try:
+        LatencyHistogram(2).merge(LatencyHistogram(3))
+        assert(False)
+    except FsDriftException:
+        pass
+
+    # sparse histograms merge like full-size ones
+    h = LatencyHistogram(2)
+    for s in samples[:1000].tolist():
+        h.record(s)
+    h2 = LatencyHistogram(2)
+    for s in samples[1000:3000].tolist():
+        h2.record(s)
+    whole_h = LatencyHistogram(2)
+    whole_h.merge_sparse(merge_sparse_pair(h.to_sparse(), h2.to_sparse()))
+    h.merge(h2)
+    assert((whole_h.counts == h.counts).all() and whole_h.summary() == h.summary())
+
+    # a timeline of many intervals is coarsened to a bounded number of slots,
+    # and timelines of different widths line up when merged
+    timelines = []
+    for (thread, intervals) in enumerate([1000, 300, 40]):
+        t = LatencyTimeline(2, 5.0)
+        for k in range(0, intervals):
+            ol = OpLatencies(2)
+            # interval k has response times of about k msec
+            ol.record('read', 0.001 * (k + 1))
+            ol.record('create', 0.001 * (k + 1))
+            t.add(k * 5.0 + 0.01, ol)
+        assert(len(t) <= LatencyTimeline.max_slots)
+        timelines.append(t)
+    assert(timelines[0].width == 4 and timelines[1].width == 2 and timelines[2].width == 1)
+    summaries = LatencyTimeline.merged_summaries(timelines)
+    assert(len(summaries) == 250 and summaries[1]['start-sec'] == 20.0)
+    # the first slot has intervals 0-3 of the first 2 threads and of the third
+    assert(summaries[0]['latency']['read']['ops'] == 12)
+    assert(summaries[0]['latency']['read']['max-usec'] == 4000)
+    assert(summaries[-1]['latency']['create']['ops'] == 4)
+    assert(sum([s['latency']['read']['ops'] for s in summaries]) == 1340)
+
+    # recording cost
+    n = 500000
+    values = rng.exponential(0.001, size=n).tolist()
+    ol = OpLatencies(2)
+    start = time.perf_counter()
+    for v in values:
+        ol.record('read', v)
+    print('%5.0f nsec per recorded op, %d bytes per histogram' %
+          ((time.perf_counter() - start) * 1.0e9 / n, ol.by_op['read'].counts.nbytes))
+    print('latency_histogram unit test passed')
@@ -0,0 +1,354 @@
+# live_stream.py - stream per-host live counters to the test driver
+#
+# in a multi-host test, the test driver only sees results when every host
+# has finished and written its result pickle to the network shared dir.
+# With --live-stream-port, the test driver listens on that TCP port and
+# each host master connects to it and sends the counter deltas it samples
+# every --live-interval seconds (see telemetry.py): ops, bytes, errors
+# and the non-zero buckets of the live response time histogram.
+# Messages are one JSON object per line.
+#
+# The test driver keeps a rolling cluster-wide time series: interval k
+# is added up once every host has sent its sample k, or has finished.
+# Then the driver prints a line for it and appends it to
+# live-cluster-rates.json in the network shared dir, which is valid JSON
+# after every append. If some host has not sent sample k by the time
+# other hosts are lag_intervals samples ahead, interval k is added up
+# without it, and the host is named as missing, so a host that is stuck
+# or cannot keep up shows within seconds. Samples arriving after their
+# interval was added up are dropped.
+#
+# Streaming is best-effort: if a host cannot connect or a send fails,
+# the host logs a warning and carries on with the test.
+
+import os
+import json
+import socket
+import selectors
+import threading
+
+import numpy
+
+from fs_drift.common import FsDriftException
+from fs_drift.telemetry import live_summary_len, live_summary, LIVE_BUCKETS
+
+LIVE_RATES_FILENAME = 'live-cluster-rates.json'
+
+# seconds a host master waits to connect to or send to the test driver
+
+SEND_TIMEOUT = 5.0
+
+
+# host master side, one connection to the test driver
+
+class LiveStreamSender:
+
+    def __init__(self, address, host, log):
+        self.host = host
+        self.log = log
+        self.seq = 0
+        self.sock = socket.create_connection(tuple(address), timeout=SEND_TIMEOUT)
+
+    def send_msg(self, msg):
+        if self.sock == None:
+            return
+        try:
+            self.sock.sendall((json.dumps(msg) + '\n').encode('ascii'))
+        except OSError as e:
+            self.log.warning('stopped streaming live counters to test driver: %s' % str(e))
+            self.sock.close()
+            self.sock = None
+
+    # delta is a row of counter deltas of all workers on this host
+    # covering secs seconds
+
+    def send(self, elapsed, secs, delta):
+        self.seq += 1
+        buckets = delta[LIVE_BUCKETS:]
+        nonzero = numpy.flatnonzero(buckets)
+        self.send_msg({'host': self.host, 'seq': self.seq, 'elapsed': elapsed, 'secs': secs,
+                       'counters': delta[:LIVE_BUCKETS].tolist(),
+                       'buckets': [nonzero.tolist(), buckets[nonzero].tolist()]})
+
+    def close(self):
+        self.send_msg({'host': self.host, 'done': True})
+        if self.sock != None:
+            self.sock.close()
+            self.sock = None
+
+
+# test driver side, state of one host
+
+class HostStream:
+
+    def __init__(self, name):
+        self.name = name
+        self.last_seq = 0
+        self.done = False
+        self.samples = {}
+
+
+# test driver side, collects samples from all hosts
+
+class LiveStreamCollector:
+
+    def __init__(self, hosts, interval, log, rates_path=None,
+                 port=0, bind_host='', lag_intervals=3, quiet=False):
+        self.hosts = dict([(h, HostStream(h)) for h in hosts])
+        self.interval = interval
+        self.log = log
+        self.row_len = live_summary_len
+        self.lag_intervals = lag_intervals
+        self.quiet = quiet
+        self.next_seq = 1
+        self.series = []
+        self.dropped = 0
+        self.rates_file = None
+        if rates_path != None:
+            self.rates_file = open(rates_path, 'w')
+            self.rates_file.write('[]\n')
+            self.rates_file.flush()
+        self.listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.listener.bind((bind_host, port))
+        self.listener.listen(max(len(hosts), 1))
+        self.listener.setblocking(False)
+        self.port = self.listener.getsockname()[1]
+        self.selector = selectors.DefaultSelector()
+        self.selector.register(self.listener, selectors.EVENT_READ, None)
+        self.lock = threading.Lock()
+        self.stopping = False
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def run(self):
+        while not self.stopping:
+            for (key, _) in self.selector.select(timeout=0.2):
+                if key.data == None:
+                    try:
+                        (conn, _) = self.listener.accept()
+                    except BlockingIOError:
+                        continue
+                    conn.setblocking(False)
+                    self.selector.register(conn, selectors.EVENT_READ, [b''])
+                else:
+                    self.read_from(key.fileobj, key.data)
+
+    def read_from(self, conn, pending):
+        try:
+            data = conn.recv(65536)
+        except BlockingIOError:
+            return
+        except OSError:
+            data = b''
+        if data == b'':
+            self.selector.unregister(conn)
+            conn.close()
+            return
+        self.parse(pending, data)
+
+    # pending holds the start of a message not yet terminated by a newline
+
+    def parse(self, pending, data):
+        lines = (pending[0] + data).split(b'\n')
+        pending[0] = lines[-1]
+        for line in lines[:-1]:
+            try:
+                self.receive(json.loads(line))
+            except (ValueError, KeyError, TypeError, IndexError, FsDriftException) as e:
+                self.log.warning('bad live counter message %s: %s' % (line[:100], str(e)))
+
+    # account for one message from a host master
+
+    def receive(self, msg):
+        with self.lock:
+            h = self.hosts.get(msg['host'])
+            if h == None:
+                raise FsDriftException('host %s is not in host set' % msg['host'])
+            if msg.get('done'):
+                h.done = True
+            else:
+                seq = msg['seq']
+                if seq < self.next_seq:
+                    self.dropped += 1
+                    return
+                delta = numpy.zeros(self.row_len, dtype=numpy.int64)
+                delta[:LIVE_BUCKETS] = msg['counters']
+                (indexes, counts) = msg['buckets']
+                delta[numpy.array(indexes, dtype=numpy.int64) + LIVE_BUCKETS] = counts
+                h.samples[seq] = (msg['secs'], delta)
+                h.last_seq = max(h.last_seq, seq)
+            self.add_up_intervals(False)
+
+    # add up every interval that all hosts have reported,
+    # or that some hosts are too far ahead of to wait for
+
+    def add_up_intervals(self, final):
+        while True:
+            most_recent = max([h.last_seq for h in self.hosts.values()] + [0])
+            waiting = [h for h in self.hosts.values()
+                       if h.last_seq < self.next_seq and not h.done]
+            if self.next_seq > most_recent:
+                return
+            if waiting and not final and most_recent - self.next_seq < self.lag_intervals:
+                return
+            self.add_up(self.next_seq)
+            self.next_seq += 1
+
+    def add_up(self, seq):
+        cluster = numpy.zeros(self.row_len, dtype=numpy.int64)
+        cluster_secs = 0.0
+        host_rates = {}
+        missing = []
+        for h in sorted(self.hosts.keys()):
+            sample = self.hosts[h].samples.pop(seq, None)
+            if sample == None:
+                if not self.hosts[h].done:
+                    missing.append(h)
+                continue
+            (secs, delta) = sample
+            cluster += delta
+            cluster_secs = max(cluster_secs, secs)
+            s = live_summary(seq * self.interval, secs, delta)
+            host_rates[h] = dict([(k, s[k]) for k in ['ops-per-sec', 'MiB-per-sec', 'errors-per-sec']])
+        entry = live_summary(seq * self.interval, cluster_secs, cluster)
+        # cluster rates are the sum of host rates, hosts may sample at slightly different times
+        for k in ['ops-per-sec', 'MiB-per-sec', 'errors-per-sec']:
+            entry[k] = sum([r[k] for r in host_rates.values()])
+        entry['hosts'] = host_rates
+        entry['missing-hosts'] = missing
+        if missing and (self.series == [] or self.series[-1]['missing-hosts'] != missing):
+            self.log.warning('interval ending %.1f sec: no live counters from %s' %
+                             (entry['elapsed'], ','.join(missing)))
+        self.series.append(entry)
+        if not self.quiet:
+            print(LiveStreamCollector.format_entry(entry), flush=True)
+        if self.rates_file != None:
+            # overwrite the closing bracket so the file is always valid JSON
+            self.rates_file.seek(self.rates_file.tell() - 2)
+            if len(self.series) > 1:
+                self.rates_file.write(',')
+            self.rates_file.write('\n' + json.dumps(entry) + '\n]\n')
+            self.rates_file.flush()
+
+    @staticmethod
+    def format_entry(e):
+        line = ('%7.1f sec: cluster %10.1f ops/sec %9.3f MiB/sec %7.1f errors/sec   usec p50 %d p99 %d p99.9 %d' %
+                (e['elapsed'], e['ops-per-sec'], e['MiB-per-sec'], e['errors-per-sec'],
+                 e['p50-usec'], e['p99-usec'], e['p99.9-usec']))
+        if len(e['hosts']) > 1:
+            slowest = min(e['hosts'].keys(), key=lambda h: e['hosts'][h]['ops-per-sec'])
+            line += '   slowest %s %.1f ops/sec' % (slowest, e['hosts'][slowest]['ops-per-sec'])
+        if e['missing-hosts']:
+            line += '   missing %s' % ','.join(e['missing-hosts'])
+        return line
+
+    # hosts have all finished, add up what is left and stop listening
+
+    def stop(self):
+        self.stopping = True
+        self.thread.join()
+        for key in list(self.selector.get_map().values()):
+            if key.data != None:
+                while True:
+                    try:
+                        data = key.fileobj.recv(65536)
+                    except OSError:
+                        break
+                    if data == b'':
+                        break
+                    self.parse(key.data, data)
+            key.fileobj.close()
+        self.selector.close()
+        with self.lock:
+            self.add_up_intervals(True)
+        if self.dropped > 0:
+            self.log.info('%d live counter samples arrived too late to add up' % self.dropped)
+        if self.rates_file != None:
+            self.rates_file.close()
+            self.rates_file = None
+
+
+if __name__ == '__main__':
+    import multiprocessing
+    import tempfile
+    import time
+    from fs_drift.fsd_log import start_log
+    from fs_drift.telemetry import LIVE_OPS, LIVE_BYTES, LIVE_ERRORS
+
+    log = start_log('live_stream')
+    row_len = live_summary_len
+
+    # a host master that sends samples of ops_per_sample ops at bucket k,
+    # stalling for stall_secs after stall_after samples
+    def host_master(port, host, samples, ops_per_sample, k, stall_after, stall_secs):
+        sender = LiveStreamSender(('127.0.0.1', port), host, log)
+        for n in range(1, samples + 1):
+            if n == stall_after + 1:
+                time.sleep(stall_secs)
+            delta = numpy.zeros(row_len, dtype=numpy.int64)
+            delta[LIVE_OPS] = ops_per_sample
+            delta[LIVE_BYTES] = ops_per_sample * 4096
+            delta[LIVE_ERRORS] = 1 if host == 'h1' else 0
+            delta[LIVE_BUCKETS + k] = ops_per_sample
+            sender.send(n * 0.1, 0.1, delta)
+            time.sleep(0.02)
+        sender.close()
+
+    with tempfile.TemporaryDirectory() as d:
+        rates_path = os.path.join(d, LIVE_RATES_FILENAME)
+        hosts = ['h0', 'h1', 'h2', 'h3']
+        collector = LiveStreamCollector(hosts, 0.1, log, rates_path=rates_path,
+                                        bind_host='127.0.0.1', lag_intervals=3)
+        collector.start()
+        # h2 stalls after 2 samples until the others have finished,
+        # h3 never connects
+        procs = [multiprocessing.Process(target=host_master,
+                                         args=(collector.port, 'h0', 10, 100, 20, 10, 0)),
+                 multiprocessing.Process(target=host_master,
+                                         args=(collector.port, 'h1', 10, 200, 30, 10, 0)),
+                 multiprocessing.Process(target=host_master,
+                                         args=(collector.port, 'h2', 10, 100, 40, 2, 1.0))]
+        for p in procs:
+            p.start()
+        # the rates file is valid JSON while hosts are still streaming
+        time.sleep(0.6)
+        with open(rates_path) as f:
+            partial = json.load(f)
+        assert(len(partial) >= 3)
+        assert(partial[0]['missing-hosts'] == ['h3'])
+        assert(abs(partial[0]['ops-per-sec'] - 4000.0) < 0.01)
+        assert('h2' in partial[2]['missing-hosts'])
+        for p in procs:
+            p.join()
+        hosts_done = [collector.hosts[h].done for h in hosts]
+        collector.stop()
+        assert(hosts_done == [True, True, True, False])
+        with open(rates_path) as f:
+            series = json.load(f)
+        assert(len(series) == 10)
+        assert(series == collector.series)
+        first = series[0]
+        assert(abs(first['elapsed'] - 0.1) < 0.001)
+        assert(sorted(first['hosts'].keys()) == ['h0', 'h1', 'h2'])
+        assert(abs(first['hosts']['h1']['ops-per-sec'] - 2000.0) < 0.01)
+        assert(abs(first['MiB-per-sec'] - 4000.0 * 4096 / 1048576) < 0.01)
+        assert(abs(first['errors-per-sec'] - 10.0) < 0.01)
+        # h0 and h2 samples are in lower buckets than h1
+        assert(first['p50-usec'] < first['p99-usec'])
+        # samples 3 onwards from h2 came after their intervals were added up
+        assert(collector.dropped > 0)
+        assert(all(['h2' in e['missing-hosts'] for e in series[2:7]]))
+        assert(series[-1]['missing-hosts'] == ['h3'])
+        print(LiveStreamCollector.format_entry(first))
+        assert('slowest h0' in LiveStreamCollector.format_entry(first))
+
+        # a host that cannot connect to the test driver finds out right away
+        try:
+            LiveStreamSender(('127.0.0.1', collector.port), 'h0', log)
+            assert(False)
+        except OSError:
+            pass
+    print('live_stream unit test passed')
@@ -0,0 +1,287 @@
+# metrics_exporter.py - Prometheus text format endpoint for a running test
+#
+# with --metrics-port, each host master serves http://host:port/metrics
+# while the test runs, so a long aging run can be scraped by Prometheus
+# and lined up with storage-side metrics on the same dashboards.
+# Everything comes from the live counter rows that the workers on this
+# host keep in shared memory (see telemetry.py), added up over workers:
+#
+#   fsdrift_<field>_total        every FSOPCounters field, in the order of
+#                                FSOPCounters.kvtuplelist(), so a counter
+#                                added there is exported without changes here
+#   fsdrift_op_latency_seconds   response time histogram per op type
+#   fsdrift_cpu_seconds_total    CPU time of workers and of the host master
+#   fsdrift_fs_*                 statvfs() of the top directory, fullness is
+#                                computed the same way as --fullness-limit-percent does
+#
+# FSOPCounters fields are copied to shared memory about once a second
+# (telemetry.counter_publish_secs), op counts and histograms as each op
+# completes. Histogram bucket bounds are powers of 2 microseconds, which
+# are also live bucket bounds, so bucket counts are exact. Response times
+# are counted in whole microseconds, rounded down, so an op counted at
+# u usec is under a bound b if u < b. The _sum of each histogram is
+# estimated from bucket midpoints.
+
+import os
+import resource
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import numpy
+
+from fs_drift.fsop import FSOPCtx, fs_fullness
+from fs_drift.fsop_counters import FSOPCounters
+from fs_drift.latency_histogram import LatencyHistogram, USEC_PER_SEC
+from fs_drift.telemetry import live_bucket_bounds, LIVE_OPS, LIVE_BYTES, LIVE_ERRORS
+from fs_drift.telemetry import LIVE_CPU_USER_USEC, LIVE_CPU_SYS_USEC
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# response time histogram bounds, 16 usec to about 134 sec
+
+latency_bounds_usec = [1 << k for k in range(4, 28)]
+
+
+def escape_label(v):
+    return str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def format_value(v):
+    if isinstance(v, (int, numpy.integer)):
+        return '%d' % v
+    return repr(float(v))
+
+
+class MetricsText:
+
+    def __init__(self, host):
+        self.host_label = 'host="%s"' % escape_label(host)
+        self.lines = []
+
+    def family(self, name, mtype, help_text):
+        self.lines.append('# HELP fsdrift_%s %s' % (name, help_text))
+        self.lines.append('# TYPE fsdrift_%s %s' % (name, mtype))
+
+    def sample(self, name, value, **labels):
+        label_list = [self.host_label] + ['%s="%s"' % (k, escape_label(v)) for (k, v) in sorted(labels.items())]
+        self.lines.append('fsdrift_%s{%s} %s' % (name, ','.join(label_list), format_value(value)))
+
+    def text(self):
+        return '\n'.join(self.lines) + '\n'
+
+
+# where each of latency_bounds_usec falls in a live histogram:
+# (number of live buckets wholly below each bound, bucket midpoints in usec)
+
+def live_bucket_layout(telemetry):
+    lows = numpy.array([live_bucket_bounds(j)[0]
+                        for j in range(0, telemetry.bucket_count + 1)], dtype=numpy.float64)
+    # the last live bucket also holds everything past the end of the histogram
+    lows[-1] = max(lows[-1], LatencyHistogram.max_usec + 1)
+    below = numpy.searchsorted(lows[1:], numpy.array(latency_bounds_usec), side='right')
+    midpoints = (lows[:-1] + lows[1:] - 1) / 2.0
+    return (below, midpoints)
+
+
+# the whole /metrics page for the workers on this host
+
+def format_metrics(host, telemetry, top_directory, layout=None):
+    if layout == None:
+        layout = live_bucket_layout(telemetry)
+    (below, midpoints) = layout
+    totals = telemetry.snapshot().sum(axis=0)
+    m = MetricsText(host)
+
+    m.family('ops_total', 'counter', 'ops completed')
+    m.sample('ops_total', totals[LIVE_OPS])
+    m.family('transferred_bytes_total', 'counter', 'bytes read or written by ops')
+    m.sample('transferred_bytes_total', totals[LIVE_BYTES])
+    m.family('errors_total', 'counter', 'ops that failed')
+    m.sample('errors_total', totals[LIVE_ERRORS])
+
+    counter_names = [k for (k, _) in FSOPCounters().kvtuplelist()][:telemetry.counter_count]
+    for (k, name) in enumerate(counter_names):
+        m.family('%s_total' % name, 'counter', 'FSOPCounters %s' % name)
+        m.sample('%s_total' % name, totals[telemetry.counters_at + k])
+
+    if telemetry.op_count > 0:
+        m.family('op_latency_seconds', 'histogram', 'response time by op type, _sum is estimated')
+    for opcode in range(0, telemetry.op_count):
+        at = telemetry.op_buckets(opcode)
+        buckets = totals[at:at + telemetry.bucket_count]
+        count = int(buckets.sum())
+        if count == 0:
+            continue
+        opname = FSOPCtx.opcode_to_opname.get(opcode, str(opcode))
+        cumulative = numpy.concatenate([[0], numpy.cumsum(buckets)])
+        for (usec, n) in zip(latency_bounds_usec, cumulative[below].tolist()):
+            m.sample('op_latency_seconds_bucket', n, op=opname, le=repr(usec / float(USEC_PER_SEC)))
+        m.sample('op_latency_seconds_bucket', count, op=opname, le='+Inf')
+        m.sample('op_latency_seconds_sum', float((buckets * midpoints).sum()) / USEC_PER_SEC, op=opname)
+        m.sample('op_latency_seconds_count', count, op=opname)
+
+    m.family('cpu_seconds_total', 'counter', 'CPU time used by fs-drift processes on this host')
+    if telemetry.counter_count > 0:
+        m.sample('cpu_seconds_total', totals[telemetry.cpu_at + LIVE_CPU_USER_USEC] / float(USEC_PER_SEC),
+                 process='workers', mode='user')
+        m.sample('cpu_seconds_total', totals[telemetry.cpu_at + LIVE_CPU_SYS_USEC] / float(USEC_PER_SEC),
+                 process='workers', mode='system')
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    m.sample('cpu_seconds_total', usage.ru_utime, process='master', mode='user')
+    m.sample('cpu_seconds_total', usage.ru_stime, process='master', mode='system')
+
+    try:
+        fs_stats = os.statvfs(top_directory)
+        m.family('fs_fullness_ratio', 'gauge', 'fraction of filesystem blocks in use')
+        m.sample('fs_fullness_ratio', fs_fullness(fs_stats))
+        m.family('fs_size_bytes', 'gauge', 'filesystem size')
+        m.sample('fs_size_bytes', fs_stats.f_blocks * fs_stats.f_frsize)
+        m.family('fs_free_bytes', 'gauge', 'filesystem free space')
+        m.sample('fs_free_bytes', fs_stats.f_bfree * fs_stats.f_frsize)
+    except OSError:
+        pass
+    return m.text()
+
+
+class MetricsRequestHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        exporter = self.server.exporter
+        if self.path.split('?')[0] not in ['/metrics', '/']:
+            self.send_error(404)
+            return
+        body = exporter.page().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, fmt, *args):
+        self.server.exporter.log.debug('metrics request from %s: %s' % (self.client_address[0], fmt % args))
+
+
+class MetricsExporter:
+
+    def __init__(self, port, host, top_directory, telemetry, log, bind_host=''):
+        self.host = host
+        self.top_directory = top_directory
+        self.telemetry = telemetry
+        self.log = log
+        self.layout = live_bucket_layout(telemetry)
+        self.server = ThreadingHTTPServer((bind_host, port), MetricsRequestHandler)
+        self.server.exporter = self
+        self.port = self.server.server_address[1]
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def page(self):
+        return format_metrics(self.host, self.telemetry, self.top_directory, self.layout)
+
+    def start(self):
+        self.thread.start()
+
+    # waits for requests in progress, so telemetry can be closed afterwards
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
+
+
+if __name__ == '__main__':
+    import re
+    import tempfile
+    import urllib.request
+    import urllib.error
+    from fs_drift.fsd_log import start_log
+    from fs_drift.telemetry import LiveCounters, live_bucket, LIVE_BUCKETS
+
+    log = start_log('metrics_exporter')
+    counter_names = [k for (k, _) in FSOPCounters().kvtuplelist()]
+    telemetry = LiveCounters.create(2, counters=len(counter_names), ops=len(FSOPCtx.opcode_to_opname))
+    read_bytes = counter_names.index('read_bytes')
+    try:
+        # 2 workers, each did 100 reads of 4 KiB at 1 msec and 10 creates at 100 msec
+        for k in range(0, 2):
+            live = telemetry.row(k)
+            for (opcode, n, secs, nbytes) in [(FSOPCtx.opname_to_opcode['read'], 100, 0.001, 4096),
+                                              (FSOPCtx.opname_to_opcode['create'], 10, 0.1, 0)]:
+                bucket = live_bucket(int(secs * USEC_PER_SEC))
+                live[LIVE_OPS] += n
+                live[LIVE_BYTES] += n * nbytes
+                live[LIVE_BUCKETS + bucket] += n
+                live[telemetry.op_buckets(opcode) + bucket] += n
+            live[telemetry.counters_at + read_bytes] = 100 * 4096
+            live[telemetry.cpu_at + LIVE_CPU_USER_USEC] = 1500000
+            live.release()
+
+        with tempfile.TemporaryDirectory() as d:
+            exporter = MetricsExporter(0, 'host"1', d, telemetry, log, bind_host='127.0.0.1')
+            exporter.start()
+            url = 'http://127.0.0.1:%d/metrics' % exporter.port
+            with urllib.request.urlopen(url) as resp:
+                assert(resp.headers['Content-Type'] == CONTENT_TYPE)
+                page = resp.read().decode('utf-8')
+            try:
+                urllib.request.urlopen('http://127.0.0.1:%d/nothing' % exporter.port)
+                assert(False)
+            except urllib.error.HTTPError as e:
+                assert(e.code == 404)
+            exporter.stop()
+        print(page)
+
+        values = {}
+        sample_re = re.compile(r'^(fsdrift_[a-z_]+)\{([^}]*)\} (\S+)$')
+        for line in page.splitlines():
+            if line.startswith('# '):
+                assert(re.match(r'^# (HELP|TYPE) fsdrift_[a-z_]+ ', line))
+                continue
+            match = sample_re.match(line)
+            assert(match)
+            assert(match.group(2).startswith('host="host\\"1"'))
+            values[(match.group(1), match.group(2)[len('host="host\\"1"'):])] = float(match.group(3))
+        assert(values[('fsdrift_ops_total', '')] == 220)
+        assert(values[('fsdrift_read_bytes_total', '')] == 2 * 100 * 4096)
+        # every FSOPCounters field is there
+        for name in counter_names:
+            assert(('fsdrift_%s_total' % name, '') in values)
+        assert(values[('fsdrift_cpu_seconds_total', ',mode="user",process="workers"')] == 3.0)
+        assert(('fsdrift_fs_fullness_ratio', '') in values)
+        # reads are all at 1 msec, creates at 100 msec
+        read_buckets = [(float(re.search(r'le="([^"]+)"', k).group(1)), v) for (k, v) in
+                        [(l, v) for ((n, l), v) in values.items()
+                         if n == 'fsdrift_op_latency_seconds_bucket' and 'op="read"' in l]]
+        read_buckets.sort()
+        assert([v for (_, v) in read_buckets] == sorted([v for (_, v) in read_buckets]))
+        assert(dict(read_buckets)[0.000512] == 0 and dict(read_buckets)[0.001024] == 200)
+        assert(dict(read_buckets)[float('inf')] == 200)
+        assert(values[('fsdrift_op_latency_seconds_count', ',op="create"')] == 20)
+        assert(abs(values[('fsdrift_op_latency_seconds_sum', ',op="create"')] - 2.0) < 2.0 / 8)
+        assert(not [k for k in values.keys() if 'op="delete"' in k[1]])
+    finally:
+        telemetry.unlink()
+        telemetry.close()
+
+    # cumulative counts are exact for response times from 0 to past the last bound
+    import random
+    rng = random.Random(11)
+    usecs = [int(rng.lognormvariate(7.0, 3.0)) for k in range(0, 20000)] + latency_bounds_usec + \
+            [b - 1 for b in latency_bounds_usec] + [0, LatencyHistogram.max_usec * 2]
+    telemetry = LiveCounters.create(1, counters=1, ops=len(FSOPCtx.opcode_to_opname))
+    try:
+        live = telemetry.row(0)
+        at = telemetry.op_buckets(FSOPCtx.opname_to_opcode['read'])
+        for u in usecs:
+            live[at + live_bucket(u)] += 1
+        live.release()
+        page = format_metrics('h', telemetry, '/nonexistent')
+        counts = dict([(float(le), int(n)) for (le, n) in
+                       re.findall(r'^fsdrift_op_latency_seconds_bucket\{host="h",le="([^"]+)",op="read"\} (\d+)$',
+                                  page, re.MULTILINE)])
+        for b in latency_bounds_usec:
+            assert(counts[b / float(USEC_PER_SEC)] == len([u for u in usecs if u < b])), b
+        assert(counts[float('inf')] == len(usecs))
+    finally:
+        telemetry.unlink()
+        telemetry.close()
+    print('metrics_exporter unit test passed')
@@ -6,17 +6,24 @@ import random
 import copy
 import socket
 import logging
+import shutil
 
 import fs_drift.worker_thread
 import fs_drift.common
-from fs_drift.common import OK, NOTOK, FsDriftException, ensure_deleted
+from fs_drift.common import OK, NOTOK, FsDriftException, ensure_deleted, ensure_dir_exists, deltree
 import fs_drift.fsd_log
 import fs_drift.invoke_process
 import fs_drift.sync_files
 import fs_drift.output_results
+import fs_drift.fsop
+from fs_drift.content_pool import ContentPool
+from fs_drift.telemetry import LiveCounters, LiveMonitor, live_summary
+from fs_drift.live_stream import LiveStreamSender
+from fs_drift.metrics_exporter import MetricsExporter
+from fs_drift.fsop_counters import FSOPCounters
 
 
-def create_worker_list(prm):
+def create_worker_list(prm, content_pool=None, telemetry=None, scratch_dir=None):
 
     # for each thread set up FsDriftWorkload instance,
     # create a thread instance, and delete the thread-ready file
@@ -25,9 +32,16 @@ def create_worker_list(prm):
     for k in range(0, prm.threads):
         nextinv = fs_drift.worker_thread.FsDriftWorkload(prm)
         nextinv.tid = '%02d' % k
+        if content_pool != None:
+            nextinv.content_pool_name = content_pool.name
+        if telemetry != None:
+            nextinv.telemetry_name = telemetry.name
+            nextinv.telemetry_row = k
+        nextinv.scratch_dir = scratch_dir
         t = fs_drift.invoke_process.subprocess(nextinv)
         thread_list.append(t)
         ensure_deleted(nextinv.gen_thread_ready_fname(nextinv.tid))
+        ensure_deleted(nextinv.gen_thread_progress_fname(nextinv.tid))
     return thread_list
 
 
@@ -51,6 +65,84 @@ def gen_host_ready_fname(params, hostname):
     return os.path.join(params.network_shared_path, 'host_ready.' + hostname + '.tmp')
 
 
+# a host updates this while its threads are still getting ready
+# (--precreate-dirs), so that the test driver and other hosts wait for it
+
+def gen_host_progress_fname(params, hostname):
+    return os.path.join(params.network_shared_path, 'host_progress.' + hostname + '.tmp')
+
+
+# returns True if any of these progress files was updated since the
+# last call with the same "seen" dictionary, which it updates
+
+def progress_seen(paths, seen):
+    changed = False
+    for p in paths:
+        try:
+            mtime = os.stat(p).st_mtime_ns
+        except FileNotFoundError:
+            continue
+        if seen.get(p) != mtime:
+            seen[p] = mtime
+            changed = True
+    return changed
+
+
+# print what the threads on this host are doing every --live-interval seconds
+# until they finish, or send it to the test driver if it is listening
+# (see live_stream.py). A thread that has finished is waiting to send its
+# results, so stop looking at it once they arrive rather than waiting for it to exit
+
+def show_live_counters(prm, host, telemetry, thread_list, log):
+    monitor = LiveMonitor(telemetry)
+    sender = None
+    if prm.live_stream_address != None:
+        try:
+            sender = LiveStreamSender(prm.live_stream_address, host, log)
+        except OSError as e:
+            log.warning('could not connect to test driver at %s port %d to stream live counters: %s' %
+                        (prm.live_stream_address[0], prm.live_stream_address[1], str(e)))
+    prefix = ''
+    if prm.host_set != []:
+        prefix = host + ': '
+    next_sample = monitor.start_time + prm.live_interval
+    while [t for t in thread_list if t.is_alive() and not t.receiver.poll()]:
+        now = time.time()
+        if now >= next_sample:
+            (elapsed, secs, delta) = monitor.delta()
+            if sender != None:
+                sender.send(elapsed, secs, delta)
+            else:
+                print(prefix + LiveMonitor.format_sample(live_summary(elapsed, secs, delta)),
+                      flush=True)
+            next_sample += prm.live_interval
+            continue
+        time.sleep(min(next_sample - now, 0.1))
+    if sender != None:
+        (elapsed, secs, delta) = monitor.delta()
+        sender.send(elapsed, secs, delta)
+        sender.close()
+
+
+# with --local-scratch-dir, threads on this host write the files they update
+# during the test here instead of the network shared dir
+
+def host_scratch_dir(params, hostname):
+    return os.path.join(params.local_scratch_dir, 'fs-drift-scratch.' + hostname)
+
+
+# once threads have finished, move their files to the network shared dir,
+# where they would have been without --local-scratch-dir
+
+def collect_scratch_files(params, scratch_dir, log):
+    moved = 0
+    for fn in sorted(os.listdir(scratch_dir)):
+        shutil.move(os.path.join(scratch_dir, fn), os.path.join(params.network_shared_path, fn))
+        moved += 1
+    os.rmdir(scratch_dir)
+    log.debug('moved %d files from %s to %s' % (moved, scratch_dir, params.network_shared_path))
+
+
 # file for result stored as pickled python object
 
 def host_result_filename(params, result_host):
@@ -68,105 +160,210 @@ def run_multi_thread_workload(prm):
     # FIXME: get coherent logging level interface
     host_startup_timeout = 5 + len(prm.host_set) / 3
 
-    # for each thread set up SmallfileWorkload instance,
-    # create a thread instance, and delete the thread-ready file
-
-    thread_list = create_worker_list(prm)
-    my_host_invoke = thread_list[0].invoke
     my_log = fs_drift.fsd_log.start_log('%s.master' % host)
     if prm.verbosity & 0x1000:
         fs_drift.fsd_log.change_loglevel(my_log, logging.DEBUG)
     my_log.debug(prm)
 
-    # start threads, wait for them to reach starting gate
-    # to do this, look for thread-ready files
+    # data to write is generated once for all threads on this host,
+    # if that fails each thread generates its own
+
+    content_pool = None
+    try:
+        content_pool = ContentPool.create(fs_drift.fsop.plain_content_size(prm),
+                                          prm.compress_ratio, prm.dedupe_pct,
+                                          seed=fs_drift.fsop.plain_content_seed(prm))
+        my_log.debug('shared content pool %s is %d bytes' %
+                     (content_pool.name, len(content_pool.mapping)))
+    except OSError as e:
+        my_log.warning('could not create shared content pool: %s' % os.strerror(e.errno))
+
+    # threads keep counters in shared memory that we can see while they run,
+    # --metrics-port also needs all their counters and per-op histograms
+
+    telemetry = None
+    if prm.live_interval > 0 or prm.metrics_port > 0:
+        counters = 0
+        ops = 0
+        if prm.metrics_port > 0:
+            counters = len(FSOPCounters().kvtuplelist())
+            ops = len(fs_drift.fsop.FSOPCtx.opcode_to_opname)
+        try:
+            telemetry = LiveCounters.create(prm.threads, counters, ops)
+        except OSError as e:
+            my_log.warning('could not create live counters: %s' % os.strerror(e.errno))
+    exporter = None
+    if telemetry != None and prm.metrics_port > 0:
+        try:
+            exporter = MetricsExporter(prm.metrics_port, host, prm.top_directory, telemetry, my_log)
+            exporter.start()
+            my_log.info('serving metrics on port %d' % exporter.port)
+        except OSError as e:
+            my_log.warning('could not serve metrics on port %d: %s' % (prm.metrics_port, str(e)))
+
+    # shared memory and the metrics server are cleaned up, and scratch files
+    # collected, even if threads do not reach the starting gate
 
-    for t in thread_list:
-        ensure_deleted(t.invoke.gen_thread_ready_fname(t.invoke.tid))
-    for t in thread_list:
-        t.start()
-    my_log.debug('started %d worker threads on host %s' %
-                 (len(thread_list), host))
-
-    # wait for all threads to reach the starting gate
-    # this makes it more likely that they will start simultaneously
-
-    abort_fname = prm.abort_path
-    thread_count = len(thread_list)
-    thread_to_wait_for = 0
-    startup_timeout = 3
-    sec = 0.0
-    while sec < startup_timeout:
-        for k in range(thread_to_wait_for, thread_count):
-            t = thread_list[k]
-            fn = t.invoke.gen_thread_ready_fname(t.invoke.tid)
-            if not os.path.exists(fn):
-                my_log.debug('thread %d thread-ready file %s not found yet with %f sec left' %
-                             (k, fn, (startup_timeout - sec)))
-                break
-            thread_to_wait_for = k + 1
-            # we only timeout if no more threads have reached starting gate
-            # in startup_timeout sec
-            sec = 0.0
-        if thread_to_wait_for == thread_count:
-            break
-        if os.path.exists(abort_fname):
-            break
-        sec += 0.5
-        time.sleep(0.5)
-
-    # if all threads didn't make it to the starting gate
-
-    if thread_to_wait_for < thread_count:
-        abort_test(abort_fname, thread_list)
-        raise FsDriftException('only %d threads reached starting gate'
-                               % thread_to_wait_for)
-
-    # declare that this host is at the starting gate
-
-    if prm_slave:
-        host_ready_fn = gen_host_ready_fname(prm, prm.as_host)
-        my_log.debug('host %s creating ready file %s' %
-                     (my_host_invoke.onhost, host_ready_fn))
-        fs_drift.common.touch(host_ready_fn)
-
-    sg = prm.starting_gun_path
-    if not prm_slave:
-        my_log.debug('wrote starting gate file ')
-        fs_drift.sync_files.write_sync_file(sg, 'hi there')
-
-    # wait for starting_gate file to be created by test driver
-    # every second we resume scan from last host file not found
-
-    if prm_slave:
-        my_log.debug('awaiting ' + sg)
-        for sec in range(0, int(host_startup_timeout+3)):
-            # hack to ensure that directory is up to date
-            #   ndlist = os.listdir(my_host_invoke.network_dir)
-            if os.path.exists(sg):
+    scratch_dir = None
+    thread_list = []
+    telemetry_unlinked = False
+    test_completed = False
+    try:
+        if prm.local_scratch_dir != None:
+            deltree(host_scratch_dir(prm, host))
+            ensure_dir_exists(host_scratch_dir(prm, host))
+            scratch_dir = host_scratch_dir(prm, host)
+
+        # for each thread set up SmallfileWorkload instance,
+        # create a thread instance, and delete the thread-ready file
+
+        thread_list = create_worker_list(prm, content_pool, telemetry, scratch_dir)
+        my_host_invoke = thread_list[0].invoke
+
+        # start threads, wait for them to reach starting gate
+        # to do this, look for thread-ready files
+
+        for t in thread_list:
+            ensure_deleted(t.invoke.gen_thread_ready_fname(t.invoke.tid))
+            ensure_deleted(t.invoke.gen_thread_progress_fname(t.invoke.tid))
+        for t in thread_list:
+            t.start()
+        my_log.debug('started %d worker threads on host %s' %
+                     (len(thread_list), host))
+
+        # wait for all threads to reach the starting gate
+        # this makes it more likely that they will start simultaneously.
+        # A thread that is still getting ready (--precreate-dirs)
+        # updates its progress file, and that also restarts the timeout,
+        # and we pass that on to the test driver and other hosts
+
+        abort_fname = prm.abort_path
+        thread_count = len(thread_list)
+        thread_to_wait_for = 0
+        startup_timeout = 3
+        thread_progress = {}
+        sec = 0.0
+        while sec < startup_timeout:
+            for k in range(thread_to_wait_for, thread_count):
+                t = thread_list[k]
+                fn = t.invoke.gen_thread_ready_fname(t.invoke.tid)
+                if not os.path.exists(fn):
+                    my_log.debug('thread %d thread-ready file %s not found yet with %f sec left' %
+                                 (k, fn, (startup_timeout - sec)))
+                    break
+                thread_to_wait_for = k + 1
+                # we only timeout if no more threads have reached starting gate
+                # in startup_timeout sec
+                sec = 0.0
+            if thread_to_wait_for == thread_count:
                 break
-            if os.path.exists(prm.abort_path):
-                logging.info('saw abort file %s, aborting test' % prm.abort_path)
+            if progress_seen([t.invoke.gen_thread_progress_fname(t.invoke.tid)
+                              for t in thread_list[thread_to_wait_for:]], thread_progress):
+                sec = 0.0
+                if prm_slave:
+                    with open(gen_host_progress_fname(prm, prm.as_host), 'w') as f:
+                        f.write('%f\n' % time.time())
+            if os.path.exists(abort_fname):
                 break
-            time.sleep(1)
-        if not os.path.exists(sg):
-            abort_test(prm.abort_path, thread_list)
-            raise FsDriftException('starting signal not seen within %d seconds'
-                                   % host_startup_timeout)
-    if prm.verbosity & 0x800:
-        my_log.info('starting test on host ' + host + ' in 2 seconds')
-    time.sleep(2 + random.random())  # let other hosts see starting gate file
-
-    # FIXME: don't timeout the test,
-    # instead check thread progress and abort if you see any of them stalled
-    # but if servers are heavily loaded you can't rely on filesystem
-
-    # wait for all threads on this host to finish
-
-    for t in thread_list:
-        my_log.debug('waiting for thread %s' % t.invoke.tid)
-        t.retrieve()
-        t.join()
+            sec += 0.5
+            time.sleep(0.5)
+
+        # threads map the content pool before reaching the starting gate,
+        # so its name is no longer needed, their mappings stay valid
+
+        if content_pool != None:
+            content_pool.unlink()
+            content_pool.close()
+            content_pool = None
+        if telemetry != None:
+            telemetry.unlink()
+            telemetry_unlinked = True
+
+        # if all threads didn't make it to the starting gate
+
+        if thread_to_wait_for < thread_count:
+            abort_test(abort_fname, thread_list)
+            raise FsDriftException('only %d threads reached starting gate'
+                                   % thread_to_wait_for)
+
+        # declare that this host is at the starting gate
+
+        if prm_slave:
+            host_ready_fn = gen_host_ready_fname(prm, prm.as_host)
+            my_log.debug('host %s creating ready file %s' %
+                         (my_host_invoke.onhost, host_ready_fn))
+            fs_drift.common.touch(host_ready_fn)
+
+        sg = prm.starting_gun_path
+        if not prm_slave:
+            my_log.debug('wrote starting gate file ')
+            fs_drift.sync_files.write_sync_file(sg, 'hi there')
+
+        # wait for starting_gate file to be created by test driver
+        # every second we resume scan from last host file not found,
+        # hosts that are still getting ready restart the timeout
+
+        if prm_slave:
+            my_log.debug('awaiting ' + sg)
+            host_progress_paths = [gen_host_progress_fname(prm, h) for h in prm.host_set]
+            host_progress = {}
+            sec = 0
+            while sec < int(host_startup_timeout+3):
+                # hack to ensure that directory is up to date
+                #   ndlist = os.listdir(my_host_invoke.network_dir)
+                if os.path.exists(sg):
+                    break
+                if os.path.exists(prm.abort_path):
+                    logging.info('saw abort file %s, aborting test' % prm.abort_path)
+                    break
+                if progress_seen(host_progress_paths, host_progress):
+                    sec = 0
+                time.sleep(1)
+                sec += 1
+            if not os.path.exists(sg):
+                abort_test(prm.abort_path, thread_list)
+                raise FsDriftException('starting signal not seen within %d seconds'
+                                       % host_startup_timeout)
+        if prm.verbosity & 0x800:
+            my_log.info('starting test on host ' + host + ' in 2 seconds')
+        time.sleep(2 + random.random())  # let other hosts see starting gate file
+
+        # FIXME: don't timeout the test,
+        # instead check thread progress and abort if you see any of them stalled
+        # but if servers are heavily loaded you can't rely on filesystem
+
+        # wait for all threads on this host to finish
+
+        if telemetry != None and prm.live_interval > 0:
+            show_live_counters(prm, host, telemetry, thread_list, my_log)
+        for t in thread_list:
+            my_log.debug('waiting for thread %s' % t.invoke.tid)
+            t.retrieve()
+            t.join()
+        test_completed = True
+    finally:
+        if exporter != None:
+            exporter.stop()
+        if content_pool != None:
+            content_pool.unlink()
+            content_pool.close()
+        if telemetry != None:
+            if not telemetry_unlinked:
+                telemetry.unlink()
+            telemetry.close()
+        if scratch_dir != None:
+            if test_completed:
+                collect_scratch_files(prm, scratch_dir, my_log)
+            else:
+                # threads were told to stop, let them finish writing,
+                # and don't hide why the test failed
+                for t in thread_list:
+                    if t.is_alive():
+                        t.join(5)
+                try:
+                    collect_scratch_files(prm, scratch_dir, my_log)
+                except OSError as e:
+                    my_log.warning('could not collect scratch files from %s: %s' % (scratch_dir, str(e)))
 
     # if not a slave of some other host, print results (for this host)
 
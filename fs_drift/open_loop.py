@@ -0,0 +1,138 @@
+# open_loop.py - start ops on a schedule instead of when the last one finishes
+#
+# normally each thread starts its next op as soon as the previous one
+# finishes (closed loop), so when the filesystem stalls, the thread just
+# issues fewer ops and the stall shows up as one slow op instead of as
+# every op that should have started during it ("coordinated omission").
+# With --target-rate, each op has an intended start time taken from an
+# arrival schedule (fixed intervals or a Poisson process) that does not
+# depend on how long earlier ops took.  The thread sleeps until the intended
+# start time if it is ahead of schedule, and starts the op immediately if
+# it is behind.  Response times are measured from the intended start time,
+# so time an op spent waiting for the thread to catch up counts against it.
+# The backlog is the number of ops whose intended start time has passed
+# but which have not been started yet.
+
+import math
+import time
+
+from fs_drift.common import RateScope, ArrivalDistr, FsDriftException
+
+
+# ops/sec that each thread must start to achieve the requested target rate
+
+def per_thread_rate(params):
+    rate = params.target_rate
+    if params.target_rate_scope == RateScope.cluster:
+        rate /= max(len(params.host_set), 1) * params.threads
+    return rate
+
+
+class ArrivalSchedule:
+
+    # uniform_stream is an iterator over uniform floats in [0, 1),
+    # e.g. DecisionStream.uniform_stream
+
+    def __init__(self, rate, distribution, uniform_stream, start_time=None):
+        if rate <= 0.0:
+            raise FsDriftException('open-loop arrival rate must be positive')
+        self.rate = rate
+        self.interval = 1.0 / rate
+        self.distribution = distribution
+        self.uniform_stream = uniform_stream
+        if start_time == None:
+            start_time = time.time()
+        # arrivals are accumulated as seconds since start_time,
+        # adding up intervals to a time since the epoch would lose precision
+        self.start_time = start_time
+        # threads with fixed arrivals do not all start their ops at the same instants
+        if distribution == ArrivalDistr.fixed:
+            self.next_offset = next(uniform_stream) * self.interval
+        else:
+            self.next_offset = self.gap()
+        self.next_time = start_time + self.next_offset
+        self.max_backlog = 0
+
+    # time between successive arrivals,
+    # exponentially distributed for a Poisson process
+
+    def gap(self):
+        if self.distribution == ArrivalDistr.poisson:
+            return -math.log(1.0 - next(self.uniform_stream)) * self.interval
+        return self.interval
+
+    # take the intended start time of the next op off the schedule
+
+    def next_arrival(self):
+        t = self.next_time
+        self.next_offset += self.gap()
+        self.next_time = self.start_time + self.next_offset
+        return t
+
+    # ops that should have started by "now" but have not been taken
+    # off the schedule yet, estimated from the mean arrival rate
+
+    def backlog(self, now):
+        if now < self.next_time:
+            return 0
+        return 1 + int((now - self.next_time) * self.rate)
+
+    # wait until the next op is due and return its intended start time
+
+    def wait(self):
+        intended = self.next_arrival()
+        now = time.time()
+        if intended > now:
+            time.sleep(intended - now)
+        else:
+            self.max_backlog = max(self.max_backlog, self.backlog(now))
+        return intended
+
+
+if __name__ == '__main__':
+    import numpy
+    from fs_drift.decision_stream import DecisionStream
+    import fs_drift.opts
+
+    ds = DecisionStream(seed=7)
+    n = 100000
+    for distribution in [ArrivalDistr.fixed, ArrivalDistr.poisson]:
+        s = ArrivalSchedule(1000.0, distribution, ds.uniform_stream, start_time=0.0)
+        arrivals = numpy.array([s.next_arrival() for k in range(0, n)])
+        gaps = numpy.diff(arrivals)
+        assert(0.0 <= arrivals[0] <= 0.02)
+        assert(abs(gaps.mean() - 0.001) < 0.00002)
+        if distribution == ArrivalDistr.fixed:
+            assert(gaps.std() < 1.0e-9)
+        else:
+            # exponential gaps have standard deviation equal to their mean
+            assert(abs(gaps.std() - 0.001) < 0.00003)
+        # once behind schedule, the backlog grows at the arrival rate
+        assert(s.backlog(s.next_time - 0.5) == 0)
+        assert(abs(s.backlog(s.next_time + 2.0) - 2001) <= 1)
+
+    # a thread that stalls catches up without sleeping
+    # and the stall is charged to the ops that were due during it
+    s = ArrivalSchedule(200.0, ArrivalDistr.fixed, ds.uniform_stream)
+    start = time.time()
+    rsptimes = []
+    for k in range(0, 100):
+        intended = s.wait()
+        if k == 10:
+            time.sleep(0.2)
+        rsptimes.append(time.time() - intended)
+    elapsed = time.time() - start
+    assert(0.45 < elapsed < 0.65)
+    assert(s.max_backlog >= 30)
+    assert(sum(1 for r in rsptimes if r > 0.05) >= 20)
+
+    p = fs_drift.opts.FsDriftOpts()
+    p.target_rate = 6000.0
+    p.threads = 4
+    p.host_set = ['a', 'b', 'c']
+    assert(per_thread_rate(p) == 6000.0)
+    p.target_rate_scope = RateScope.cluster
+    assert(per_thread_rate(p) == 500.0)
+    p.host_set = []
+    assert(per_thread_rate(p) == 1500.0)
+    print('open_loop unit test passed')
@@ -9,11 +9,14 @@ from argparse import ArgumentParser
 
 # fs-drift module dependencies
 
-from fs_drift.common import OK, NOTOK, FsDriftException, FileAccessDistr, USEC_PER_SEC, BYTES_PER_KiB
-from fs_drift.common import FileAccessDistr2str
+from fs_drift.common import OK, NOTOK, FsDriftException, FileAccessDistr, BYTES_PER_KiB
+from fs_drift.common import FileAccessDistr2str, IOMode, IOMode2str, IOEngine, IOEngine2str
+from fs_drift.common import RateScope, RateScope2str, ArrivalDistr, ArrivalDistr2str
+from fs_drift.common import SampleLogFormat, SampleLogFormat2str
 from fs_drift.parser_data_types import boolean, positive_integer, non_negative_integer, bitmask, positive_integer_or_None
 from fs_drift.parser_data_types import positive_float, non_negative_float, positive_percentage
-from fs_drift.parser_data_types import host_set, file_access_distrib, size_or_range
+from fs_drift.parser_data_types import host_set, file_access_distrib, size_or_range, io_mode, io_engine
+from fs_drift.parser_data_types import rate_scope, arrival_distrib, latency_digits, sample_log_format
 from fs_drift.parser_data_types import FsDriftParseException, TypeExc
 
 
@@ -31,8 +34,9 @@ class FsDriftOpts:
         self.starting_gun_path = os.path.join(self.network_shared_path, 'starting-gun.tmp')
         self.stop_file_path = os.path.join(self.network_shared_path, 'stop-file.tmp')
         self.param_pickle_path = os.path.join(self.network_shared_path, 'params.pickle')
-        self.rsptime_path = os.path.join(self.network_shared_path, 'host-%s_thrd-%s_rsptimes.csv')
-        self.bw_path = os.path.join(self.network_shared_path, 'host-%s_thrd-%s_bw.csv')
+        log_suffix = '.bin' if self.sample_log_format == SampleLogFormat.binary else '.csv'
+        self.rsptime_path = os.path.join(self.network_shared_path, 'host-%s_thrd-%s_rsptimes' + log_suffix)
+        self.bw_path = os.path.join(self.network_shared_path, 'host-%s_thrd-%s_bw' + log_suffix)
         self.abort_path = os.path.join(self.network_shared_path, 'abort.tmp')
         self.pause_path = os.path.join(self.network_shared_path, 'pause.tmp')
         self.checkerflag_path = os.path.join(self.network_shared_path, 'checkered_flag.tmp')
@@ -56,15 +60,31 @@ class FsDriftOpts:
         self.subdirs_per_dir = 3
         self.response_times = False
         self.bw = False
+        self.sample_log_format = SampleLogFormat.csv
+        self.sample_every = 1
+        self.sample_reservoir = 0
         self.workload_table_csv_path = None
         self.stats_report_interval = max(self.duration // 60, 5)
         self.pause_between_ops = 100
-        self.pause_secs = self.pause_between_ops / float(USEC_PER_SEC)
         self.incompressible = False
         self.compress_ratio = 0.0
         self.dedupe_pct = 0
         self.directIO = False
         self.rawdevice = None
+        self.io_mode = IOMode.seek
+        self.iov_batch = 8
+        self.iodepth = 1
+        self.io_engine = IOEngine.sync
+        self.dirfd_cache = 0
+        self.precreate_dirs = False
+        self.target_rate = 0.0
+        self.target_rate_scope = RateScope.thread
+        self.arrivals = ArrivalDistr.poisson
+        self.latency_digits = 2
+        self.live_interval = 1.0
+        self.live_stream_port = 0
+        self.metrics_port = 0
+        self.local_scratch_dir = None
         # new parameters related to gaussian filename distribution
         self.random_distribution = FileAccessDistr.uniform
         self.mean_index_velocity = 1.0  # default is a fixed mean for the distribution
@@ -81,6 +101,7 @@ class FsDriftOpts:
         # not settable
         self.is_slave = False
         self.as_host = None  # filled in by worker host
+        self.live_stream_address = None  # filled in by test driver
         self.verbosity = 0
         self.tolerate_stale_fh = False
         self.launch_as_daemon = False
@@ -94,6 +115,9 @@ class FsDriftOpts:
             ('JSON output file', self.output_json_path),
             ('save response times?', self.response_times),
             ('save bandwidth?', self.bw),
+            ('response time and bandwidth log format', SampleLogFormat2str(self.sample_log_format)),
+            ('log every Nth sample', self.sample_every),
+            ('samples kept in reservoir (0 = all)', self.sample_reservoir),
             ('stats report interval', self.stats_report_interval),
             ('workload table csv path', self.workload_table_csv_path),
             ('host set', ','.join(self.host_set)),
@@ -113,6 +137,20 @@ class FsDriftOpts:
             ('deduplication percentage', self.dedupe_pct),
             ('use direct IO', self.directIO),
             ('use this device for raw IO', self.rawdevice),
+            ('random I/O mode', IOMode2str(self.io_mode)),
+            ('records per vectored I/O', self.iov_batch),
+            ('data-path ops in flight per thread', self.iodepth),
+            ('I/O engine', IOEngine2str(self.io_engine)),
+            ('directory fds cached per thread', self.dirfd_cache),
+            ('create directory tree before starting', self.precreate_dirs),
+            ('target ops/sec (0 = closed loop)', self.target_rate),
+            ('target rate is per', RateScope2str(self.target_rate_scope)),
+            ('op arrivals', ArrivalDistr2str(self.arrivals)),
+            ('latency histogram significant digits', self.latency_digits),
+            ('live counter interval (0 = off)', self.live_interval),
+            ('live stream port (0 = off)', self.live_stream_port),
+            ('metrics port (0 = off)', self.metrics_port),
+            ('local scratch directory', self.local_scratch_dir),
             ('pause between ops (usec)', self.pause_between_ops),
             ('distribution', FileAccessDistr2str(self.random_distribution)),
             ('mean index velocity', self.mean_index_velocity),
@@ -144,6 +182,15 @@ class FsDriftOpts:
 
     def validate(self):
 
+        if self.sample_every > 1 and self.sample_reservoir > 0:
+            raise FsDriftException('use either --sample-every or --sample-reservoir, not both')
+
+        if self.live_stream_port > 0 and self.live_interval == 0:
+            raise FsDriftException('--live-stream-port needs a --live-interval greater than 0')
+
+        if self.local_scratch_dir != None and not os.path.isabs(self.local_scratch_dir):
+            raise FsDriftException('--local-scratch-dir %s must be an absolute path' % self.local_scratch_dir)
+
         if len(self.top_directory) < 6:
             raise FsDriftException(
                 'top directory %s too short, may be system directory' %
@@ -259,6 +306,15 @@ def parseopts(cli_params=sys.argv[1:]):
     add('--save-bw', help='if True then save bandwidth to CSV file',
         type=boolean,
         default=o.bw)
+    add('--sample-log-format', help='"csv" or "binary" for response time and bandwidth logs',
+        type=sample_log_format,
+        default=SampleLogFormat.csv)
+    add('--sample-every', help='save only every Nth response time and bandwidth sample',
+        type=positive_integer,
+        default=o.sample_every)
+    add('--sample-reservoir', help='save a uniform random sample of this many response times and bandwidths, 0 saves them all',
+        type=non_negative_integer,
+        default=o.sample_reservoir)
     add('--incompressible', help='if True then write incompressible data',
         type=boolean,
         default=o.incompressible)
@@ -273,6 +329,47 @@ def parseopts(cli_params=sys.argv[1:]):
         default=o.directIO)
     add('--rawdevice', help='if set, use this device as a target for rawdevice testing (Warning: Data/File systems on this device will be corrupted)',
         default=o.rawdevice)
+    add('--io-mode', help='how random_read/random_write position records: "seek", "positional" or "vectored"',
+        type=io_mode,
+        default=IOMode.seek)
+    add('--iov-batch', help='records submitted together by --io-mode vectored or --io-engine io_uring',
+        type=positive_integer,
+        default=o.iov_batch)
+    add('--iodepth', help='data-path ops kept in flight by each thread',
+        type=positive_integer,
+        default=o.iodepth)
+    add('--io-engine', help='"sync" for ordinary syscalls or "io_uring" to batch records through io_uring',
+        type=io_engine,
+        default=IOEngine.sync)
+    add('--dirfd-cache', help='directory fds each thread keeps open for dir_fd-relative syscalls, 0 disables',
+        type=non_negative_integer,
+        default=o.dirfd_cache)
+    add('--precreate-dirs', help='if True then threads create the whole directory tree before the test starts',
+        type=boolean,
+        default=o.precreate_dirs)
+    add('--target-rate', help='open-loop mode: start ops at this many per sec regardless of how long they take, 0 for closed loop',
+        type=non_negative_float,
+        default=o.target_rate)
+    add('--target-rate-scope', help='"thread" if --target-rate is for each thread, "cluster" if for all threads together',
+        type=rate_scope,
+        default=RateScope.thread)
+    add('--arrivals', help='spacing of open-loop op start times: "fixed" or "poisson"',
+        type=arrival_distrib,
+        default=ArrivalDistr.poisson)
+    add('--latency-digits', help='significant decimal digits (1-5) of response time histograms',
+        type=latency_digits,
+        default=o.latency_digits)
+    add('--live-interval', help='seconds between live throughput and response time lines from each host, 0 disables',
+        type=non_negative_float,
+        default=o.live_interval)
+    add('--live-stream-port', help='multi-host: TCP port test driver listens on for live counters from hosts, 0 disables',
+        type=non_negative_integer,
+        default=o.live_stream_port)
+    add('--metrics-port', help='TCP port each host serves Prometheus metrics on while the test runs, 0 disables',
+        type=non_negative_integer,
+        default=o.metrics_port)
+    add('--local-scratch-dir', help='local directory on each host for counter files, response time and bandwidth logs and simulated time, moved to the shared directory at the end',
+        default=o.local_scratch_dir)
     add('--random-distribution', help='either "uniform" or "gaussian"',
         type=file_access_distrib,
         default=FileAccessDistr.uniform)
@@ -348,10 +445,26 @@ def parseopts(cli_params=sys.argv[1:]):
         else:
             o.file_size = assure_block_alignment(o.file_size)
     o.rawdevice = args.rawdevice
+    o.io_mode = args.io_mode
+    o.iov_batch = args.iov_batch
+    o.iodepth = args.iodepth
+    o.io_engine = args.io_engine
+    o.dirfd_cache = args.dirfd_cache
+    o.precreate_dirs = args.precreate_dirs
+    o.target_rate = args.target_rate
+    o.target_rate_scope = args.target_rate_scope
+    o.arrivals = args.arrivals
+    o.latency_digits = args.latency_digits
+    o.live_interval = args.live_interval
+    o.live_stream_port = args.live_stream_port
+    o.metrics_port = args.metrics_port
+    o.local_scratch_dir = args.local_scratch_dir
     o.pause_between_ops = args.pause_between_ops
-    o.pause_secs = o.pause_between_ops / float(USEC_PER_SEC)
     o.response_times = args.response_times
     o.bw = args.save_bw
+    o.sample_log_format = args.sample_log_format
+    o.sample_every = args.sample_every
+    o.sample_reservoir = args.sample_reservoir
     o.random_distribution = args.random_distribution
     o.mean_index_velocity = args.mean_velocity
     o.gaussian_stddev = args.gaussian_stddev
@@ -440,6 +553,12 @@ def parse_yaml(options, input_yaml_file):
                 options.response_times = boolean(v)
             elif k == 'bw':
                 options.bw = boolean(v)
+            elif k == 'sample_log_format':
+                options.sample_log_format = sample_log_format(v)
+            elif k == 'sample_every':
+                options.sample_every = positive_integer(v)
+            elif k == 'sample_reservoir':
+                options.sample_reservoir = non_negative_integer(v)
             elif k == 'incompressible':
                 options.incompressible = boolean(v)
             elif k == 'compress-ratio':
@@ -450,6 +569,34 @@ def parse_yaml(options, input_yaml_file):
                 options.directIO = boolean(v)
             elif k == 'rawdevice':
                 options.rawdevice = v
+            elif k == 'io_mode':
+                options.io_mode = io_mode(v)
+            elif k == 'iov_batch':
+                options.iov_batch = positive_integer(v)
+            elif k == 'iodepth':
+                options.iodepth = positive_integer(v)
+            elif k == 'io_engine':
+                options.io_engine = io_engine(v)
+            elif k == 'dirfd_cache':
+                options.dirfd_cache = non_negative_integer(v)
+            elif k == 'precreate_dirs':
+                options.precreate_dirs = boolean(v)
+            elif k == 'target_rate':
+                options.target_rate = non_negative_float(v)
+            elif k == 'target_rate_scope':
+                options.target_rate_scope = rate_scope(v)
+            elif k == 'arrivals':
+                options.arrivals = arrival_distrib(v)
+            elif k == 'latency_digits':
+                options.latency_digits = latency_digits(v)
+            elif k == 'live_interval':
+                options.live_interval = non_negative_float(v)
+            elif k == 'live_stream_port':
+                options.live_stream_port = non_negative_integer(v)
+            elif k == 'metrics_port':
+                options.metrics_port = non_negative_integer(v)
+            elif k == 'local_scratch_dir':
+                options.local_scratch_dir = v
             elif k == 'random_distribution':
                 options.random_distribution = file_access_distrib(v)
             elif k == 'mean_velocity':
@@ -533,9 +680,25 @@ if __name__ == "__main__":
             params.extend(['--dirs-per-level', '50'])
             params.extend(['--report-interval', '60'])
             params.extend(['--response-times', 'Y'])
+            params.extend(['--sample-log-format', 'binary'])
+            params.extend(['--sample-every', '10'])
             params.extend(['--incompressible', 'false'])
             params.extend(['--directIO', 'false'])
             params.extend(['--rawdevice', 'none'])
+            params.extend(['--io-mode', 'vectored'])
+            params.extend(['--iov-batch', '16'])
+            params.extend(['--iodepth', '8'])
+            params.extend(['--io-engine', 'io_uring'])
+            params.extend(['--dirfd-cache', '64'])
+            params.extend(['--precreate-dirs', 'y'])
+            params.extend(['--target-rate', '250.5'])
+            params.extend(['--target-rate-scope', 'cluster'])
+            params.extend(['--arrivals', 'fixed'])
+            params.extend(['--latency-digits', '3'])
+            params.extend(['--live-interval', '2.5'])
+            params.extend(['--live-stream-port', '9123'])
+            params.extend(['--metrics-port', '9125'])
+            params.extend(['--local-scratch-dir', '/var/tmp'])
             params.extend(['--random-distribution', 'gaussian'])
             params.extend(['--mean-velocity', '4.2'])
             params.extend(['--gaussian-stddev', '100.2'])
@@ -546,6 +709,7 @@ if __name__ == "__main__":
             params.extend(['--launch-as-daemon', 'Y'])
             options = parseopts(cli_params=params)
             options.validate()
+            assert(options.rsptime_path == '/var/tmp/network-shared/host-%s_thrd-%s_rsptimes.bin')
             print(options)
             print('json format:')
             print(json.dumps(options.to_json_obj(), indent=2, sort_keys=True))
@@ -570,8 +734,24 @@ if __name__ == "__main__":
                 w('dirs_per_level: 50')
                 w('report_interval: 60')
                 w('response_times: Y')
+                w('sample_log_format: binary')
+                w('sample_reservoir: 100000')
                 w('incompressible: false')
                 w('directIO: false')
+                w('io_mode: positional')
+                w('iov_batch: 4')
+                w('iodepth: 16')
+                w('io_engine: io_uring')
+                w('dirfd_cache: 32')
+                w('precreate_dirs: true')
+                w('target_rate: 1000')
+                w('target_rate_scope: cluster')
+                w('arrivals: fixed')
+                w('latency_digits: 3')
+                w('live_interval: 0')
+                w('live_stream_port: 9124')
+                w('metrics_port: 9126')
+                w('local_scratch_dir: /tmp/scratch')
                 w('random_distribution: gaussian')
                 w('mean_velocity: 4.2')
                 w('gaussian_stddev: 100.2')
@@ -601,9 +781,25 @@ if __name__ == "__main__":
             assert(p.dirs_per_level == 50)
             assert(p.stats_report_interval == 60)
             assert(p.response_times == True)
+            assert(p.sample_log_format == SampleLogFormat.binary)
+            assert(p.sample_reservoir == 100000)
             assert(p.incompressible == False)
             assert(p.directIO == False)
             assert(p.rawdevice == None)
+            assert(p.io_mode == IOMode.positional)
+            assert(p.iov_batch == 4)
+            assert(p.iodepth == 16)
+            assert(p.io_engine == IOEngine.io_uring)
+            assert(p.dirfd_cache == 32)
+            assert(p.precreate_dirs == True)
+            assert(p.target_rate == 1000.0)
+            assert(p.target_rate_scope == RateScope.cluster)
+            assert(p.arrivals == ArrivalDistr.fixed)
+            assert(p.latency_digits == 3)
+            assert(p.live_interval == 0.0)
+            assert(p.live_stream_port == 9124)
+            assert(p.metrics_port == 9126)
+            assert(p.local_scratch_dir == '/tmp/scratch')
             assert(p.random_distribution == FileAccessDistr.gaussian)
             assert(p.mean_velocity == 4.2)
             assert(p.gaussian_stddev == 100.2)
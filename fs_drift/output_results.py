@@ -4,22 +4,36 @@ import os
 import json
 import copy
 from fs_drift.fsop_counters import FSOPCounters
+from fs_drift.latency_histogram import OpLatencies, LatencyTimeline, format_summary_table
 from fs_drift.common import FsDriftException, OK
 from fs_drift.common import KiB_PER_GiB, BYTES_PER_KiB, MiB_PER_GiB, BYTES_PER_MiB
 
 
-def output_thread_counters(outfile, start_time, total_errors, fsop_ctrs):
+# in open-loop mode "schedule" is the thread's open_loop.ArrivalSchedule,
+# whose current and largest backlog since the last interval are reported too,
+# "latencies" are the response time histograms for the interval
+
+def output_thread_counters(outfile, start_time, total_errors, fsop_ctrs, schedule=None, latencies=None):
     jsondict = fsop_ctrs.json_dict()
-    jsondict['elapsed-time'] = '%9.1f' % (time.time() - start_time)
+    now = time.time()
+    jsondict['elapsed-time'] = '%9.1f' % (now - start_time)
     jsondict['total-errors'] = '%9u' % total_errors
+    if schedule != None:
+        jsondict['backlog'] = '%9u' % schedule.backlog(now)
+        jsondict['max-backlog'] = '%9u' % schedule.max_backlog
+        schedule.max_backlog = 0
+    if latencies != None:
+        jsondict['latency'] = latencies.to_json_obj()
     outfile.write(json.dumps(jsondict, indent=4) + '\n')
     outfile.flush()
 
 
 def output_results(params, subprocess_list):
     cluster = FSOPCounters()
+    cluster_latencies = OpLatencies(params.latency_digits)
     host_index = 0
     host_ids = {}
+    host_latencies = {}
     rslt = {}
     rslt['in-host'] = {}
     if not params.rawdevice:
@@ -44,6 +58,7 @@ def output_results(params, subprocess_list):
 
         c = p.ctrs
         c.add_to(cluster)
+        cluster_latencies.merge(p.latencies)
 
         thrd = {}
         thrd['status'] = status
@@ -52,6 +67,7 @@ def output_results(params, subprocess_list):
         thrd['ios'] = c.total_ios()
         thrd['MiB'] = c.total_bytes() / float(BYTES_PER_MiB)
         thrd['fsop-counters'] = c.json_dict()
+        thrd['latency'] = p.latencies.summary()
         if max_elapsed_time > 0.001:  # can't compute rates if it ended too quickly
             thrd['files-per-sec'] = thrd['files'] / max_elapsed_time
             thrd['IOPS'] = thrd['ios'] / max_elapsed_time
@@ -77,8 +93,11 @@ def output_results(params, subprocess_list):
             per_host_results = {'hostname': p.onhost, 'in-thread': {}, 'files': 0, 'ios': 0, 'MiB': 0.0}
             rslt['in-host'][host_number] = per_host_results
             per_host_counters = FSOPCounters()
+            host_latencies[p.onhost] = OpLatencies(params.latency_digits)
 
         c.add_to(per_host_counters)
+        host_latencies[p.onhost].merge(p.latencies)
+        per_host_results['latency'] = host_latencies[p.onhost].summary()
         per_host_results['fsop-counters'] = per_host_counters.json_dict()
         per_host_results['in-thread'][p.tid] = thrd
         per_host_results['files'] = per_host_counters.total_files()
@@ -119,6 +138,31 @@ def output_results(params, subprocess_list):
     if cluster.have_remounted > 0:
         print('remounts = %d' % cluster.have_remounted)
 
+    if len(cluster_latencies) > 0:
+        print(cluster_latencies.format_table())
+        rslt['latency'] = cluster_latencies.summary()
+        # with several hosts, one line per host for all op types together
+        if len(host_latencies) > 1:
+            print(format_summary_table('host latency', [(h, host_latencies[h].all_ops().summary())
+                                                        for h in sorted(host_latencies.keys())]))
+
+    # cluster-wide percentiles for each interval, merged from the
+    # interval histograms that each thread returned
+
+    rslt['latency-over-time'] = LatencyTimeline.merged_summaries(
+            [p.latency_timeline for p in subprocess_list])
+
+    # if pauses took much longer than requested, the harness and not
+    # the filesystem may have been limiting throughput
+
+    if cluster.pauses > 0:
+        requested = cluster.pause_requested_usec / float(cluster.pauses)
+        achieved = cluster.pause_achieved_usec / float(cluster.pauses)
+        print('pause between ops requested = %9.1f usec, achieved = %9.1f usec' % (requested, achieved))
+        rslt['pacing'] = {'pauses': cluster.pauses,
+                          'requested-usec-per-op': requested,
+                          'achieved-usec-per-op': achieved}
+
     print('elapsed time = %9.3f' % max_elapsed_time)
     rslt['elapsed'] = max_elapsed_time
 
@@ -0,0 +1,114 @@
+# pacer.py - precise pauses between ops
+#
+# --pause-between-ops is usually a few hundred microseconds or less, but
+# time.sleep() of that long oversleeps by the kernel timer slack and
+# scheduling latency, often by more than the pause itself, which silently
+# caps how many ops per second a thread can do.  The Pacer keeps a
+# deadline for the end of each pause: it sleeps until shortly before the
+# deadline and spins for the rest, and if a pause still takes longer than
+# requested, the excess is carried forward as credit that shortens the
+# following pauses, so on average each op is followed by the requested pause.
+# Requested and achieved pause time are added to the thread's counters so
+# the results show when pacing, not the filesystem, is limiting throughput.
+
+import time
+
+from fs_drift.common import FsDriftException
+
+
+class Pacer:
+
+    # pauses shorter than this are spun out entirely, longer ones
+    # sleep until this long before the deadline and spin the rest
+
+    spin_threshold = 0.0005
+
+    # never carry forward more than this much oversleep (seconds),
+    # e.g. if the process was stopped during a pause
+
+    max_credit = 1.0
+
+    def __init__(self, interval, ctrs=None):
+        if interval < 0.0:
+            raise FsDriftException('pause between ops cannot be negative')
+        self.interval = interval
+        self.ctrs = ctrs
+        # pause time still owed, negative when pauses have overslept
+        self.debt = 0.0
+        self.pauses = 0
+        self.requested = 0.0
+        self.achieved = 0.0
+
+    # pause for one interval, less any oversleep carried forward
+
+    def pause(self):
+        interval = self.interval
+        if interval <= 0.0:
+            return
+        self.debt += interval
+        start = time.perf_counter()
+        end = start
+        if self.debt > 0.0:
+            deadline = start + self.debt
+            if self.debt > Pacer.spin_threshold:
+                time.sleep(self.debt - Pacer.spin_threshold)
+            end = time.perf_counter()
+            while end < deadline:
+                # lets other threads (e.g. --iodepth lanes) run while spinning
+                time.sleep(0)
+                end = time.perf_counter()
+        achieved = end - start
+        self.debt = max(self.debt - achieved, -Pacer.max_credit)
+        self.pauses += 1
+        self.requested += interval
+        self.achieved += achieved
+        c = self.ctrs
+        if c != None:
+            c.pauses += 1
+            c.pause_requested_usec = int(self.requested * 1.0e6)
+            c.pause_achieved_usec = int(self.achieved * 1.0e6)
+
+
+if __name__ == '__main__':
+    from fs_drift.fsop_counters import FSOPCounters
+
+    # how far plain time.sleep() misses short pauses, compared with the pacer
+    n = 2000
+    for interval in [0.00002, 0.0001, 0.001]:
+        start = time.perf_counter()
+        for k in range(0, n):
+            time.sleep(interval)
+        sleep_avg = (time.perf_counter() - start) / n
+        ctrs = FSOPCounters()
+        p = Pacer(interval, ctrs)
+        start = time.perf_counter()
+        for k in range(0, n):
+            p.pause()
+        pacer_avg = (time.perf_counter() - start) / n
+        print('%6d usec pause: time.sleep takes %7.1f usec, pacer %7.1f usec' %
+              (interval * 1.0e6, sleep_avg * 1.0e6, pacer_avg * 1.0e6))
+        assert(abs(pacer_avg - interval) < 0.05 * interval + 0.000005)
+        assert(ctrs.pauses == n)
+        assert(abs(ctrs.pause_requested_usec - n * interval * 1.0e6) <= 1)
+        assert(abs(ctrs.pause_achieved_usec - ctrs.pause_requested_usec) < 0.05 * ctrs.pause_requested_usec + 5 * n)
+
+    # oversleep is made up by the following pauses
+    p = Pacer(0.001)
+    p.debt = -0.005
+    start = time.perf_counter()
+    for k in range(0, 10):
+        p.pause()
+    elapsed = time.perf_counter() - start
+    assert(0.0045 < elapsed < 0.0065)
+
+    # no pause at all when none is requested
+    ctrs = FSOPCounters()
+    p = Pacer(0.0, ctrs)
+    p.pause()
+    assert(ctrs.pauses == 0)
+    try:
+        Pacer(-1.0)
+        assert(False)
+    except FsDriftException:
+        pass
+    print('pacer unit test passed')
@@ -1,6 +1,6 @@
 import argparse
 import os
-from fs_drift.common import FileSizeDistr, FileAccessDistr
+from fs_drift.common import FileSizeDistr, FileAccessDistr, IOMode, IOEngine, RateScope, ArrivalDistr, SampleLogFormat
 from fs_drift.common import BYTES_PER_KiB
 
 TypeExc = argparse.ArgumentTypeError
@@ -92,6 +92,13 @@ def positive_percentage(pos_float_str):
     return f
 
 
+def latency_digits(digits_str):
+    i = int(digits_str)
+    if i < 1 or i > 5:
+        raise TypeExc('latency histogram precision must be 1 to 5 significant digits')
+    return i
+
+
 def host_set(hostname_list_str):
     if os.path.isfile(hostname_list_str):
         with open(hostname_list_str, 'r') as f:
@@ -116,6 +123,58 @@ def file_access_distrib(distrib_str):
         raise TypeExc(
             'file access distribution must be either "gaussian" or "uniform"')
 
+
+def io_mode(mode_str):
+    if mode_str == 'seek':
+        return IOMode.seek
+    elif mode_str == 'positional':
+        return IOMode.positional
+    elif mode_str == 'vectored':
+        return IOMode.vectored
+    else:
+        raise TypeExc(
+            'I/O mode must be one of "seek", "positional" or "vectored"')
+
+
+def io_engine(engine_str):
+    if engine_str == 'sync':
+        return IOEngine.sync
+    elif engine_str == 'io_uring':
+        return IOEngine.io_uring
+    else:
+        raise TypeExc(
+            'I/O engine must be one of "sync" or "io_uring"')
+
+
+def rate_scope(scope_str):
+    if scope_str == 'thread':
+        return RateScope.thread
+    elif scope_str == 'cluster':
+        return RateScope.cluster
+    else:
+        raise TypeExc(
+            'target rate scope must be one of "thread" or "cluster"')
+
+
+def arrival_distrib(distrib_str):
+    if distrib_str == 'fixed':
+        return ArrivalDistr.fixed
+    elif distrib_str == 'poisson':
+        return ArrivalDistr.poisson
+    else:
+        raise TypeExc(
+            'arrival distribution must be one of "fixed" or "poisson"')
+
+
+def sample_log_format(format_str):
+    if format_str == 'csv':
+        return SampleLogFormat.csv
+    elif format_str == 'binary':
+        return SampleLogFormat.binary
+    else:
+        raise TypeExc(
+            'sample log format must be one of "csv" or "binary"')
+
 #If the input is g or G, multiply by 1024*1024*1024
 #If the input is m or M, multiply by 1024*1024
 #If the input is k or K multiply by 1024
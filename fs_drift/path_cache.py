@@ -0,0 +1,137 @@
+# path_cache.py - memoized mapping from file index to pathname
+#
+# every op turns a random file index into a relative pathname like
+# ./d0003/d0001/f000000123, which takes string formatting and an
+# os.path.join per directory level.  PathCache computes each pathname
+# once, already encoded as bytes (which every os.* call accepts), and
+# remembers it.  When the whole index range fits in "capacity" entries
+# the cache is a flat list indexed by file index, otherwise it is an LRU
+# holding at most "capacity" entries, so memory use stays bounded
+# however large --max-files is.
+#
+# the index -> directory mapping uses only integer arithmetic: the
+# directory index is file_index // files_per_dir, and its base-subdirs_per_dir
+# digits, least significant first, select the subdirectory at each level.
+
+from collections import OrderedDict
+
+from fs_drift.common import FsDriftException
+
+
+class PathCache:
+
+    default_capacity = 1 << 16
+
+    def __init__(self, levels, subdirs_per_dir, files_per_dir, max_files, capacity=default_capacity):
+        if files_per_dir < 1 or subdirs_per_dir < 1:
+            raise FsDriftException('files per dir and subdirs per dir must be positive')
+        self.levels = levels
+        self.subdirs_per_dir = subdirs_per_dir
+        self.files_per_dir = files_per_dir
+        self.capacity = capacity
+        # file indexes run from 0 to max_files inclusive
+        self.array_backed = (max_files + 1 <= capacity)
+        if self.array_backed:
+            self.paths = [None] * (max_files + 1)
+        else:
+            self.paths = OrderedDict()
+        self.dirs = {}
+
+    def __len__(self):
+        if self.array_backed:
+            return len(self.paths) - self.paths.count(None)
+        return len(self.paths)
+
+    def dir_index(self, file_index):
+        return file_index // self.files_per_dir
+
+    def compute_dirname(self, dir_index):
+        components = [b'.']
+        for j in range(0, self.levels):
+            components.append(b'd%04d' % (1 + (dir_index % self.subdirs_per_dir)))
+            dir_index //= self.subdirs_per_dir
+        return b'/'.join(components)
+
+    # directory containing file "file_index", there are only
+    # subdirs_per_dir ** levels of them so they are simply all kept
+
+    def dirname(self, file_index):
+        dir_index = file_index // self.files_per_dir
+        try:
+            return self.dirs[dir_index]
+        except KeyError:
+            d = self.compute_dirname(dir_index)
+            if len(self.dirs) >= self.capacity:
+                self.dirs.clear()
+            self.dirs[dir_index] = d
+            return d
+
+    def compute_path(self, file_index):
+        return self.dirname(file_index) + b'/f%09d' % file_index
+
+    def path(self, file_index):
+        paths = self.paths
+        if self.array_backed:
+            p = paths[file_index]
+            if p is None:
+                p = self.compute_path(file_index)
+                paths[file_index] = p
+            return p
+        try:
+            p = paths[file_index]
+            paths.move_to_end(file_index)
+            return p
+        except KeyError:
+            p = self.compute_path(file_index)
+            paths[file_index] = p
+            if len(paths) > self.capacity:
+                paths.popitem(last=False)
+            return p
+
+
+if __name__ == '__main__':
+    import os.path
+    import time
+
+    # must agree with the original float-based gen_random_dirname
+    def reference_path(file_index, levels, subdirs_per_dir, files_per_dir):
+        d = '.'
+        index = file_index // files_per_dir
+        for j in range(0, levels):
+            subdir_index = 1 + (index % subdirs_per_dir)
+            d = os.path.join(d, 'd%04d' % subdir_index)
+            index /= subdirs_per_dir
+        return os.path.join(d, 'f%09d' % file_index)
+
+    for (levels, subdirs, files_per_dir, max_files) in [(2, 3, 22, 200), (3, 10, 7, 7000), (0, 5, 100, 10)]:
+        for capacity in [PathCache.default_capacity, 50]:
+            cache = PathCache(levels, subdirs, files_per_dir, max_files, capacity=capacity)
+            assert(cache.array_backed == (max_files + 1 <= capacity))
+            for k in list(range(0, max_files + 1)) + list(range(max_files, -1, -3)):
+                p = cache.path(k)
+                assert(p == os.fsencode(reference_path(k, levels, subdirs, files_per_dir)))
+                assert(cache.path(k) is p)
+                assert(os.path.dirname(p) == cache.dirname(k))
+            assert(len(cache) <= max(capacity, max_files + 1))
+            if not cache.array_backed:
+                assert(len(cache) == capacity)
+    assert(PathCache(2, 3, 1, 10).path(5) == b'./d0003/d0002/f000000005')
+
+    # integer math stays exact where the float version would not
+    big = PathCache(4, 100, 1, 10**17, capacity=10)
+    assert(big.path(10**17 - 1) == b'./d0100/d0100/d0100/d0100/f99999999999999999')
+
+    # lookup cost compared with building the path every time
+    n = 200000
+    cache = PathCache(3, 10, 1000, 1000000)
+    indices = [(k * 7919) % 20000 for k in range(0, n)]
+    start = time.perf_counter()
+    for k in indices:
+        reference_path(k, 3, 10, 1000)
+    build_usec = (time.perf_counter() - start) * 1.0e6 / n
+    start = time.perf_counter()
+    for k in indices:
+        cache.path(k)
+    cached_usec = (time.perf_counter() - start) * 1.0e6 / n
+    print('%5.2f usec/path to build, %5.2f usec/path from LRU cache' % (build_usec, cached_usec))
+    print('path_cache unit test passed')
@@ -0,0 +1,178 @@
+# queue_depth.py - keep several data-path requests outstanding per worker
+#
+# a worker normally has exactly one op in flight, so reaching the
+# queue depth that NVMe or a distributed filesystem needs takes hundreds
+# of worker processes.  With --iodepth N, data-path ops are handed to
+# a pool of N threads instead.  The blocking syscalls they issue
+# release the GIL, so one process keeps up to N requests outstanding.
+# Each op runs in its own "lane" (see FSOPCtx.make_lane) and when it
+# finishes, its counters, response time and bandwidth are reported back
+# through a completion queue, which the worker thread drains into the
+# same counters and response-time records that synchronous ops use.
+
+import time
+import queue
+from concurrent.futures import ThreadPoolExecutor
+
+from fs_drift.common import rq, OK, NOTOK, FsDriftException
+from fs_drift.fsop_counters import FSOPCounters
+
+
+class QDCompletion:
+
+    def __init__(self, lane, opname, rc, start_time, end_time):
+        self.lane = lane
+        self.opname = opname
+        self.rc = rc
+        self.start_time = start_time
+        self.end_time = end_time
+        self.ctrs = lane.ctrs
+        self.measured_io = lane.measured_io
+
+
+class QueueDepthEngine:
+
+    # only these ops move data, metadata ops are still done synchronously
+
+    data_path_ops = frozenset([
+        rq.READ,
+        rq.RANDOM_READ,
+        rq.CREATE,
+        rq.RANDOM_WRITE,
+        rq.APPEND,
+        rq.WRITE,
+        rq.RANDOM_DISCARD])
+
+    def __init__(self, ctx, depth):
+        self.depth = depth
+        ctx.share_file_selection()
+        self.lanes = [ctx.make_lane() for k in range(0, depth)]
+        self.free_lanes = list(self.lanes)
+        self.completions = queue.SimpleQueue()
+        self.executor = ThreadPoolExecutor(max_workers=depth,
+                                           thread_name_prefix='iodepth-%s' % ctx.tid)
+
+    def is_data_path(self, rqcode):
+        return rqcode in QueueDepthEngine.data_path_ops
+
+    def inflight(self):
+        return self.depth - len(self.free_lanes)
+
+    def full(self):
+        return len(self.free_lanes) == 0
+
+    def set_verbosity(self, verbosity):
+        for lane in self.lanes:
+            lane.verbosity = verbosity
+
+    # runs in a pool thread
+
+    def _run(self, lane, rqcode, opname, start_time):
+        rc = NOTOK
+        try:
+            rc = lane.invoke_rq(rqcode)
+        except (FsDriftException, OSError) as e:
+            lane.log.exception(e)
+        finally:
+            self.completions.put(QDCompletion(lane, opname, rc, start_time, time.time()))
+
+    def submit(self, rqcode, opname, start_time):
+        try:
+            lane = self.free_lanes.pop()
+        except IndexError:
+            raise FsDriftException('iodepth %d exceeded' % self.depth)
+        lane.ctrs = FSOPCounters()
+        lane.measured_io = None
+        self.executor.submit(self._run, lane, rqcode, opname, start_time)
+
+    # return list of completed ops, if block is True
+    # then wait until at least one op completes
+
+    def reap(self, block=False):
+        done = []
+        if block and self.inflight() > 0:
+            done.append(self.completions.get())
+        while True:
+            try:
+                done.append(self.completions.get_nowait())
+            except queue.Empty:
+                break
+        for c in done:
+            self.free_lanes.append(c.lane)
+        return done
+
+    # wait for every outstanding op to complete
+
+    def drain(self):
+        done = []
+        while self.inflight() > 0:
+            done.extend(self.reap(block=True))
+        return done
+
+    def shutdown(self):
+        self.executor.shutdown(wait=True)
+        for lane in self.lanes:
+            lane.bufpool.close()
+            if lane.uring != None:
+                lane.uring.close()
+            if lane.dirfds != None:
+                lane.dirfds.clear()
+
+
+if __name__ == '__main__':
+    import os
+    import opts
+    import fs_drift.fsd_log
+    from fs_drift.fsop import FSOPCtx, fs_fullness
+    options = opts.parseopts()
+    log = fs_drift.fsd_log.start_log('queue-depth-unittest')
+    if not options.top_directory.__contains__('/tmp/'):
+        raise FsDriftException('bad top directory')
+    os.system('rm -rf %s' % options.top_directory)
+    os.makedirs(options.top_directory)
+    os.chdir(options.top_directory)
+    ctrs = FSOPCounters()
+    ctx = FSOPCtx(options, log, ctrs, 'test-host', 'test-tid')
+    engine = QueueDepthEngine(ctx, 4)
+    assert(engine.inflight() == 0)
+    completed = 0
+    opcodes = [rq.CREATE, rq.READ, rq.RANDOM_READ, rq.APPEND, rq.RANDOM_WRITE, rq.WRITE]
+    for j in range(0, 500):
+        rqcode = opcodes[j % len(opcodes)]
+        assert(engine.is_data_path(rqcode))
+        engine.submit(rqcode, FSOPCtx.opcode_to_opname[rqcode], time.time())
+        assert(engine.inflight() <= 4)
+        for c in engine.reap(block=engine.full()):
+            assert(c.rc == OK)
+            assert(c.end_time >= c.start_time)
+            c.ctrs.add_to(ctrs)
+            completed += 1
+    for c in engine.drain():
+        c.ctrs.add_to(ctrs)
+        completed += 1
+    engine.shutdown()
+    assert(completed == 500)
+    assert(engine.inflight() == 0)
+    assert(not engine.is_data_path(rq.DELETE))
+    assert(ctrs.have_created + ctrs.e_already_exists > 0)
+    assert(ctrs.write_requests > 0)
+
+    # creates in lanes stop once the filesystem gets over --fullness-limit-percent,
+    # lanes are made while it is still empty
+    ctx = FSOPCtx(options, log, ctrs, 'test-host', 'test-tid')
+    ctx.fs_fullness = 0.0
+    engine = QueueDepthEngine(ctx, 4)
+    options.fullness_limit_pct = fs_fullness(os.statvfs(options.top_directory)) * 100.0 / 2
+    ctx.get_fs_stats()
+    assert(ctx.fs_is_full() and all([lane.fs_is_full() for lane in engine.lanes]))
+    created = ctrs.have_created
+    for j in range(0, 100):
+        engine.submit(rq.CREATE, 'create', time.time())
+        for c in engine.reap(block=engine.full()):
+            c.ctrs.add_to(ctrs)
+    for c in engine.drain():
+        c.ctrs.add_to(ctrs)
+    engine.shutdown()
+    assert(ctrs.have_created == created)
+    print(ctrs)
+    print('queue_depth unit test passed')
@@ -4,76 +4,251 @@ import string
 import array
 import os
 import mmap
+import numpy
 from numpy import append
-from fs_drift.common import myassert, BYTES_PER_KiB
+from fs_drift.common import myassert, BYTES_PER_KiB, FsDriftException
 
-#Generate buffer of deduplicable and compressible data
-#*Step 1: generate some compressible blocks by fillng a portion
-#with random data and pad the rest with zeroes
-#*Step 2: repeat these blocks in the buffer to achieve deduplicability
-#Note, I know this looks bad, but I'm trying to squeeze in as much performance
-#as possible
+CONTENT_BLOCK_SIZE = 4 * BYTES_PER_KiB
 
+#Generate deduplicable and compressible data
+#*Step 1: generate a fixed pool of compressible blocks by filling a portion
+#with random data and padding the rest with zeroes
+#*Step 2: stream blocks out of the pool, stamping each unique block with
+#a counter so it never matches any other, and repeating the previous
+#unique block wherever a duplicate is due
+#memory use depends on the pool and window sizes, not on how much is written
 
-def gen_compressible_buffer(size_bytes, compression_ratio, dedupe):
+
+def gen_block_pool(pool_blocks, compression_ratio, seed=None):
     compress = 1
     if compression_ratio:
         compress = 1/compression_ratio
-    to_dedupe = (dedupe/100)
-    if not to_dedupe:
-        to_dedupe = 1
-        repeat_buf = 1
-    else:
-        repeat_buf = int(1 / (1 - to_dedupe))
-    number_of_blocks = int((size_bytes / (4 * BYTES_PER_KiB)) * to_dedupe)
+    random_len = int(compress * CONTENT_BLOCK_SIZE)
+    pool = numpy.zeros((pool_blocks, CONTENT_BLOCK_SIZE), dtype=numpy.uint8)
+    pool[:, 0:random_len] = numpy.random.default_rng(seed).integers(
+            0, 256, size=(pool_blocks, random_len), dtype=numpy.uint8)
+    return pool
+
+
+class CompressibleStream:
+
+    # 4 MiB of random blocks, more than typical compressor windows,
+    # so block contents do not visibly repeat within a record
+
+    default_pool_blocks = 1024
+
+    # each unique block starts with 8 bytes of per-stream salt
+    # and 8 bytes of block counter
+
+    stamp_size = 16
+
+    # "window" is a writable buffer (e.g. an mmap) that records are
+    # generated into, it must hold at least one block more than
+    # the largest run of records that is requested at once
+
+    def __init__(self, window, compression_ratio, dedupe_pct, pool=None, seed=None):
+        self.window = numpy.frombuffer(window, dtype=numpy.uint8)
+        self.window_blocks = len(self.window) // CONTENT_BLOCK_SIZE
+        if self.window_blocks < 2:
+            raise FsDriftException('content window must hold at least 2 blocks')
+        if pool is None:
+            pool = gen_block_pool(CompressibleStream.default_pool_blocks, compression_ratio, seed)
+        self.pool = pool
+        self.dedupe = dedupe_pct / 100.0
+        self.rng = numpy.random.default_rng(seed)
+        self.restart()
+
+    # start a new stream (e.g. for the next file),
+    # none of its unique blocks match those of earlier streams
+
+    def restart(self):
+        self.salt = self.rng.integers(0, 256, size=8, dtype=numpy.uint8)
+        self.window_start = 0
+        self.window_end = 0
+
+    # regenerate the window so it starts with the block containing stream byte "offset"
+    # block b repeats the previous unique block when the number of duplicates
+    # due by block b, floor((b+1) * dedupe), goes up, so every prefix of
+    # the stream has the requested share of duplicates
+
+    def fill(self, offset):
+        first = offset // CONTENT_BLOCK_SIZE
+        nblocks = self.window_blocks
+        b = numpy.arange(first, first + nblocks, dtype=numpy.int64)
+        counters = b - numpy.floor((b + 1) * self.dedupe).astype(numpy.int64)
+        numpy.maximum(counters, 0, out=counters)
+        blocks = self.window[0:nblocks * CONTENT_BLOCK_SIZE].reshape(nblocks, CONTENT_BLOCK_SIZE)
+        numpy.take(self.pool, counters % len(self.pool), axis=0, out=blocks)
+        blocks[:, 0:8] = self.salt
+        blocks[:, 8:16] = counters.astype('<u8').view(numpy.uint8).reshape(nblocks, 8)
+        self.window_start = first * CONTENT_BLOCK_SIZE
+        self.window_end = self.window_start + nblocks * CONTENT_BLOCK_SIZE
+
+    # make stream bytes [offset, offset+length) available in the window
+    # and return where they start in it
+
+    def locate(self, offset, length):
+        if offset < self.window_start or offset + length > self.window_end:
+            if length > (self.window_blocks - 1) * CONTENT_BLOCK_SIZE:
+                raise FsDriftException('%d bytes of content requested, window holds %d' %
+                                       (length, (self.window_blocks - 1) * CONTENT_BLOCK_SIZE))
+            self.fill(offset)
+        return offset - self.window_start
+
+
+# whole buffer of compressible/dedupable data, for callers that want
+# all of it at once, writers should use CompressibleStream directly
 
-    blocks = bytearray()
-    for i in range(number_of_blocks):
-        blocks.extend(bytearray(os.urandom(int(compress * 4 * BYTES_PER_KiB))) + bytearray(((4 * BYTES_PER_KiB)-int(compress * 4 * BYTES_PER_KiB))*b'\0'))
-
-    return repeat_buf * blocks
+def gen_compressible_buffer(size_bytes, compression_ratio, dedupe):
+    blocks = (size_bytes + CONTENT_BLOCK_SIZE - 1) // CONTENT_BLOCK_SIZE + 1
+    window = bytearray(blocks * CONTENT_BLOCK_SIZE)
+    stream = CompressibleStream(window, compression_ratio, dedupe)
+    stream.locate(0, size_bytes)
+    return window[0:size_bytes]
 
 
 starter_array_len = 1024
 
 
 def gen_init_buffer(size_bytes):
-  b = array.array('B')
-  for k in range(0, size_bytes):
-    index = k % len(string.printable)
-    printable_char = string.printable[index]
-    b.append(ord(printable_char))
-  return b
+    printable = string.printable.encode()
+    repeats = size_bytes // len(printable) + 1
+    return array.array('B', (printable * repeats)[0:size_bytes])
 
 
 starter_buffer = gen_init_buffer(starter_array_len)
 
-# use doubling of buffer size to reduce time spent in python interpreter
-# the loop in gen_init_buffer is very expensive per byte
+# seed used for the incompressible pattern unless the caller picks one
+
+incompressible_seed = 0x66736472
+
+# random bytes are generated this much at a time
+# so that no temporary copy of a large buffer is needed
+
+random_chunk_size = 1 << 22
+
 
+# fill a writable buffer (e.g. an mmap) in place with the data pattern:
+# the printable starter pattern repeated, written through a broadcast
+# assignment of the pattern to a (rows, pattern length) view of the
+# destination, so there is no intermediate copy,
+# or with seeded random (incompressible) data if "seed" is not None
 
-def gen_buffer(size_bytes):
-  b = array.array('B')
-  if size_bytes < starter_array_len:
-    b = starter_buffer[0:size_bytes]
-  else:
-    b = starter_buffer[:]
-    while len(b) < size_bytes / 2:
-      b = append(b, b)
-    remainder = size_bytes - len(b)
-    b = append(b, b[0:remainder])
-    myassert(len(b) == size_bytes)
-  return b
+def fill_buffer(dest, seed=None):
+    a = numpy.frombuffer(dest, dtype=numpy.uint8)
+    if seed is not None:
+        rng = numpy.random.default_rng(seed)
+        for k in range(0, len(a), random_chunk_size):
+            chunk = a[k:k + random_chunk_size]
+            chunk[:] = numpy.frombuffer(rng.bytes(len(chunk)), dtype=numpy.uint8)
+        return
+    pattern = numpy.frombuffer(starter_buffer, dtype=numpy.uint8)
+    whole = len(a) - len(a) % len(pattern)
+    a[0:whole].reshape(-1, len(pattern))[:] = pattern
+    a[whole:] = pattern[0:len(a) - whole]
+
+
+# return a page-aligned mmap of size_bytes holding the data pattern
+
+def gen_buffer(size_bytes, seed=None):
+    b = mmap.mmap(-1, max(size_bytes, 1))
+    if size_bytes < 1:
+        b.close()
+        return b''
+    fill_buffer(b, seed)
+    return b
 
 
 if __name__ == '__main__':
     import time
-    start_time = time.perf_counter()
-    buf = gen_buffer(1000)
-    print('Time elapsed:', (time.perf_counter() - start_time)*1000)
-    start_time = time.perf_counter()
-    buf = gen_buffer(1000000)
-    print('Time elapsed:', (time.perf_counter() - start_time)*1000)
+    import zlib
+
+    # same pattern as the original array-doubling implementation
+    def reference_buffer(size_bytes):
+        b = starter_buffer[:]
+        while len(b) < size_bytes:
+            b = append(b, b)
+        return bytes(b[0:size_bytes])
+
+    for size in [0, 1, 1000, 1024, 4096, 1000000]:
+        buf = gen_buffer(size)
+        assert(len(buf) == size and bytes(buf) == reference_buffer(size))
+    assert(len(gen_init_buffer(333)) == 333 and chr(gen_init_buffer(333)[100]) == string.printable[0])
+    buf = gen_buffer(1 << 20, seed=5)
+    assert(bytes(buf) == bytes(gen_buffer(1 << 20, seed=5)))
+    assert(bytes(buf) != bytes(gen_buffer(1 << 20, seed=6)))
+    assert(len(zlib.compress(buf, 1)) > len(buf))
+    assert(len(zlib.compress(gen_buffer(1 << 20), 1)) < len(buf) / 50)
+
+    # buffer build time from 4 KiB to 1 GiB, the old way up to 256 MiB
+    size = 4096
+    while size <= 1 << 30:
+        start_time = time.perf_counter()
+        buf = gen_buffer(size)
+        pattern_sec = time.perf_counter() - start_time
+        buf.close()
+        start_time = time.perf_counter()
+        buf = gen_buffer(size, seed=incompressible_seed)
+        random_sec = time.perf_counter() - start_time
+        buf.close()
+        old_way = ''
+        if size <= 1 << 28:
+            start_time = time.perf_counter()
+            b = starter_buffer[:]
+            while len(b) < size / 2:
+                b = append(b, b)
+            b = append(b, b[0:size - len(b)])
+            old_way = '%10.6f sec old pattern' % (time.perf_counter() - start_time)
+            del b
+        print('%10d bytes: %10.6f sec pattern %10.6f sec incompressible %s' %
+              (size, pattern_sec, random_sec, old_way))
+        size *= 8
     start_time = time.perf_counter()
     buf = gen_compressible_buffer(4096*245, 50, 4.0)
     print('Time elapsed:', (time.perf_counter() - start_time)*1000)
+    assert(len(buf) == 4096*245)
+
+    # compression and dedupe ratios hold over a long stream
+    # that is much bigger than the memory it is generated in
+    import zlib
+    window = mmap.mmap(-1, 1 << 20)
+    for (ratio, dedupe_pct) in [(4.0, 0), (2.0, 50), (0, 75), (8.0, 25)]:
+        stream = CompressibleStream(window, ratio, dedupe_pct, seed=1)
+        record_size = 192 * 1024
+        stream_len = 300 * record_size
+        blocks_seen = set()
+        duplicates = 0
+        compressed = 0
+        start_time = time.perf_counter()
+        for offset in range(0, stream_len, record_size):
+            start = stream.locate(offset, record_size)
+            record = bytes(window[start:start + record_size])
+            compressed += len(zlib.compress(record, 1))
+            for k in range(0, record_size, CONTENT_BLOCK_SIZE):
+                block = record[k:k + CONTENT_BLOCK_SIZE]
+                if block in blocks_seen:
+                    duplicates += 1
+                else:
+                    blocks_seen.add(block)
+        elapsed = time.perf_counter() - start_time
+        del block, record
+        dup_pct = 100.0 * duplicates / (stream_len // CONTENT_BLOCK_SIZE)
+        achieved_ratio = stream_len / compressed
+        print('ratio %4.1f dedupe %3d%%: got ratio %5.2f, %5.1f%% duplicate blocks, %6.0f MiB/s' %
+              (ratio, dedupe_pct, achieved_ratio, dup_pct, stream_len / elapsed / (1 << 20)))
+        assert(abs(dup_pct - dedupe_pct) < 0.1)
+        if dedupe_pct == 0:
+            # zlib cannot see across blocks further apart than 32 KiB,
+            # so only the zero-filled part of each block compresses
+            assert(abs(achieved_ratio - (ratio if ratio else 1.0)) < 0.15 * ratio)
+        # a restarted stream shares no blocks with the previous one
+        stream.restart()
+        start = stream.locate(0, CONTENT_BLOCK_SIZE)
+        assert(bytes(window[start:start + CONTENT_BLOCK_SIZE]) not in blocks_seen)
+        del stream
+    try:
+        CompressibleStream(window, 2.0, 0).locate(0, 1 << 20)
+        assert(False)
+    except FsDriftException:
+        pass
+    print('random_buffer unit test passed')
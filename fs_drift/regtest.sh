@@ -52,7 +52,22 @@ echo "log directory is $logdir"
 
 # run unit tests first
 
+chk "$PY buffer_pool.py"
+chk "$PY io_uring.py"
+chk "$PY decision_stream.py"
+chk "$PY path_cache.py"
+chk "$PY dirfd_cache.py"
+chk "$PY content_pool.py"
+chk "$PY open_loop.py"
+chk "$PY pacer.py"
+chk "$PY latency_histogram.py"
+chk "$PY sample_log.py"
+chk "$PY telemetry.py"
+chk "$PY live_stream.py"
+chk "$PY metrics_exporter.py"
+chk "$PY simtime.py"
 chk "$PY fsop.py"
+chk "$PY queue_depth.py"
 chk "$PY event.py"
 if [ -n "$test_ssh" ] ; then
 	sudo systemctl start sshd || exit 1
@@ -125,6 +140,24 @@ export params_json_fn=/tmp/fs-drift-result.json
 chk "./compute-rates.py /var/tmp/mydir/network-shared"
 # response time processing used by benchmark-operator
 chk "./rsptime_stats.py --time-interval 1 /var/tmp/mydir/network-shared"
+# binary response time and bandwidth logs, converted back to CSV
+rm -rf /var/tmp/mydir
+mkdir /var/tmp/mydir
+chk "./fs-drift.py --top /var/tmp/mydir --duration 5 --response-times True --save-bw True --sample-log-format binary"
+chk "./sample-log-to-csv.py /var/tmp/mydir/network-shared"
+# thread files kept on local scratch dir, moved to shared dir at the end
+rm -rf /var/tmp/mydir
+mkdir /var/tmp/mydir
+chk "./fs-drift.py --top /var/tmp/mydir --duration 5 --response-times True --report-interval 1 --local-scratch-dir /tmp"
+chk "ls /var/tmp/mydir/network-shared/counters.*.json"
+chk "./rsptime_stats.py --time-interval 1 /var/tmp/mydir/network-shared"
+# Prometheus metrics while the test runs
+rm -rf /var/tmp/mydir
+mkdir /var/tmp/mydir
+./fs-drift.py --top /var/tmp/mydir --duration 6 --metrics-port 19877 > /tmp/fs-drift-metrics.log 2>&1 &
+sleep 4
+chk "curl -s http://localhost:19877/metrics | grep '^fsdrift_ops_total'"
+chk "wait $!"
 
 # test multi-host feature
 
@@ -132,4 +165,6 @@ if [ -n "$test_ssh" ] ; then
 	rm -rf /var/tmp/mydir2
 	mkdir /var/tmp/mydir2
 	chk "./fs-drift.py --host-set localhost --top /var/tmp/mydir2 --response-times True --save-bw True --output-json /tmp/fs-drift-result2.json"
+	chk "./fs-drift.py --host-set localhost --top /var/tmp/mydir2 --duration 5 --live-stream-port 19876"
+	chk "jq '.[].hosts.localhost' /var/tmp/mydir2/network-shared/live-cluster-rates.json | grep ops-per-sec"
 fi
@@ -15,19 +15,18 @@
 # this program has to be adjusted to parse the filenames
 # and extract 2 fields, thread number and short hostname
 #
+# response times are held in NumPy arrays (16 bytes per sample) rather than
+# lists of tuples, files are parsed in parallel by a pool of processes,
+# cluster-wide samples are sorted by time once, and each time interval
+# is found in the sorted samples with a binary search (searchsorted).
 #
 import sys
 from sys import argv
 import os
-import string
 import re
+import multiprocessing
 import numpy
-import scipy
-import scipy.stats
-from scipy.stats import tmean, tstd
-import bisect
-
-time_infinity = 1 << 62
+import fs_drift.sample_log
 
 # edit this list if you want additional percentiles
 
@@ -40,95 +39,56 @@ def usage(msg):
   print('usage: python smallfile_rsptimes_stats.py ')
   print('           [ --common-hostname-suffix my.suffix ] ')
   print('           [ --time-interval positive-integer-seconds ] ')
+  print('           [ --processes positive-integer ] ')
   print('           directory')
   sys.exit(1)
 
-# parse files once, we assume here that we can hold them in RAM
-# so we don't have to keep reading them
-# by keeping them in RAM we allow binary search for starting
-# time since we want to isolate set of samples in a time interval
-
-
-def parse_rsptime_file(result_dir, csv_pathname):
-    samples = []
-    with open(os.path.join(result_dir, csv_pathname), 'r') as f:
-        records = [l.strip() for l in f.readlines()]
-        for sample in records:
-            components = sample.split(',')
-            at_time = float(components[0])
-            rsp_time = float(components[1])
-            op = components[2]
-            samples.append((op, at_time, rsp_time))
-    return samples
-
 
-# to be used for sorting based on tuple components
+# parse one response time log into a pair of float64 arrays,
+# the time each op started (since the start of the test) and its response time.
+# this runs in a pool of processes, one file at a time
 
-def get_at_time(rsptime_tuple):
-    (_, at_time, _) = rsptime_tuple
-    return at_time
+def parse_rsptime_file(pathname):
+    if pathname.endswith('.bin'):
+        # binary log from --sample-log-format binary, see sample_log.py
+        (_, records) = fs_drift.sample_log.read_samples(pathname)
+        return (records['time'].astype(numpy.float64), records['latency'].astype(numpy.float64))
+    if os.path.getsize(pathname) == 0:
+        return (numpy.zeros(0), numpy.zeros(0))
+    # only the first 2 columns are parsed, the op name is not needed
+    columns = numpy.loadtxt(pathname, delimiter=',', usecols=(0, 1), dtype=numpy.float64, ndmin=2)
+    return (numpy.ascontiguousarray(columns[:, 0]), numpy.ascontiguousarray(columns[:, 1]))
 
 
-def get_rsp_time(rsptime_tuple):
-    (_, _, rsp_time) = rsptime_tuple
-    return rsp_time
+# stats for one set of response times, in no particular order
 
-
-# this function avoids duplication of sorting
-
-def do_sorting(sample_set, already_sorted=False):
-    if not already_sorted:
-        sorted_samples = sorted(sample_set, key=get_at_time)
-    else:
-        sorted_samples = sample_set
-    sorted_keys = list(map(get_at_time, sorted_samples))
-    sorted_rsptimes = list(sorted(map(get_rsp_time, sample_set)))
-    return (sorted_samples, sorted_keys, sorted_rsptimes)
-
-
-# leverage python binary search module "bisect"
-# obtained from https://docs.python.org/2/library/bisect.html#searching-sorted-lists
-
-def find_le(a, x):
-    # find highest index with value < x
-    i = bisect.bisect_right(a, x)
-    return i
-
-
-def find_gt(a, x):
-    # find lowest index with value >= x
-    i = bisect.bisect_left(a, x)
-    if i < len(a):
-        return i
-    return len(a)-1
-
-
-# if you want this to calculate stats for a time_interval
-# t specify from_time and to_time
-
-def reduce_thread_set(sorted_samples_tuple, from_time=0, to_time=time_infinity):
-    # FIXME: need binary search to
-    # efficiently find beginning of time interval
-    (sorted_samples, sorted_keys, sorted_times) = sorted_samples_tuple
-    if to_time < time_infinity:
-        start_index = find_le(sorted_keys, from_time)
-        end_index = find_gt(sorted_keys, to_time)
-        # replace sorted_times with just the response times in time interval
-        sorted_times = sorted(map(get_rsp_time, sorted_samples[start_index:end_index]))
-    sample_count = len(sorted_times)
+def reduce_sample_set(rsptimes):
+    sample_count = len(rsptimes)
     if sample_count < min_rsptime_samples:
         return None
-    mintime = sorted_times[0]
-    maxtime = sorted_times[-1]
-    mean = scipy.stats.tmean(sorted_times)
-    stdev = scipy.stats.tstd(sorted_times)
+    mintime = rsptimes.min()
+    maxtime = rsptimes.max()
+    mean = rsptimes.mean()
+    stdev = rsptimes.std(ddof=1)
     pctdev = 100.0*stdev/mean
-    pctiles = []
-    for p in percentiles:
-        pctiles.append(numpy.percentile(sorted_times, float(p), overwrite_input=True))
+    pctiles = numpy.percentile(rsptimes, percentiles).tolist()
     return (sample_count, mintime, maxtime, mean, pctdev, pctiles)
 
 
+# stats for each time_interval-second interval from 0 to end_time,
+# the samples are sorted by time once and the start of each interval is
+# found with a binary search
+
+def reduce_by_interval(times, rsptimes, time_interval, end_time):
+    order = numpy.argsort(times, kind='stable')
+    sorted_times = times[order]
+    rsptimes_by_time = rsptimes[order]
+    edges = numpy.arange(0, end_time + time_interval, time_interval, dtype=numpy.float64)
+    bounds = numpy.searchsorted(sorted_times, edges, side='left').tolist()
+    return [(int(edges[k]), reduce_sample_set(rsptimes_by_time[bounds[k]:bounds[k + 1]]))
+            for k in range(0, len(edges) - 1)]
+
+
 # format the stats for output to a csv file
 
 def format_stats(all_stats):
@@ -142,186 +102,176 @@ def format_stats(all_stats):
     return partial_record
 
 
-#FIXME: convert to argparse module, more compact and standard
-# define default parameter values
-
-hosts = {}
-suffix = ''
-argindex = 1
-argcount = len(argv)
-time_interval = 10
-
-# parse any optional parameters
-
-while argindex < argcount:
-  pname = argv[argindex]
-  if not pname.startswith('--'):
-    break
-  if argindex == argcount - 1:
-    usage('every parameter consists of a --name and a value')
-  pval = argv[argindex + 1]
-  argindex += 2
-  pname = pname[2:]
-  if pname == 'common-hostname-suffix':
-    suffix = pval
-    if not suffix.startswith('.'):
-      suffix = '.' + pval
-  elif pname == 'time-interval':
-    time_interval = int(pval)
-  else:
-    usage('--%s: no such optional parameter defined' % pname)
-
-if suffix != '':
-  print('filtering out suffix %s from hostnames' % suffix)
-print('time interval is %d seconds' % time_interval)
-
-# this regex plucks out a tuple of 2 values:
-#
-## thread number
-## hostname
-
-regex = \
- 'host-([0-9,a-z,\-,\.]*)%s_thrd-([0-9]{2})_rsptimes.csv'
-
-# filter out redundant suffix, if any, in hostname
-
-new_regex = regex % suffix
-
-# now parse hostnames and files
-
-if argindex != argcount - 1:
-    usage('need directory where response time files are')
-
-directory = argv[argindex]
-if not os.path.isdir(directory):
-    usage('%s: directory containing result csv files was not provided' % directory)
-
-# process the results
-# we show individual threads, per-host groupings and all threads together
-
-samples_by_thread = {}
-hosts = {}
-def pathname_matcher(path): return path.startswith('host') and path.endswith('.csv')
-
-
-pathnames = filter(pathname_matcher, os.listdir(directory))
-max_thread = -1
-for p in pathnames:
-    m = re.match(new_regex, p)
-    if not m:
-        continue
-    (host, threadstr) = m.group(1, 2)
-    thread = int(threadstr)
-    if max_thread < thread:
-      max_thread = thread
-    try:
-        perhost_dict = hosts[host]
-    except KeyError:
-        perhost_dict = {}
-        hosts[host] = perhost_dict
-    # load response times for this file into memory
-    # save what file it came from too
-    samples = parse_rsptime_file(directory, p)
-    perhost_dict[threadstr] = (p, samples)
-
-hostcount = len(hosts.keys())
-if hostcount == 0:
-    usage('%s: no .csv response time log files were found' % directory)
-
-summary_pathname = os.path.join(directory, 'stats-rsptimes.csv')
-header = 'host:thread, samples, min, max, mean, %dev, '
-for p in percentiles:
-    header += '%d%%ile, ' % p
-
-with open(summary_pathname, 'w') as outf:
-    outf.write(header + '\n')
-
-    # aggregate response times across all threads and whole test duration
-    # if there is only 1 host, no need for cluster-wide stats
-
-    cluster_sample_set = None
-    if len(hosts.keys()) > 1:
-        outf.write('cluster-wide stats:\n')
-        cluster_sample_set = []
-        for per_host_dict in hosts.values():
-            for (_, samples) in per_host_dict.values():
-                cluster_sample_set.extend(samples)
-        sorted_cluster_tuple = do_sorting(cluster_sample_set)
-        cluster_results = reduce_thread_set(sorted_cluster_tuple)
-        outf.write('all-hosts:all-thrd,' + format_stats(cluster_results) + '\n')
-        outf.write('\n')
+# thread ids sort numerically if they are numbers
+
+def thread_sort_key(threadstr):
+    if threadstr.isdigit():
+        return (0, int(threadstr), threadstr)
+    return (1, 0, threadstr)
+
+
+def concatenate(sample_sets):
+    times = numpy.concatenate([t for (t, r) in sample_sets] + [numpy.zeros(0)])
+    rsptimes = numpy.concatenate([r for (t, r) in sample_sets] + [numpy.zeros(0)])
+    return (times, rsptimes)
+
+
+def main():
+    #FIXME: convert to argparse module, more compact and standard
+    # define default parameter values
+
+    suffix = ''
+    argindex = 1
+    argcount = len(argv)
+    time_interval = 10
+    processes = os.cpu_count() or 1
+
+    # parse any optional parameters
+
+    while argindex < argcount:
+      pname = argv[argindex]
+      if not pname.startswith('--'):
+        break
+      if argindex == argcount - 1:
+        usage('every parameter consists of a --name and a value')
+      pval = argv[argindex + 1]
+      argindex += 2
+      pname = pname[2:]
+      if pname == 'common-hostname-suffix':
+        suffix = pval
+        if not suffix.startswith('.'):
+          suffix = '.' + pval
+      elif pname == 'time-interval':
+        time_interval = int(pval)
+      elif pname == 'processes':
+        processes = int(pval)
+      else:
+        usage('--%s: no such optional parameter defined' % pname)
+    if time_interval < 1:
+      usage('--time-interval must be a positive integer')
+    if processes < 1:
+      usage('--processes must be a positive integer')
+
+    if suffix != '':
+      print('filtering out suffix %s from hostnames' % suffix)
+    print('time interval is %d seconds' % time_interval)
+
+    # this regex plucks out a tuple of 2 values:
+    #
+    ## hostname
+    ## thread id (any length)
+    # filter out redundant suffix, if any, in hostname
+
+    regex = re.compile('^host-(.+?)%s_thrd-(.+)_rsptimes\\.(?:csv|bin)$' % re.escape(suffix))
+
+    # now parse hostnames and files
+
+    if argindex != argcount - 1:
+        usage('need directory where response time files are')
+
+    directory = argv[argindex]
+    if not os.path.isdir(directory):
+        usage('%s: directory containing result csv files was not provided' % directory)
+
+    # process the results
+    # we show individual threads, per-host groupings and all threads together
+
+    hosts = {}
+    pathnames = []
+    for p in sorted(os.listdir(directory)):
+        m = regex.match(p)
+        if not m:
+            continue
+        (host, threadstr) = m.group(1, 2)
+        pathnames.append((host, threadstr, os.path.join(directory, p)))
+
+    if len(pathnames) == 0:
+        usage('%s: no .csv or .bin response time log files were found' % directory)
+
+    # load response times for each file into memory,
+    # in parallel since parsing dominates for text files
+    paths = [p for (_, _, p) in pathnames]
+    if processes > 1 and len(paths) > 1:
+        with multiprocessing.Pool(min(processes, len(paths))) as pool:
+            sample_sets = pool.map(parse_rsptime_file, paths, chunksize=1)
+    else:
+        sample_sets = [parse_rsptime_file(p) for p in paths]
+    for ((host, threadstr, p), samples) in zip(pathnames, sample_sets):
+        try:
+            perhost_dict = hosts[host]
+        except KeyError:
+            perhost_dict = {}
+            hosts[host] = perhost_dict
+        perhost_dict[threadstr] = (p, samples)
+
+    summary_pathname = os.path.join(directory, 'stats-rsptimes.csv')
+    header = 'host:thread, samples, min, max, mean, %dev, '
+    for p in percentiles:
+        header += '%d%%ile, ' % p
+
+    (cluster_times, cluster_rsptimes) = concatenate(sample_sets)
+
+    with open(summary_pathname, 'w') as outf:
+        outf.write(header + '\n')
+
+        # aggregate response times across all threads and whole test duration
+        # if there is only 1 host, no need for cluster-wide stats
+
+        if len(hosts.keys()) > 1:
+            outf.write('cluster-wide stats:\n')
+            cluster_results = reduce_sample_set(cluster_rsptimes)
+            outf.write('all-hosts:all-thrd,' + format_stats(cluster_results) + '\n')
+            outf.write('\n')
+
+        # show them if there is variation amongst clients (could be network)
+        # if there is only 1 thread per host, no need for per-host stats
+        # assumption: all hosts have 1 thread/host or all hosts have > 1 thread/host
 
-    # show them if there is variation amongst clients (could be network)
-    # if there is only 1 thread per host, no need for per-host stats
-    # assumption: all hosts have 1 thread/host or all hosts have > 1 thread/host
+        first_host = hosts[list(hosts.keys())[0]]
+        if len(first_host.keys()) > 1:
+            outf.write('per-host stats:\n')
+            for h in sorted(hosts.keys()):
+                (_, host_rsptimes) = concatenate([samples for (_, samples) in hosts[h].values()])
+                host_results = reduce_sample_set(host_rsptimes)
+                outf.write(h + ':' + 'all-thrd' + ',' + format_stats(host_results) + '\n')
+            outf.write('\n')
 
-    first_host = hosts[list(hosts.keys())[0]]
-    if len(first_host.keys()) > 1:
-        outf.write('per-host stats:\n')
+        # show per-thread results so we can see if client Cephfs mountpoint is fair
+
+        outf.write('per-thread stats:\n')
         for h in sorted(hosts.keys()):
-            sample_set = []
-            for (_, samples) in hosts[h].values():
-                sample_set.extend(samples)
-            sorted_host_tuple = do_sorting(sample_set)
-            host_results = reduce_thread_set(sorted_host_tuple)
-            outf.write(h + ':' + 'all-thrd' + ',' + format_stats(host_results) + '\n')
+            threadset = hosts[h]
+            for t in sorted(threadset.keys(), key=thread_sort_key):
+                (_, (_, rsptimes)) = threadset[t]
+                thrd_results = reduce_sample_set(rsptimes)
+                outf.write(h + ':' + t + ',' + format_stats(thrd_results) + '\n')
         outf.write('\n')
 
-    # show per-thread results so we can see if client Cephfs mountpoint is fair
-
-    outf.write('per-thread stats:\n')
-    for h in sorted(hosts.keys()):
-        threadset = hosts[h]
-        for t in sorted(threadset.keys()):
-            (_, samples) = threadset[t]
-            sorted_thrd_tuple = do_sorting(samples, already_sorted=True)
-            thrd_results = reduce_thread_set(sorted_thrd_tuple)
-            outf.write(h + ':' + t + ',' + format_stats(thrd_results) + '\n')
-    outf.write('\n')
-
-    # generate cluster-wide percentiles over time
-    # to show if latency spikes occur
-    # first get max end time of any request,
-    # round that down to quantized time interval
-
-    end_time = -1
-    for h in hosts.keys():
-        threadset = hosts[h]
-        for t in threadset.keys():
-            (_, samples) = threadset[t]
-            if len(samples) > 0:
-                (_, max_at_time, max_rsp_time) = samples[-1]
-            else:
-                max_at_time = 0.0
-                max_rsp_time = 0.0
-            end_time = max(end_time, max_at_time + max_rsp_time)
-    quantized_end_time = (int(end_time) // time_interval) * time_interval
-
-    # if there is only 1 interval, cannot do percentiles vs time
-    # else for each time interval calculate percentiles of samples
-    # in that time interval
-
-    if quantized_end_time > 0:
-        outf.write('cluster-wide response time stats over time:\n')
-        outf.write('time-since-start(sec), ' + header + '\n')
-
-        # avoid re-sorting all response time samples
-        # if possible (and it often is)
-
-        if cluster_sample_set == None:
-            cluster_sample_set = []
-            for per_host_dict in hosts.values():
-                for (_, samples) in per_host_dict.values():
-                    cluster_sample_set.extend(samples)
-            sorted_cluster_tuple = do_sorting(cluster_sample_set)
-        for from_t in range(0, quantized_end_time, time_interval):
-            to_t = from_t + time_interval
-            results_in_interval = reduce_thread_set(sorted_cluster_tuple,
-                                                    from_time=from_t,
-                                                    to_time=to_t)
-            outf.write('%-8d, all-hosts:all-thrd, ' % from_t)
-            outf.write(format_stats(results_in_interval) + '\n')
-        outf.write('\n')
+        # generate cluster-wide percentiles over time
+        # to show if latency spikes occur
+        # first get max end time of any request,
+        # round that down to quantized time interval
+
+        end_time = 0.0
+        if len(cluster_times) > 0:
+            end_time = (cluster_times + cluster_rsptimes).max()
+        quantized_end_time = (int(end_time) // time_interval) * time_interval
+
+        # if there is only 1 interval, cannot do percentiles vs time
+        # else for each time interval calculate percentiles of samples
+        # in that time interval
+
+        if quantized_end_time > 0:
+            outf.write('cluster-wide response time stats over time:\n')
+            outf.write('time-since-start(sec), ' + header + '\n')
+            for (from_t, results_in_interval) in reduce_by_interval(
+                    cluster_times, cluster_rsptimes, time_interval, quantized_end_time):
+                outf.write('%-8d, all-hosts:all-thrd, ' % from_t)
+                outf.write(format_stats(results_in_interval) + '\n')
+            outf.write('\n')
+
+    print('rsp. time result summary at: %s' % summary_pathname)
 
 
-print('rsp. time result summary at: %s' % summary_pathname)
+if __name__ == '__main__':
+    main()
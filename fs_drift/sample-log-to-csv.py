@@ -0,0 +1,37 @@
+#!/usr/bin/python3
+# convert binary response time and bandwidth logs
+# (--sample-log-format binary) to the CSV format that
+# --sample-log-format csv produces, for tools that expect it.
+# each .bin file named on the command line, or each .bin file
+# in a directory named on the command line (e.g. the network shared dir),
+# is converted to a .csv file of the same name next to it.
+#
+# for example:
+#   $ sample-log-to-csv.py /mnt/cephfs/network-shared
+
+import os
+from sys import argv, exit
+
+import fs_drift.sample_log
+
+
+def usage(errmsg):
+    print('ERROR: %s' % errmsg)
+    print('usage: sample-log-to-csv.py { binary-log-file | directory } ...')
+    exit(1)
+
+
+if len(argv) < 2:
+    usage('no binary logs given')
+paths = []
+for p in argv[1:]:
+    if os.path.isdir(p):
+        paths.extend([os.path.join(p, fn) for fn in sorted(os.listdir(p)) if fn.endswith('.bin')])
+    elif os.path.isfile(p):
+        paths.append(p)
+    else:
+        usage('%s: no such file or directory' % p)
+for p in paths:
+    csv_path = p[:-len('.bin')] + '.csv' if p.endswith('.bin') else p + '.csv'
+    samples = fs_drift.sample_log.to_csv(p, csv_path)
+    print('%d samples in %s' % (samples, csv_path))
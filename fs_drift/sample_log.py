@@ -0,0 +1,532 @@
+# sample_log.py - streaming, bounded-memory response time and bandwidth logs
+#
+# with --response-times or --save-bw, every op adds one sample to a log,
+# and a multi-day run produces billions of them, so samples are never
+# accumulated for the whole run.  A SampleStream keeps them in a
+# preallocated ring of array-backed columns, and a background thread
+# writes them to the per-thread file whenever the ring is half full, and
+# at least once a second, so memory use is constant and a worker that dies
+# loses at most the last second of samples.  If the file cannot keep up,
+# the worker waits for the flusher rather than drop samples.
+#
+# for very long runs, --sample-every N keeps only every Nth sample, and
+# --sample-reservoir K instead keeps a uniform random sample of K of all
+# the ops in the run (a SampleReservoir), rewriting the file with the
+# current sample every checkpoint_interval seconds.
+#
+# with --sample-log-format csv, each sample is a text line
+# "time, value, op name" as before.  With binary, each is a fixed-width record:
+#
+#   time     float64  seconds since the thread started its workload
+#   latency  float32  seconds the op took (for bandwidth logs,
+#                     seconds spent in the data transfer itself)
+#   opcode   uint8    op type, see rq in common.py
+#   bytes    uint64   bytes transferred by the op
+#
+# records are packed (21 bytes each) with no padding and follow a
+# fixed-size header, so the whole file can be loaded with numpy.fromfile()
+# or mapped with numpy.memmap() using RECORD_DTYPE and offset=HEADER_SIZE.
+# The header holds JSON describing the log, including the op names
+# for each opcode, so readers do not need the rest of fs-drift.
+# to_csv() converts a binary log back to the CSV format.
+
+import os
+import json
+import math
+import random
+import struct
+import array
+import threading
+
+import numpy
+
+from fs_drift.common import FsDriftException, SampleLogFormat
+
+RECORD_DTYPE = numpy.dtype([
+        ('time', '<f8'),
+        ('latency', '<f4'),
+        ('opcode', 'u1'),
+        ('bytes', '<u8')])
+
+HEADER_SIZE = 4096
+HEADER_MAGIC = b'fsdsmpl1'
+HEADER_PREFIX = '=8sI'
+
+# what the latency column means in each kind of log
+
+RSPTIMES = 'rsptimes'
+BANDWIDTH = 'bw'
+
+
+# samples are handed to a file as NumPy column slices
+
+class BinarySampleFile:
+
+    def __init__(self, path, kind, start_time, opnames, info={}):
+        self.path = path
+        self.records = numpy.zeros(0, dtype=RECORD_DTYPE)
+        header = dict(info)
+        header.update({
+            'kind': kind,
+            'start-time': start_time,
+            'record-size': RECORD_DTYPE.itemsize,
+            'opnames': dict([(str(k), v) for (k, v) in opnames.items()])})
+        header = json.dumps(header).encode()
+        prefix_size = struct.calcsize(HEADER_PREFIX)
+        if prefix_size + len(header) > HEADER_SIZE:
+            raise FsDriftException('sample log header too long for %s' % path)
+        self.f = open(path, 'wb', buffering=0)
+        self.f.write(struct.pack(HEADER_PREFIX, HEADER_MAGIC, len(header)) + header +
+                     bytes(HEADER_SIZE - prefix_size - len(header)))
+
+    def write(self, times, latencies, opcodes, byte_counts):
+        n = len(times)
+        if n > len(self.records):
+            self.records = numpy.zeros(n, dtype=RECORD_DTYPE)
+        records = self.records[:n]
+        records['time'] = times
+        records['latency'] = latencies
+        records['opcode'] = opcodes
+        records['bytes'] = byte_counts
+        self.f.write(records.data)
+
+    def close(self):
+        os.fsync(self.f.fileno())  # particularly for NFS this is needed
+        self.f.close()
+
+
+class CsvSampleFile:
+
+    def __init__(self, path, kind, start_time, opnames, info={}):
+        self.path = path
+        self.kind = kind
+        self.opnames = opnames
+        self.f = open(path, 'w')
+
+    def write(self, times, latencies, opcodes, byte_counts):
+        if self.kind == BANDWIDTH:
+            values = byte_counts / latencies
+        else:
+            values = latencies
+        opnames = self.opnames
+        # time granularity is microseconds, accuracy is less
+        self.f.write(''.join(['%9.6f, %9.6f, %s\n' % (t, v, opnames[op]) for (t, v, op) in
+                              zip(times.tolist(), values.tolist(), opcodes.tolist())]))
+        self.f.flush()
+
+    def close(self):
+        os.fsync(self.f.fileno())  # particularly for NFS this is needed
+        self.f.close()
+
+
+def open_sample_file(log_format, path, kind, start_time, opnames, info={}):
+    if log_format == SampleLogFormat.binary:
+        return BinarySampleFile(path, kind, start_time, opnames, info)
+    return CsvSampleFile(path, kind, start_time, opnames, info)
+
+
+# common part of SampleStream and SampleReservoir: a background thread
+# that calls flush() when woken up, or every flush_interval seconds
+
+class SampleLog:
+
+    flush_interval = 1.0
+
+    # opnames maps each opcode to its op name
+
+    def __init__(self, path, kind, start_time, opnames, log_format):
+        self.path = path
+        self.kind = kind
+        self.start_time = start_time
+        self.opnames = opnames
+        self.log_format = log_format
+        self.seen = 0
+        self.error = None
+        self.closing = False
+        self.wakeup = threading.Event()
+        self.flusher = threading.Thread(target=self.run_flusher, name='flush %s' % path, daemon=True)
+
+    def run_flusher(self):
+        while True:
+            self.wakeup.wait(self.flush_interval)
+            self.wakeup.clear()
+            closing = self.closing
+            self.flush()
+            if closing:
+                break
+
+    def flush(self):
+        raise FsDriftException('flush() not implemented')
+
+    # stop the flusher once it has written everything,
+    # returns the number of samples in the file
+
+    def close(self):
+        self.closing = True
+        self.wakeup.set()
+        self.flusher.join()
+        samples = self.finish()
+        if self.error != None:
+            raise FsDriftException('could not write %s: %s' % (self.path, str(self.error)))
+        return samples
+
+
+class SampleStream(SampleLog):
+
+    # samples the ring holds, about 1.6 MiB of columns
+
+    default_capacity = 1 << 16
+
+    def __init__(self, path, kind, start_time, opnames, log_format=SampleLogFormat.binary,
+                 every=1, capacity=default_capacity):
+        SampleLog.__init__(self, path, kind, start_time, opnames, log_format)
+        self.every = every
+        self.countdown = every
+        self.capacity = capacity
+        self.half = capacity // 2
+        # Python arrays because storing into them for every op is fast,
+        # the flusher reads them through NumPy views
+        self.times = array.array('d', bytes(8 * capacity))
+        self.latencies = array.array('d', bytes(8 * capacity))
+        self.opcodes = array.array('B', bytes(capacity))
+        self.byte_counts = array.array('Q', bytes(8 * capacity))
+        self.columns = [numpy.frombuffer(self.times, dtype=numpy.float64),
+                        numpy.frombuffer(self.latencies, dtype=numpy.float64),
+                        numpy.frombuffer(self.opcodes, dtype=numpy.uint8),
+                        numpy.frombuffer(self.byte_counts, dtype=numpy.uint64)]
+        # samples appended and flushed so far, only the
+        # worker changes head and only the flusher changes tail
+        self.head = 0
+        self.tail = 0
+        # times that the worker had to wait for the flusher
+        self.stalls = 0
+        self.space = threading.Event()
+        self.file = open_sample_file(log_format, path, kind, start_time, opnames,
+                                     {'sample-every': every})
+        self.flusher.start()
+
+    def append(self, at_time, latency, opcode, byte_count):
+        self.seen += 1
+        if self.every > 1:
+            self.countdown -= 1
+            if self.countdown > 0:
+                return
+            self.countdown = self.every
+        head = self.head
+        if head - self.tail >= self.capacity:
+            self.wait_for_space()
+        k = head % self.capacity
+        self.times[k] = at_time
+        self.latencies[k] = latency
+        self.opcodes[k] = opcode
+        self.byte_counts[k] = byte_count
+        self.head = head + 1
+        if self.head - self.tail == self.half:
+            self.wakeup.set()
+
+    def wait_for_space(self):
+        self.stalls += 1
+        while self.head - self.tail >= self.capacity:
+            if not self.flusher.is_alive():
+                raise FsDriftException('flusher for %s has stopped' % self.path)
+            self.wakeup.set()
+            self.space.wait(0.1)
+            self.space.clear()
+
+    # write out everything appended so far, at most up to the end of the ring
+    # at a time.  After a write error, samples are discarded so the worker
+    # never blocks, and the error is reported by close()
+
+    def flush(self):
+        head = self.head
+        tail = self.tail
+        while tail < head:
+            start = tail % self.capacity
+            end = min(start + head - tail, self.capacity)
+            if self.error == None:
+                try:
+                    self.file.write(*[c[start:end] for c in self.columns])
+                except Exception as e:
+                    self.error = e
+            tail += end - start
+            self.tail = tail
+            self.space.set()
+
+    def finish(self):
+        try:
+            self.file.close()
+        except Exception as e:
+            if self.error == None:
+                self.error = e
+        return self.head
+
+
+class SampleReservoir(SampleLog):
+
+    checkpoint_interval = 10.0
+
+    def __init__(self, path, kind, start_time, opnames, log_format=SampleLogFormat.binary,
+                 size=10000, seed=None):
+        SampleLog.__init__(self, path, kind, start_time, opnames, log_format)
+        self.flush_interval = SampleReservoir.checkpoint_interval
+        self.size = size
+        self.times = array.array('d', bytes(8 * size))
+        self.latencies = array.array('d', bytes(8 * size))
+        self.opcodes = array.array('B', bytes(size))
+        self.byte_counts = array.array('Q', bytes(8 * size))
+        self.columns = [numpy.frombuffer(self.times, dtype=numpy.float64),
+                        numpy.frombuffer(self.latencies, dtype=numpy.float64),
+                        numpy.frombuffer(self.opcodes, dtype=numpy.uint8),
+                        numpy.frombuffer(self.byte_counts, dtype=numpy.uint64)]
+        # so the checkpoint does not see a sample half-replaced
+        self.lock = threading.Lock()
+        # Li's "Algorithm L": rather than draw a random number for every
+        # sample, draw how many samples to skip before the next replacement
+        self.rng = random.Random(seed)
+        self.w = math.exp(math.log(self.uniform()) / size)
+        self.next_replacement = size + self.skip()
+        self.flusher.start()
+
+    def uniform(self):
+        u = 0.0
+        while u == 0.0:
+            u = self.rng.random()
+        return u
+
+    def skip(self):
+        return int(math.log(self.uniform()) / math.log1p(-self.w)) + 1
+
+    def append(self, at_time, latency, opcode, byte_count):
+        self.seen += 1
+        seen = self.seen
+        if seen <= self.size:
+            k = seen - 1
+        elif seen == self.next_replacement:
+            k = self.rng.randrange(self.size)
+            self.w *= math.exp(math.log(self.uniform()) / self.size)
+            self.next_replacement += self.skip()
+        else:
+            return
+        with self.lock:
+            self.times[k] = at_time
+            self.latencies[k] = latency
+            self.opcodes[k] = opcode
+            self.byte_counts[k] = byte_count
+
+    # replace the file with the current sample, in time order
+
+    def flush(self):
+        with self.lock:
+            seen = self.seen
+            n = min(seen, self.size)
+            columns = [c[:n].copy() for c in self.columns]
+        order = numpy.argsort(columns[0], kind='stable')
+        tmp_path = self.path + '.tmp'
+        try:
+            f = open_sample_file(self.log_format, tmp_path, self.kind, self.start_time, self.opnames,
+                                 {'reservoir-size': self.size, 'ops-seen': seen})
+            f.write(*[c[order] for c in columns])
+            f.close()
+            os.rename(tmp_path, self.path)
+            self.error = None
+        except Exception as e:
+            self.error = e
+
+    def finish(self):
+        return min(self.seen, self.size)
+
+
+# the log that --sample-every/--sample-reservoir ask for
+
+def open_sample_log(params, path, kind, start_time, opnames):
+    if params.sample_reservoir > 0:
+        return SampleReservoir(path, kind, start_time, opnames, params.sample_log_format,
+                               size=params.sample_reservoir)
+    return SampleStream(path, kind, start_time, opnames, params.sample_log_format,
+                        every=params.sample_every)
+
+
+def read_header(path):
+    with open(path, 'rb') as f:
+        prefix = f.read(HEADER_SIZE)
+    prefix_size = struct.calcsize(HEADER_PREFIX)
+    if len(prefix) < HEADER_SIZE:
+        raise FsDriftException('%s is too short to be a sample log' % path)
+    (magic, header_len) = struct.unpack_from(HEADER_PREFIX, prefix, 0)
+    if magic != HEADER_MAGIC:
+        raise FsDriftException('%s is not an fs-drift sample log' % path)
+    header = json.loads(prefix[prefix_size:prefix_size + header_len].decode())
+    header['opnames'] = dict([(int(k), v) for (k, v) in header['opnames'].items()])
+    return header
+
+
+# returns the header and an array of RECORD_DTYPE records,
+# mapped rather than read in if use_mmap is True.
+# a partial record at the end (e.g. if the thread was killed) is ignored
+
+def read_samples(path, use_mmap=False):
+    header = read_header(path)
+    count = (os.path.getsize(path) - HEADER_SIZE) // RECORD_DTYPE.itemsize
+    if use_mmap:
+        if count == 0:
+            return (header, numpy.zeros(0, dtype=RECORD_DTYPE))
+        records = numpy.memmap(path, dtype=RECORD_DTYPE, mode='r', offset=HEADER_SIZE, shape=(count,))
+    else:
+        records = numpy.fromfile(path, dtype=RECORD_DTYPE, count=count, offset=HEADER_SIZE)
+    return (header, records)
+
+
+# write the CSV file that the text log format would have produced,
+# a bandwidth log gets bytes/sec in its second column
+
+def to_csv(path, csv_path, chunk_records=1 << 20):
+    (header, records) = read_samples(path, use_mmap=True)
+    f = CsvSampleFile(csv_path, header['kind'], header['start-time'], header['opnames'])
+    for start in range(0, len(records), chunk_records):
+        chunk = records[start:start + chunk_records]
+        f.write(chunk['time'], chunk['latency'].astype(numpy.float64), chunk['opcode'], chunk['bytes'])
+    f.close()
+    return len(records)
+
+
+if __name__ == '__main__':
+    import time
+    import tempfile
+    import multiprocessing
+
+    opnames = {0: 'read', 2: 'create', 13: 'write'}
+    tmpdir = tempfile.mkdtemp()
+    path = os.path.join(tmpdir, 'host-x_thrd-00_rsptimes.bin')
+    n = 100000
+    rng = numpy.random.default_rng(5)
+    times = numpy.cumsum(rng.exponential(0.0001, size=n))
+    latencies = rng.exponential(0.001, size=n)
+    opcodes = rng.choice([0, 2, 13], size=n)
+    byte_counts = rng.integers(0, 1 << 40, size=n)
+    samples = list(zip(times.tolist(), latencies.tolist(), opcodes.tolist(), byte_counts.tolist()))
+
+    # a ring much smaller than the run wraps around many times
+    # without losing or reordering samples
+    assert(RECORD_DTYPE.itemsize == 21)
+    w = SampleStream(path, RSPTIMES, 1234.5, opnames, capacity=1024)
+    start = time.perf_counter()
+    for s in samples:
+        w.append(*s)
+    elapsed = time.perf_counter() - start
+    assert(w.close() == n)
+    print('%5.0f nsec per sample logged, worker waited for flusher %d times' % (elapsed * 1.0e9 / n, w.stalls))
+    assert(os.path.getsize(path) == HEADER_SIZE + n * RECORD_DTYPE.itemsize)
+
+    for use_mmap in [False, True]:
+        (header, records) = read_samples(path, use_mmap=use_mmap)
+        assert(header['kind'] == RSPTIMES and header['start-time'] == 1234.5)
+        assert(header['opnames'] == opnames and header['sample-every'] == 1)
+        assert((records['time'] == times).all())
+        assert((records['latency'] == latencies.astype(numpy.float32)).all())
+        assert((records['opcode'] == opcodes).all())
+        assert((records['bytes'] == byte_counts).all())
+        del records
+    # plain numpy.fromfile works too
+    records = numpy.fromfile(path, dtype=RECORD_DTYPE, offset=HEADER_SIZE)
+    assert(len(records) == n)
+
+    # CSV conversion gives the text format
+    csv_path = path[:-len('.bin')] + '.csv'
+    start = time.perf_counter()
+    assert(to_csv(path, csv_path) == n)
+    print('%5.0f nsec per sample converted to CSV' % ((time.perf_counter() - start) * 1.0e9 / n))
+    with open(csv_path, 'r') as f:
+        lines = f.readlines()
+    assert(len(lines) == n)
+    assert(lines[1] == '%9.6f, %9.6f, %s\n' % (times[1], numpy.float32(latencies[1]), opnames[opcodes[1]]))
+
+    # streaming straight to CSV keeps full latency precision,
+    # and bandwidth logs get bytes/sec
+    w = SampleStream(csv_path, RSPTIMES, 0.0, opnames, log_format=SampleLogFormat.csv, capacity=1000)
+    for s in samples[:5000]:
+        w.append(*s)
+    w.close()
+    with open(csv_path, 'r') as f:
+        assert(f.readline() == '%9.6f, %9.6f, %s\n' % (times[0], latencies[0], opnames[opcodes[0]]))
+    bw_path = os.path.join(tmpdir, 'host-x_thrd-00_bw.bin')
+    w = SampleStream(bw_path, BANDWIDTH, 0.0, opnames)
+    w.append(0.5, 0.25, 0, 1 << 20)
+    w.close()
+    to_csv(bw_path, bw_path + '.csv')
+    with open(bw_path + '.csv', 'r') as f:
+        assert(f.read() == '%9.6f, %9.6f, read\n' % (0.5, 4.0 * (1 << 20)))
+
+    # 1-in-N keeps every Nth sample
+    w = SampleStream(path, RSPTIMES, 0.0, opnames, every=10)
+    for s in samples:
+        w.append(*s)
+    assert(w.close() == n // 10 and w.seen == n)
+    (header, records) = read_samples(path)
+    assert((records['time'] == times[9::10]).all() and header['sample-every'] == 10)
+
+    # samples are in the file within a second or so, before close(),
+    # so a worker that dies leaves them behind
+    def die_after_logging(path):
+        w = SampleStream(path, RSPTIMES, 0.0, opnames)
+        for s in samples[:1000]:
+            w.append(*s)
+        time.sleep(SampleLog.flush_interval * 2)
+        os._exit(1)
+
+    p = multiprocessing.Process(target=die_after_logging, args=(path,))
+    p.start()
+    p.join()
+    assert(len(read_samples(path)[1]) == 1000)
+
+    # a reservoir keeps a uniform random sample of the whole run, in time order,
+    # and memory stays the same however long the run
+    res_path = os.path.join(tmpdir, 'reservoir.bin')
+    kept = 2000
+    w = SampleReservoir(res_path, RSPTIMES, 0.0, opnames, size=kept, seed=9)
+    start = time.perf_counter()
+    for s in samples:
+        w.append(*s)
+    elapsed = time.perf_counter() - start
+    assert(w.close() == kept)
+    print('%5.0f nsec per sample offered to reservoir' % (elapsed * 1.0e9 / n))
+    (header, records) = read_samples(res_path)
+    assert(len(records) == kept and header['ops-seen'] == n and header['reservoir-size'] == kept)
+    assert((numpy.diff(records['time']) >= 0.0).all())
+    assert(numpy.isin(records['time'], times).all())
+    # about as many samples from each tenth of the run
+    tenths = numpy.histogram(records['time'], bins=10, range=(0.0, times[-1]))[0]
+    assert((abs(tenths - kept / 10) < 0.25 * kept / 10).all())
+    assert(abs(numpy.median(records['latency']) - numpy.median(latencies)) < 0.1 * numpy.median(latencies))
+    # fewer samples than the reservoir holds are all kept
+    w = SampleReservoir(res_path, RSPTIMES, 0.0, opnames, log_format=SampleLogFormat.csv, size=kept)
+    for s in samples[:100]:
+        w.append(*s)
+    assert(w.close() == 100)
+    with open(res_path, 'r') as f:
+        assert(len(f.readlines()) == 100)
+
+    # write errors are reported when the log is closed
+    w = SampleStream(os.path.join(tmpdir, 'full.bin'), RSPTIMES, 0.0, opnames, capacity=16)
+    w.file.f.close()
+    for s in samples[:100]:
+        w.append(*s)
+    try:
+        w.close()
+        assert(False)
+    except FsDriftException:
+        pass
+
+    # a partial record at the end is ignored, an empty log has no records
+    SampleStream(path, RSPTIMES, 0.0, opnames).close()
+    with open(path, 'ab') as f:
+        f.write(b'\0' * 5)
+    assert(len(read_samples(path, use_mmap=True)[1]) == 0)
+    try:
+        read_samples(csv_path)
+        assert(False)
+    except FsDriftException:
+        pass
+    for fn in os.listdir(tmpdir):
+        os.unlink(os.path.join(tmpdir, fn))
+    os.rmdir(tmpdir)
+    print('sample_log unit test passed')
@@ -0,0 +1,143 @@
+# simtime.py - where each thread's moving gaussian distribution has got to
+#
+# with --random-distribution gaussian, the center of each thread's
+# distribution moves with simulated time, and a later run on the same host
+# picks up where the last one left off.  This state used to be rewritten
+# as a small text file in the network shared dir every few ops, which put
+# thousands of small synchronous writes a second on the filesystem under
+# test.  Now each thread keeps it in a record in a small local file that
+# it maps with mmap: every update is a store into the page cache, which
+# survives the process being killed, and msync() writes it out every
+# flush_secs seconds and when the thread finishes, so it also survives a
+# host crash with at most flush_secs of simulated time lost.
+#
+# the record has a CRC, so a record that is torn or from some other
+# version is ignored and the thread starts from scratch.
+# State files are in --local-scratch-dir if set, or else $TMPDIR or
+# /var/tmp, one per top directory, host and thread.
+
+import os
+import mmap
+import time
+import zlib
+import struct
+
+RECORD_FORMAT = '=8sqdd'
+RECORD_MAGIC = b'fsdsimt1'
+RECORD_SIZE = struct.calcsize(RECORD_FORMAT)
+CRC_FORMAT = '=I'
+FILE_SIZE = 64
+
+# most simulated time lost if the host crashes
+
+flush_secs = 10.0
+
+
+def state_dir(params):
+    if params.local_scratch_dir != None:
+        return params.local_scratch_dir
+    return os.getenv('TMPDIR') or '/var/tmp'
+
+
+def state_path(params, onhost, tid):
+    top_crc = zlib.crc32(os.path.abspath(params.top_directory).encode('utf-8'))
+    return os.path.join(state_dir(params), 'fs-drift-simtime-%08x-hst-%s-thrd-%s.state' % (top_crc, onhost, tid))
+
+
+class SimTimeState:
+
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            if os.fstat(fd).st_size < FILE_SIZE:
+                os.ftruncate(fd, FILE_SIZE)
+            self.mapping = mmap.mmap(fd, FILE_SIZE, flags=mmap.MAP_SHARED, prot=mmap.PROT_READ | mmap.PROT_WRITE)
+        finally:
+            os.close(fd)
+        self.last_flush = time.monotonic()
+
+    # returns (simulated time, center, velocity) of the last run,
+    # or None if there is none
+
+    def load(self):
+        (crc,) = struct.unpack_from(CRC_FORMAT, self.mapping, RECORD_SIZE)
+        if crc != zlib.crc32(self.mapping[0:RECORD_SIZE]):
+            return None
+        (magic, simulated_time, center, velocity) = struct.unpack_from(RECORD_FORMAT, self.mapping, 0)
+        if magic != RECORD_MAGIC:
+            return None
+        return (simulated_time, center, velocity)
+
+    def store(self, simulated_time, center, velocity):
+        m = self.mapping
+        struct.pack_into(RECORD_FORMAT, m, 0, RECORD_MAGIC, simulated_time, center, velocity)
+        struct.pack_into(CRC_FORMAT, m, RECORD_SIZE, zlib.crc32(m[0:RECORD_SIZE]))
+        now = time.monotonic()
+        if now - self.last_flush >= flush_secs:
+            m.flush()
+            self.last_flush = now
+
+    def close(self):
+        if self.mapping != None:
+            self.mapping.flush()
+            self.mapping.close()
+            self.mapping = None
+
+
+if __name__ == '__main__':
+    import tempfile
+    import multiprocessing
+
+    class FakeParams:
+        pass
+
+    with tempfile.TemporaryDirectory() as d:
+        params = FakeParams()
+        params.local_scratch_dir = os.path.join(d, 'scratch')
+        params.top_directory = '/mnt/fs/top'
+        path = state_path(params, 'host1', '03')
+        assert(path.startswith(params.local_scratch_dir + '/') and path.endswith('-hst-host1-thrd-03.state'))
+        params.top_directory = '/mnt/fs/other'
+        assert(state_path(params, 'host1', '03') != path)
+        params.local_scratch_dir = None
+        assert(os.path.dirname(state_path(params, 'host1', '03')) in [os.getenv('TMPDIR'), '/var/tmp'])
+
+        # a new state file has no state
+        s = SimTimeState(path)
+        assert(s.load() == None)
+        s.store(12345, 678.25, 1.5)
+        assert(s.load() == (12345, 678.25, 1.5))
+        s.close()
+        s = SimTimeState(path)
+        assert(s.load() == (12345, 678.25, 1.5))
+        s.close()
+
+        # a process that is killed without closing the state file
+        # still leaves its latest state behind
+        def killed(path):
+            s = SimTimeState(path)
+            for t in range(0, 1000):
+                s.store(t, t * 0.5, 2.0)
+            os._exit(1)
+        p = multiprocessing.Process(target=killed, args=(path,))
+        p.start()
+        p.join()
+        s = SimTimeState(path)
+        assert(s.load() == (999, 499.5, 2.0))
+
+        # a torn record is ignored
+        s.mapping[10] ^= 0xff
+        assert(s.load() == None)
+        s.close()
+
+        # store cost
+        s = SimTimeState(path)
+        n = 200000
+        start = time.perf_counter()
+        for t in range(0, n):
+            s.store(t, 1.0, 2.0)
+        print('%5.0f nsec per store' % ((time.perf_counter() - start) * 1.0e9 / n))
+        s.close()
+    print('simtime unit test passed')
@@ -0,0 +1,356 @@
+# telemetry.py - live counters shared by the worker processes on a host
+#
+# worker processes only report their counters to the host master when
+# they finish, so nothing shows a throughput collapse while the test is
+# running.  run_multi_thread_workload() creates a shared memory segment
+# with one row of 64-bit integers per worker, and each worker keeps its
+# row up to date as ops complete: ops done, bytes transferred, errors seen,
+# and a coarse response time histogram, with values below 16 usec counted
+# exactly and each power of 2 above that split into 8 buckets, so each op
+# costs only a few integer operations and stores.  The host master samples all
+# the rows every --live-interval seconds and prints what changed since the
+# last sample: ops/sec, MiB/sec, errors/sec and response time percentiles.
+#
+# For --metrics-port (see metrics_exporter.py), each row also has the
+# worker's CPU time and FSOPCounters fields, which the worker copies there
+# about once a second, and a live histogram for each op type.
+#
+# the segment starts with a page-sized header holding its dimensions,
+# so a worker only needs the segment name and its row number.
+# Rows are only written by one worker each, and a sample that sees a row
+# part-way through an op update is off by at most one op.
+
+import os
+import mmap
+import time
+import struct
+from multiprocessing import shared_memory
+
+import numpy
+
+from fs_drift.latency_histogram import LatencyHistogram
+from fs_drift.common import FsDriftException, BYTES_PER_MiB
+
+HEADER_FORMAT = '=8sQQQQ'
+HEADER_MAGIC = b'fsdlive2'
+
+# POSIX shared memory segments appear here on Linux
+
+SHM_DIR = '/dev/shm'
+
+# positions in each worker's row
+
+LIVE_OPS = 0
+LIVE_BYTES = 1
+LIVE_ERRORS = 2
+LIVE_BUCKETS = 3
+
+# positions after the summary part of each row,
+# followed by FSOPCounters fields and then per-op histograms
+
+LIVE_CPU_USER_USEC = 0
+LIVE_CPU_SYS_USEC = 1
+LIVE_CPU_SLOTS = 2
+
+# how often workers copy FSOPCounters fields and CPU time to their row
+
+counter_publish_secs = 1.0
+
+# percentiles shown in live output
+
+live_percentiles = [50.0, 99.0, 99.9]
+
+
+# live histogram buckets are laid out like a latency_histogram with
+# LIVE_SUB_BITS bits: values below 2^LIVE_SUB_BITS usec each have a
+# bucket, and each power of 2 above that has LIVE_SUB_BUCKETS buckets,
+# whatever --latency-digits is
+
+LIVE_SUB_BITS = 4
+LIVE_SUB_BUCKETS = 1 << (LIVE_SUB_BITS - 1)
+live_bucket_count = (LatencyHistogram.max_usec.bit_length() - LIVE_SUB_BITS + 2) * LIVE_SUB_BUCKETS
+
+
+# the live bucket for a response time in usec
+
+def live_bucket(usec):
+    if usec > LatencyHistogram.max_usec:
+        usec = LatencyHistogram.max_usec
+    elif usec < 0:
+        usec = 0
+    e = usec.bit_length() - LIVE_SUB_BITS
+    if e < 0:
+        e = 0
+    return e * LIVE_SUB_BUCKETS + (usec >> e)
+
+
+# smallest value counted in live bucket j, and the bucket width
+
+def live_bucket_bounds(j):
+    e = max(j // LIVE_SUB_BUCKETS - 1, 0)
+    return ((j - e * LIVE_SUB_BUCKETS) << e, 1 << e)
+
+
+# length of the ops, bytes, errors and histogram part of a row,
+# which is what LiveMonitor and live_stream.py work with
+
+live_summary_len = LIVE_BUCKETS + live_bucket_count
+
+
+# response time (usec) percentiles of a live histogram,
+# the middle of the bucket each falls in
+
+def live_percentiles_usec(buckets, pcts):
+    total = int(buckets.sum())
+    if total == 0:
+        return [0 for p in pcts]
+    cumulative = numpy.cumsum(buckets)
+    ranks = [max(int(numpy.ceil(p * total / 100.0)), 1) for p in pcts]
+    result = []
+    for j in numpy.searchsorted(cumulative, ranks).tolist():
+        (low, width) = live_bucket_bounds(j)
+        result.append(low + (width - 1) // 2)
+    return result
+
+
+# rates and response times for one row of counter deltas,
+# which may be one worker, one host or the sum of several hosts
+
+def live_summary(elapsed, secs, delta):
+    secs = max(secs, 1.0e-6)
+    s = {'elapsed': elapsed,
+         'ops-per-sec': float(delta[LIVE_OPS]) / secs,
+         'MiB-per-sec': float(delta[LIVE_BYTES]) / secs / BYTES_PER_MiB,
+         'errors-per-sec': float(delta[LIVE_ERRORS]) / secs}
+    for (p, v) in zip(live_percentiles, live_percentiles_usec(delta[LIVE_BUCKETS:], live_percentiles)):
+        s['p%g-usec' % p] = v
+    return s
+
+
+class LiveCounters:
+
+    def __init__(self, mapping, name, shm=None):
+        self.name = name
+        self.shm = shm
+        self.mapping = mapping
+        (magic, self.rows, self.row_len, self.counter_count, self.op_count) = \
+            struct.unpack_from(HEADER_FORMAT, mapping, 0)
+        if magic != HEADER_MAGIC:
+            raise FsDriftException('%s is not an fs-drift live counter segment' % name)
+        self.bucket_count = live_bucket_count
+        self.summary_len = live_summary_len
+        self.cpu_at = self.summary_len
+        self.counters_at = self.cpu_at + LIVE_CPU_SLOTS
+        self.op_buckets_at = self.counters_at + self.counter_count
+        self.values = memoryview(mapping)[mmap.PAGESIZE:mmap.PAGESIZE + 8 * self.rows * self.row_len].cast('q')
+
+    # counters is the number of FSOPCounters fields, ops the number of op types,
+    # 0 if only the summary is wanted
+
+    @staticmethod
+    def create(rows, counters=0, ops=0):
+        row_len = live_summary_len
+        if counters > 0 or ops > 0:
+            row_len += LIVE_CPU_SLOTS + counters + ops * live_bucket_count
+        shm = shared_memory.SharedMemory(create=True, size=mmap.PAGESIZE + 8 * rows * row_len)
+        struct.pack_into(HEADER_FORMAT, shm.buf, 0, HEADER_MAGIC, rows, row_len, counters, ops)
+        return LiveCounters(shm.buf, shm.name, shm=shm)
+
+    # map an existing segment for a worker to update,
+    # raises OSError if it is not there
+
+    @staticmethod
+    def attach(name):
+        fd = os.open(os.path.join(SHM_DIR, name), os.O_RDWR)
+        try:
+            mapping = mmap.mmap(fd, 0, flags=mmap.MAP_SHARED, prot=mmap.PROT_READ | mmap.PROT_WRITE)
+        finally:
+            os.close(fd)
+        return LiveCounters(mapping, name)
+
+    # the row that worker number k updates, a memoryview of 64-bit integers
+
+    def row(self, k):
+        if k < 0 or k >= self.rows:
+            raise FsDriftException('no live counter row %d in %s' % (k, self.name))
+        return self.values[k * self.row_len:(k + 1) * self.row_len]
+
+    # position of the histogram for op type "opcode" in a row
+
+    def op_buckets(self, opcode):
+        return self.op_buckets_at + opcode * self.bucket_count
+
+    # copy of columns start to end of every row
+
+    def snapshot(self, start=0, end=None):
+        if end == None:
+            end = self.row_len
+        return numpy.frombuffer(self.values, dtype=numpy.int64).reshape(self.rows, self.row_len)[:, start:end].copy()
+
+    # remove the segment name, processes that have it mapped keep their mapping,
+    # only the process that created the segment does this
+
+    def unlink(self):
+        if self.shm != None:
+            self.shm.unlink()
+
+    def close(self):
+        self.values.release()
+        if self.shm != None:
+            self.shm.close()
+            self.shm = None
+        else:
+            self.mapping.close()
+        self.mapping = None
+
+
+# what all workers on the host did between successive samples
+
+class LiveMonitor:
+
+    def __init__(self, counters):
+        self.counters = counters
+        self.start_time = time.time()
+        self.last_time = self.start_time
+        self.last = counters.snapshot(0, counters.summary_len)
+
+    # returns (seconds since monitor started, seconds since last delta,
+    # counter deltas of all workers added together)
+
+    def delta(self):
+        now = time.time()
+        current = self.counters.snapshot(0, self.counters.summary_len)
+        delta = (current - self.last).sum(axis=0)
+        secs = now - self.last_time
+        self.last = current
+        self.last_time = now
+        return (now - self.start_time, secs, delta)
+
+    def sample(self):
+        (elapsed, secs, delta) = self.delta()
+        return live_summary(elapsed, secs, delta)
+
+    @staticmethod
+    def format_sample(s):
+        return ('%7.1f sec: %10.1f ops/sec %9.3f MiB/sec %7.1f errors/sec   usec p50 %d p99 %d p99.9 %d' %
+                (s['elapsed'], s['ops-per-sec'], s['MiB-per-sec'], s['errors-per-sec'],
+                 s['p50-usec'], s['p99-usec'], s['p99.9-usec']))
+
+
+if __name__ == '__main__':
+    import multiprocessing
+
+    import random
+
+    # live buckets are contiguous and cover every value
+    assert([live_bucket(u) for u in range(0, 64)] ==
+           list(range(0, 16)) + [16 + k // 2 for k in range(0, 16)] + [24 + k // 4 for k in range(0, 32)])
+    assert(live_bucket(LatencyHistogram.max_usec + 1) == live_bucket_count - 1)
+    for j in range(1, live_bucket_count):
+        (low, width) = live_bucket_bounds(j)
+        assert(live_bucket(low) == j and live_bucket(low - 1) == j - 1 and live_bucket(low + width - 1) == j)
+        assert(width == 1 or width <= low / LIVE_SUB_BUCKETS)
+
+    # live percentiles are within a live bucket of those of a latency histogram,
+    # whatever its precision
+    rng = random.Random(7)
+    values = [int(rng.lognormvariate(6.0, 1.5)) for k in range(0, 20000)]
+    pcts = [10.0, 50.0, 90.0, 99.0, 99.9]
+    for d in [3, 4, 5]:
+        h = LatencyHistogram(d)
+        buckets = numpy.zeros(live_bucket_count, dtype=numpy.int64)
+        for u in values:
+            h.record(u / 1.0e6)
+            buckets[live_bucket(u)] += 1
+        for (p, live_usec, exact_usec) in zip(pcts, live_percentiles_usec(buckets, pcts), h.percentiles(pcts)):
+            assert(abs(live_usec - exact_usec) <= exact_usec / LIVE_SUB_BUCKETS + 1), (d, p, live_usec, exact_usec)
+    # a tight cluster of fast ops
+    buckets = numpy.zeros(live_bucket_count, dtype=numpy.int64)
+    for u in [90] * 50 + [300] * 49 + [900]:
+        buckets[live_bucket(u)] += 1
+    assert(all([abs(v - u) <= u / 16 for (v, u) in zip(live_percentiles_usec(buckets, [50.0, 99.0, 100.0]), [90, 300, 900])]))
+
+    counters = LiveCounters.create(3)
+
+    # each worker process updates its own row the way a worker thread does
+    def worker(name, k, ops, usec):
+        c = LiveCounters.attach(name)
+        live = c.row(k)
+        for n in range(0, ops):
+            live[LIVE_OPS] += 1
+            live[LIVE_BUCKETS + live_bucket(usec)] += 1
+            live[LIVE_BYTES] += 4096
+        live[LIVE_ERRORS] = k
+
+    try:
+        assert(counters.row_len < 512)
+        monitor = LiveMonitor(counters)
+        workers = [multiprocessing.Process(target=worker, args=(counters.name, k, 1000 * (k + 1), 100 * 10 ** k))
+                   for k in range(0, 3)]
+        for w in workers:
+            w.start()
+        for w in workers:
+            w.join()
+        time.sleep(0.1)
+        s = monitor.sample()
+        print(LiveMonitor.format_sample(s))
+        secs = monitor.last_time - monitor.start_time
+        assert(abs(s['ops-per-sec'] * secs - 6000) < 0.01)
+        assert(abs(s['MiB-per-sec'] * secs - 6000 * 4096 / BYTES_PER_MiB) < 0.01)
+        assert(abs(s['errors-per-sec'] * secs - 3) < 0.01)
+        # 1000 ops at 100 usec, 2000 at 1000 usec, 3000 at 10000 usec,
+        # within the 1/8 octave precision of live buckets
+        assert(abs(s['p50-usec'] - 1000) < 1000 / 8)
+        assert(abs(s['p99-usec'] - 10000) < 10000 / 8)
+        assert(abs(live_percentiles_usec(monitor.last.sum(axis=0)[LIVE_BUCKETS:], [10.0])[0] - 100) < 100 / 8)
+        assert(counters.row_len == live_summary_len)
+        # nothing happened since the last sample
+        s = monitor.sample()
+        assert(s['ops-per-sec'] == 0 and s['p99-usec'] == 0)
+        try:
+            counters.row(3)
+            assert(False)
+        except FsDriftException:
+            pass
+    finally:
+        counters.unlink()
+        counters.close()
+    try:
+        LiveCounters.attach(counters.name)
+        assert(False)
+    except OSError:
+        pass
+
+    # rows with CPU time, FSOPCounters fields and per-op histograms
+    c = LiveCounters.create(2, counters=5, ops=3)
+    try:
+        w = LiveCounters.attach(c.name)
+        assert((w.counters_at, w.op_buckets_at) == (w.summary_len + LIVE_CPU_SLOTS, w.summary_len + LIVE_CPU_SLOTS + 5))
+        assert(w.row_len == w.op_buckets(3))
+        live = w.row(1)
+        live[LIVE_OPS] += 1
+        live[w.counters_at + 4] = 7
+        live[w.op_buckets(2) + w.bucket_count - 1] += 1
+        live.release()
+        w.close()
+        rows = c.snapshot()
+        assert(rows[1, LIVE_OPS] == 1 and rows[1, c.counters_at + 4] == 7 and rows[1, -1] == 1)
+        assert(rows.sum() == 9 and rows[0].sum() == 0)
+        assert(LiveMonitor(c).last.shape == (2, c.summary_len))
+    finally:
+        c.unlink()
+        c.close()
+
+    # update cost
+    c = LiveCounters.create(1)
+    live = c.row(0)
+    n = 500000
+    start = time.perf_counter()
+    for k in range(0, n):
+        live[LIVE_OPS] += 1
+        live[LIVE_BUCKETS + live_bucket(k & 16383)] += 1
+    print('%5.0f nsec per live update' % ((time.perf_counter() - start) * 1.0e9 / n))
+    live.release()
+    c.unlink()
+    c.close()
+    print('telemetry unit test passed')
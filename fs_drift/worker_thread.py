@@ -34,14 +34,24 @@ import threading
 import socket
 import errno
 import codecs
+import json
+import resource
 
 # fs-drift modules
 import fs_drift.common
 from fs_drift.common import touch, FsDriftException, FileSizeDistr, FileAccessDistr
-from fs_drift.common import ensure_dir_exists, deltree, OK
+from fs_drift.common import ensure_dir_exists, deltree, rq, OK
 import fs_drift.event
 from fs_drift.fsop import FSOPCtx
+from fs_drift.content_pool import ContentPool
+from fs_drift.open_loop import ArrivalSchedule, per_thread_rate
+from fs_drift.pacer import Pacer
+from fs_drift.latency_histogram import OpLatencies, LatencyTimeline, USEC_PER_SEC
+from fs_drift.sample_log import open_sample_log, RSPTIMES, BANDWIDTH
+from fs_drift.telemetry import LiveCounters, live_bucket, LIVE_OPS, LIVE_BYTES, LIVE_ERRORS, LIVE_BUCKETS
+from fs_drift.telemetry import LIVE_CPU_USER_USEC, LIVE_CPU_SYS_USEC, counter_publish_secs
 from fs_drift.fsop_counters import FSOPCounters
+from fs_drift.queue_depth import QueueDepthEngine
 import fs_drift.fsd_log
 from fs_drift.sync_files import write_pickle, read_pickle
 import fs_drift.output_results
@@ -63,6 +73,11 @@ class FsDriftWorkload:
     # number of files between threads-finished check at smallest file size
     max_files_between_checks = 100
 
+    # seconds between updates of the thread progress file,
+    # well within the host master's starting gate timeout
+
+    progress_interval = 1.0
+
     # multiply mean size by this to get max file size
 
     random_size_limit = 8
@@ -83,8 +98,26 @@ class FsDriftWorkload:
 
         self.params = params
         self.ctx = None
+        self.engine = None
         self.ctrs = FSOPCounters()
 
+        # name of the per-host shared content pool, if the caller made one,
+        # see content_pool.py
+        self.content_pool_name = None
+        self.content_pool = None
+
+        # name of the per-host live counter segment and our row in it,
+        # if the caller made one, see telemetry.py
+        self.telemetry_name = None
+        self.telemetry_row = 0
+        self.telemetry = None
+        self.live = None
+        self.live_op_buckets = None
+
+        # local directory for files that are updated during the test,
+        # if the caller made one (--local-scratch-dir)
+        self.scratch_dir = None
+
         # total_threads is thread count across entire distributed test
         # FIXME: take into account thread count and multiple hosts running threads
         self.total_threads = 0
@@ -129,7 +162,8 @@ class FsDriftWorkload:
         self.verbosity = self.params.verbosity
         self.verbosity_last_checked = 0
         self.verbosity_poll_rate = 1
-        self.pause_sec = self.params.pause_between_ops / MICROSEC_PER_SEC
+        # paces --pause-between-ops, set up once params are final
+        self.pacer = None
 
         # to measure per-thread elapsed time
         self.end_time = -1.0
@@ -137,8 +171,16 @@ class FsDriftWorkload:
         self.elapsed_time = -1.0
         # to measure file operation response times
         self.op_start_time = None
-        self.rsptimes = []
-        self.bw = []
+        # with --response-times and --save-bw, samples are streamed
+        # to per-thread files as the test runs, see sample_log.py
+        self.rsptime_log = None
+        self.bw_log = None
+        # response time histograms per op type for the whole run,
+        # and for the current --report-interval, see latency_histogram.py
+        self.latencies = OpLatencies(self.params.latency_digits)
+        self.interval_latencies = OpLatencies(self.params.latency_digits)
+        # and for each interval, returned with the counters
+        self.latency_timeline = LatencyTimeline(self.params.latency_digits, self.params.stats_report_interval)
 
     # create per-thread log file
     # we have to avoid getting the logger for self.tid more than once,
@@ -181,6 +223,8 @@ class FsDriftWorkload:
                 self.verbosity = v
                 if self.ctx is not None:
                     self.ctx.verbosity = v
+                if self.engine is not None:
+                    self.engine.set_verbosity(v)
         except ValueError:
             self.log.error('could not parse verbosity %s in file %s' % (vstr, vpath))
         except IOError as e:
@@ -189,38 +233,94 @@ class FsDriftWorkload:
                 raise e
 
     # indicate end of an operation,
-    # this appends the elapsed time of the operation to .rsptimes array
+    # this records the elapsed time of the operation
 
     def op_endtime(self, opname):
-        if self.params.response_times:
-            end_time = time.time()
-            rsp_time = end_time - self.op_start_time
-            self.rsptimes.append((self.op_start_time, rsp_time, opname))
-
-        if self.params.bw:
-            self.bw.append((self.op_start_time, self.ctx.measured_bw, opname))
-            self.ctx.measured_bw = None
+        self.record_op(opname, self.op_start_time, time.time(), self.ctx.measured_io)
+        self.ctx.measured_io = None
         self.op_start_time = None
 
-    # save response times seen by this thread
-    def save_rsptimes(self):
-        fname = self.params.rsptime_path % (self.onhost, self.tid)
-        with open(fname, 'w') as f:
-            for (start_time, rsp_time, opname) in self.rsptimes:
-                # time granularity is microseconds, accuracy is less
-                f.write('%9.6f, %9.6f, %s\n' % (start_time - self.start_time, rsp_time, opname))
-            os.fsync(f.fileno())  # particularly for NFS this is needed
-        self.log.info('response times saved in %s' % fname)
-
-    def save_bw(self):
-        fname = self.params.bw_path % (self.onhost, self.tid)
-        with open(fname, 'w') as f:
-            for (start_time, bw, opname) in self.bw:
-                if not bw:
-                    continue
-                f.write('%9.6f, %9.6f, %s\n' % (start_time - self.start_time, bw, opname))
-            os.fsync(f.fileno())  # particularly for NFS this is needed
-        self.log.info('bandwidth saved in %s' % fname)
+    # measured_io is None or (bytes transferred, seconds spent transferring them)
+
+    def record_op(self, opname, start_time, end_time, measured_io):
+        rsp_time = end_time - start_time
+        self.interval_latencies.record(opname, rsp_time)
+        live = self.live
+        if live != None:
+            bucket = live_bucket(int(rsp_time * USEC_PER_SEC))
+            live[LIVE_OPS] += 1
+            live[LIVE_BUCKETS + bucket] += 1
+            if self.live_op_buckets != None:
+                live[self.live_op_buckets[FSOPCtx.opname_to_opcode[opname]] + bucket] += 1
+            if measured_io:
+                live[LIVE_BYTES] += measured_io[0]
+        if self.rsptime_log != None:
+            self.rsptime_log.append(start_time - self.start_time, rsp_time, FSOPCtx.opname_to_opcode[opname],
+                                    measured_io[0] if measured_io else 0)
+        if self.bw_log != None and measured_io:
+            self.bw_log.append(start_time - self.start_time, measured_io[1],
+                               FSOPCtx.opname_to_opcode[opname], measured_io[0])
+
+    # account for ops that the --iodepth engine has finished,
+    # returns number of ops that failed
+
+    def complete_ops(self, completions):
+        errors = 0
+        for c in completions:
+            c.ctrs.add_to(self.ctrs)
+            self.record_op(c.opname, c.start_time, c.end_time, c.measured_io)
+            if c.rc != OK:
+                self.log.debug("%s returns %d" % (c.opname, c.rc))
+                errors += 1
+        return errors
+
+    # copy counters and CPU time to our live counter row for --metrics-port,
+    # fields are in FSOPCounters.kvtuplelist() order
+
+    def publish_live_counters(self):
+        live = self.live
+        if live == None or self.telemetry.counter_count == 0:
+            return
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+        live[self.telemetry.cpu_at + LIVE_CPU_USER_USEC] = int(usage.ru_utime * MICROSEC_PER_SEC)
+        live[self.telemetry.cpu_at + LIVE_CPU_SYS_USEC] = int(usage.ru_stime * MICROSEC_PER_SEC)
+        at = self.telemetry.counters_at
+        for (k, (_, v)) in enumerate(self.ctrs.kvtuplelist()[:self.telemetry.counter_count]):
+            live[at + k] = v
+
+    # start streaming samples to the response time and bandwidth logs,
+    # once the thread start time is known
+
+    def open_sample_logs(self):
+        if self.params.response_times:
+            self.rsptime_log = open_sample_log(self.params,
+                                               self.bookkeeping_path(self.params.rsptime_path % (self.onhost, self.tid)),
+                                               RSPTIMES, self.start_time, FSOPCtx.opcode_to_opname)
+        if self.params.bw:
+            self.bw_log = open_sample_log(self.params,
+                                          self.bookkeeping_path(self.params.bw_path % (self.onhost, self.tid)),
+                                          BANDWIDTH, self.start_time, FSOPCtx.opcode_to_opname)
+
+    # where to write a file that belongs in the network shared dir
+    # but is updated all through the test, with --local-scratch-dir the
+    # host master moves it to the network shared dir when threads finish
+
+    def bookkeeping_path(self, shared_path):
+        if self.scratch_dir == None:
+            return shared_path
+        return join(self.scratch_dir, os.path.basename(shared_path))
+
+    # save the rest of the response times and bandwidths seen by this thread
+
+    def close_sample_logs(self):
+        if self.rsptime_log != None:
+            samples = self.rsptime_log.close()
+            self.log.info('%d response times saved in %s' % (samples, self.rsptime_log.path))
+            self.rsptime_log = None
+        if self.bw_log != None:
+            samples = self.bw_log.close()
+            self.log.info('%d bandwidth samples saved in %s' % (samples, self.bw_log.path))
+            self.bw_log = None
 
     # determine if test interval is over for this thread
 
@@ -230,6 +330,19 @@ class FsDriftWorkload:
     def gen_thread_ready_fname(self, tid, hostname=None):
         return join(self.tmp_dir, 'thread_ready.' + tid + '.tmp')
 
+    # each thread updates this while it is getting ready to reach the
+    # starting gate (--precreate-dirs), so that the host master waits for it
+
+    def gen_thread_progress_fname(self, tid):
+        return join(self.tmp_dir, 'thread_progress.' + tid + '.tmp')
+
+    def show_progress(self):
+        now = time.time()
+        if now - self.last_progress_time >= self.progress_interval:
+            self.last_progress_time = now
+            with open(self.gen_thread_progress_fname(self.tid), 'w') as f:
+                f.write('%f\n' % now)
+
     # log file for this worker thread goes here
 
     def log_fn(self):
@@ -253,6 +366,23 @@ class FsDriftWorkload:
     # also, wait 2 sec after seeing starting gate to maximize probability
     # that other hosts will also see it at the same time
 
+    # every thread on every host gets a distinct slot so that
+    # together they create each directory exactly once
+
+    def dir_partition(self):
+        hosts = self.params.host_set
+        if hosts == []:
+            hosts = [self.params.as_host]
+        try:
+            host_index = hosts.index(self.params.as_host)
+        except ValueError:
+            host_index = 0
+        try:
+            thread_index = int(self.tid)
+        except ValueError:
+            thread_index = 0
+        return (host_index * self.params.threads + thread_index, len(hosts) * self.params.threads)
+
     def wait_for_gate(self):
         if self.params.starting_gun_path:
             gateReady = self.gen_thread_ready_fname(self.tid)
@@ -325,8 +455,8 @@ class FsDriftWorkload:
         if self.abort:
             raise FsDriftException(
                 'thread ' + str(self.tid) + ' saw abort flag')
-        if self.pause_sec > 0.0:
-            time.sleep(self.pause_sec)
+        if self.pacer != None:
+            self.pacer.pause()
         return True
 
     def chk_status(self):
@@ -338,14 +468,33 @@ class FsDriftWorkload:
 
         self.start_log()
         self.params = read_pickle(self.params.param_pickle_path)
-        self.ctx = FSOPCtx(self.params, self.log, self.ctrs, self.onhost, self.tid)
+        if self.content_pool_name != None:
+            try:
+                self.content_pool = ContentPool.attach(self.content_pool_name)
+            except OSError as e:
+                self.log.warning('could not map shared content pool %s (%s), generating our own' %
+                                 (self.content_pool_name, os.strerror(e.errno)))
+        if self.telemetry_name != None:
+            try:
+                self.telemetry = LiveCounters.attach(self.telemetry_name)
+                self.live = self.telemetry.row(self.telemetry_row)
+                if self.telemetry.op_count > 0:
+                    self.live_op_buckets = [self.telemetry.op_buckets(k) for k in range(0, self.telemetry.op_count)]
+            except OSError as e:
+                self.log.warning('could not map live counters %s (%s), host will not show them' %
+                                 (self.telemetry_name, os.strerror(e.errno)))
+        self.ctx = FSOPCtx(self.params, self.log, self.ctrs, self.onhost, self.tid,
+                           content_pool=self.content_pool)
+        self.pacer = Pacer(self.params.pause_between_ops / MICROSEC_PER_SEC, self.ctrs)
+        if self.params.iodepth > 1:
+            self.engine = QueueDepthEngine(self.ctx, self.params.iodepth)
 
         # retrieve params from pickle file so that
         # remote workload generators can read them
 
         if self.params.stats_report_interval > 0:
             per_thread_ctr_fn = 'counters.%s.%s.json' % (self.tid, self.onhost)
-            counter_file_path = os.path.join(self.params.network_shared_path, per_thread_ctr_fn)
+            counter_file_path = self.bookkeeping_path(os.path.join(self.params.network_shared_path, per_thread_ctr_fn))
             self.counter_file = open(counter_file_path, 'w')
             self.counter_file.write('[')
 
@@ -357,12 +506,26 @@ class FsDriftWorkload:
         stop_file = self.params.stop_file_path
         weights = fs_drift.event.parse_weights(self.params)
         normalized_weights = fs_drift.event.normalize_weights(weights)
+        opcode_stream = self.ctx.decisions.opcodes(fs_drift.event.AliasTable(normalized_weights))
+
+        if self.params.precreate_dirs:
+            (slot, slots) = self.dir_partition()
+            self.last_progress_time = 0.0
+            self.ctx.precreate_dirs(slot, slots, progress=self.show_progress)
 
         self.wait_for_gate()
 
         self.start_time = time.time()
+        self.open_sample_logs()
         last_stat_time = self.start_time
         last_drift_time = self.start_time
+        next_publish_time = self.start_time
+
+        # with --target-rate, ops start on schedule (see open_loop.py)
+        schedule = None
+        if self.params.target_rate > 0.0:
+            schedule = ArrivalSchedule(per_thread_rate(self.params), self.params.arrivals,
+                                       self.ctx.decisions.uniform_stream, self.start_time)
 
         first_counters_written = False
         try:
@@ -393,22 +556,42 @@ class FsDriftWorkload:
                     self.log.debug('fs fullness = %f' % self.ctx.fs_fullness)
             event_count += 1
 
-            x = fs_drift.event.gen_event(normalized_weights)
+            x = next(opcode_stream)
             name = FSOPCtx.opcode_to_opname[x]
             if self.verbosity & 0x1:
                 self.log.debug('event %d name %s' % (x, name))
-            self.op_start_time = time.time()
+            if schedule != None:
+                self.op_start_time = schedule.wait()
+            else:
+                self.op_start_time = time.time()
+            if self.live != None and self.op_start_time >= next_publish_time:
+                self.publish_live_counters()
+                next_publish_time = self.op_start_time + counter_publish_secs
             rc = NOTOK
-            try:
-                rc = self.ctx.invoke_rq(x)
-            except FsDriftException as e:
-                self.log.exception(e)
-            except OSError as e:
-                self.log.exception(e)
-            time.sleep(self.params.pause_secs)
+            queued = self.engine != None and self.engine.is_data_path(x)
+            if queued:
+                # completion is accounted for when the engine reports it,
+                # block only when every lane is busy
+                self.engine.submit(x, name, self.op_start_time)
+                total_errors += self.complete_ops(self.engine.reap(block=self.engine.full()))
+                rc = OK
+            else:
+                # a remount closes the directory fds that queued ops use
+                if self.engine != None and x == rq.REMOUNT:
+                    total_errors += self.complete_ops(self.engine.drain())
+                try:
+                    rc = self.ctx.invoke_rq(x)
+                except FsDriftException as e:
+                    self.log.exception(e)
+                except OSError as e:
+                    self.log.exception(e)
+            if schedule == None:
+                self.pacer.pause()
             if rc != OK:
                 self.log.debug("%s returns %d" % (name, rc))
                 total_errors += 1
+            if self.live != None:
+                self.live[LIVE_ERRORS] = total_errors
 
             # periodically output counters
 
@@ -416,13 +599,20 @@ class FsDriftWorkload:
                     and (self.op_start_time - last_stat_time > self.params.stats_report_interval)):
                 if first_counters_written:
                     self.counter_file.write(',')
-                fs_drift.output_results.output_thread_counters(self.counter_file, self.start_time, total_errors, self.ctrs)
+                fs_drift.output_results.output_thread_counters(self.counter_file, self.start_time, total_errors,
+                                                               self.ctrs, schedule, self.interval_latencies)
+                self.latency_timeline.add(last_stat_time - self.start_time, self.interval_latencies)
+                self.latencies.merge(self.interval_latencies)
+                self.interval_latencies.reset()
                 first_counters_written = True
                 last_stat_time = self.op_start_time
 
             # record response time, must happen AFTER op_start_time referenced
 
-            self.op_endtime(name)
+            if queued:
+                self.op_start_time = None
+            else:
+                self.op_endtime(name)
 
             # if using moving gaussian file access pattern...
 
@@ -436,6 +626,10 @@ class FsDriftWorkload:
             if elapsed > self.params.duration:
                 break
 
+          if self.engine != None:
+            total_errors += self.complete_ops(self.engine.drain())
+          if schedule != None:
+            self.log.info('open-loop backlog at end of test %d ops' % schedule.backlog(time.time()))
           if total_errors > 0:
             self.log.error('total of %d unexpected errors seen' % total_errors)
             self.status = NOTOK
@@ -448,14 +642,25 @@ class FsDriftWorkload:
         except Exception as e:
             self.log.exception(e)
             self.status = -NOTOK
+        if self.engine != None:
+            self.engine.shutdown()
+        self.ctx.save_simulated_time()
         if self.counter_file != None:
             self.counter_file.write(']')
             self.counter_file.close()
+        if self.params.stats_report_interval > 0 and self.start_time > 0:
+            self.latency_timeline.add(last_stat_time - self.start_time, self.interval_latencies)
+        self.latencies.merge(self.interval_latencies)
+        self.interval_latencies.reset()
         self.end_test()
-        if self.params.response_times:
-            self.save_rsptimes()
-        if self.params.bw:
-            self.save_bw()
+        self.close_sample_logs()
+        if self.telemetry != None:
+            self.live[LIVE_ERRORS] = total_errors
+            self.publish_live_counters()
+            self.live.release()
+            self.live = None
+            self.telemetry.close()
+            self.telemetry = None
         if self.status != OK:
             self.log.error('invocation did not complete cleanly')
         self.log.info('worker_thread do_workload finished')
@@ -474,6 +679,9 @@ if __name__ == '__main__':
     from unit_test_module import get_unit_test_module
     unittest_module = get_unit_test_module()
     import opts
+    import numpy
+    import fs_drift.sample_log
+    from fs_drift.simtime import SimTimeState, state_path
 
     # threads used to do multi-threaded unit testing
 
@@ -565,4 +773,135 @@ if __name__ == '__main__':
                 t.worker.chk_status()
             print('total counters:')
             print(totals)
+
+        def test_c_precreate_dirs(self):
+            self.cleanup_files()
+            self.params.precreate_dirs = True
+            self.params.threads = 1
+            write_pickle(self.params.param_pickle_path, self.params)
+            fsd = FsDriftWorkload(self.params)
+            fsd.tid = '00'
+            assert(fsd.dir_partition() == (0, 1))
+            touch(fsd.params.starting_gun_path)
+            fsd.do_workload()
+            fsd.chk_status()
+            leaves = 0
+            for (dirpath, subdirs, files) in os.walk(self.params.top_directory):
+                if dirpath.count(os.sep) - self.params.top_directory.count(os.sep) == self.params.levels:
+                    leaves += 1
+            assert(leaves == self.params.subdirs_per_dir ** self.params.levels)
+            # the host master could see that directories were being created
+            assert(os.path.exists(fsd.gen_thread_progress_fname(fsd.tid)))
+            # creates never had to make a directory themselves
+            assert(fsd.ctrs.dirs_created == 0)
+            assert(fsd.ctrs.have_created > 0)
+
+        def test_d_open_loop(self):
+            self.cleanup_files()
+            self.params.target_rate = 200.0
+            self.params.arrivals = fs_drift.common.ArrivalDistr.fixed
+            self.params.response_times = True
+            write_pickle(self.params.param_pickle_path, self.params)
+            fsd = FsDriftWorkload(self.params)
+            fsd.tid = 'open_loop'
+            touch(fsd.params.starting_gun_path)
+            fsd.do_workload()
+            fsd.chk_status()
+            # ops start at the target rate, not as fast as they can
+            with open(self.params.rsptime_path % (fsd.onhost, fsd.tid), 'r') as f:
+                starts = [float(l.split(',')[0]) for l in f.readlines()]
+            ops = len(starts)
+            assert(0.8 * 200 * self.params.duration < ops < 1.1 * 200 * self.params.duration)
+            assert(all(abs((starts[k] - starts[0]) - k / 200.0) < 1.0e-5 for k in range(0, ops)))
+            counter_fn = os.path.join(self.params.network_shared_path,
+                                      'counters.%s.%s.json' % (fsd.tid, fsd.onhost))
+            with open(counter_fn, 'r') as f:
+                intervals = json.load(f)
+            assert('max-backlog' in intervals[0])
+            # interval histograms add up to the whole-run histograms,
+            # which count every op that has a response time
+            assert(len(fsd.latencies) == ops and len(fsd.interval_latencies) == 0)
+            merged = OpLatencies(self.params.latency_digits)
+            for interval in intervals:
+                merged.merge(OpLatencies.from_json_obj(interval['latency']))
+            assert(0 < len(merged) <= ops)
+            assert(set(merged.by_op.keys()) <= set(fsd.latencies.by_op.keys()))
+            # the timeline returned with the counters has them all,
+            # including the last partial interval
+            assert(len(fsd.latency_timeline) >= len(intervals) + 1)
+            timeline_ops = sum([s['latency'][opname]['ops'] for s in LatencyTimeline.merged_summaries(
+                    [fsd.latency_timeline]) for opname in s['latency']])
+            assert(timeline_ops == ops)
+
+        def test_e_binary_sample_logs(self):
+            self.cleanup_files()
+            self.params.response_times = True
+            self.params.bw = True
+            self.params.sample_log_format = fs_drift.common.SampleLogFormat.binary
+            self.params.derive_paths()
+            write_pickle(self.params.param_pickle_path, self.params)
+            fsd = FsDriftWorkload(self.params)
+            fsd.tid = 'binlog'
+            touch(fsd.params.starting_gun_path)
+            fsd.do_workload()
+            fsd.chk_status()
+            # every op is in the response time log
+            assert(fsd.rsptime_log == None and fsd.bw_log == None)
+            rsptime_fn = self.params.rsptime_path % (fsd.onhost, fsd.tid)
+            (header, records) = fs_drift.sample_log.read_samples(rsptime_fn)
+            assert(header['start-time'] == fsd.start_time)
+            assert(len(records) == len(fsd.latencies) > 0)
+            assert((numpy.diff(records['time']) >= 0.0).all())
+            # only ops that transferred data have bandwidth samples
+            (header, bw_records) = fs_drift.sample_log.read_samples(self.params.bw_path % (fsd.onhost, fsd.tid))
+            assert(header['kind'] == fs_drift.sample_log.BANDWIDTH)
+            assert(0 < len(bw_records) < len(records) and (bw_records['bytes'] > 0).all())
+            assert(records['bytes'].sum() == bw_records['bytes'].sum())
+
+        def test_f_sample_reservoir(self):
+            self.cleanup_files()
+            self.params.response_times = True
+            self.params.sample_reservoir = 100
+            write_pickle(self.params.param_pickle_path, self.params)
+            fsd = FsDriftWorkload(self.params)
+            fsd.tid = 'reservoir'
+            touch(fsd.params.starting_gun_path)
+            fsd.do_workload()
+            fsd.chk_status()
+            # a random sample of ops from the whole run, in time order
+            with open(self.params.rsptime_path % (fsd.onhost, fsd.tid), 'r') as f:
+                starts = [float(l.split(',')[0]) for l in f.readlines()]
+            assert(len(starts) == 100 < len(fsd.latencies))
+            assert(starts == sorted(starts) and starts[-1] > self.params.duration / 2)
+
+        def test_g_local_scratch_dir(self):
+            self.cleanup_files()
+            self.params.response_times = True
+            self.params.random_distribution = FileAccessDistr.gaussian
+            write_pickle(self.params.param_pickle_path, self.params)
+            scratch_dir = '/var/tmp/fsd-worker-scratch'
+            deltree(scratch_dir)
+            ensure_dir_exists(scratch_dir)
+            fsd = FsDriftWorkload(self.params)
+            fsd.tid = 'scratch'
+            fsd.scratch_dir = scratch_dir
+            touch(fsd.params.starting_gun_path)
+            fsd.do_workload()
+            fsd.chk_status()
+            # nothing the thread updates during the test is in the network shared dir
+            shared_path = self.params.rsptime_path % (fsd.onhost, fsd.tid)
+            assert(not os.path.exists(shared_path))
+            assert(not [fn for fn in os.listdir(self.params.network_shared_path)
+                        if fn.startswith('counters.') or fn.startswith('fs-drift-simtime')])
+            scratch_files = sorted(os.listdir(scratch_dir))
+            assert(os.path.basename(shared_path) in scratch_files)
+            assert('counters.%s.%s.json' % (fsd.tid, fsd.onhost) in scratch_files)
+            deltree(scratch_dir)
+            # gaussian simulated time is kept in a local state file for the next run
+            assert(not [fn for fn in scratch_files if fn.startswith('fs-drift-simtime')])
+            state = SimTimeState(state_path(self.params, fsd.onhost, fsd.tid))
+            assert(state.load() == (fsd.ctx.simulated_time, fsd.ctx.center, fsd.ctx.velocity))
+            assert(fsd.ctx.simulated_time > 0)
+            state.close()
+            os.unlink(state.path)
     unittest_module.main()